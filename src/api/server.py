@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import uuid
+import base64
+import signal
+import asyncio
+import logging
+import multiprocessing
+import click
+
+from aiohttp import web
+
+from api.sessions import SessionStore
+from model.llm_client import LLMOverloadedError
+from model.loader import AgentLoader
+from tools.metrics import METRICS
+from tools.utils import serialize_docs
+
+
+# Эндпоинты с вызовом агента, на которые действуют ограничения
+LIMITED_PATHS = {"/chat", "/chat/stream", "/image"}
+
+MAX_QUERY_LENGTH = 2000
+
+
+def json_error(error_class, message: str, **kwargs):
+    """HTTP-ошибка с телом в JSON
+    """
+    return error_class(
+        text=json.dumps({"error": message}, ensure_ascii=False),
+        content_type="application/json",
+        **kwargs
+        )
+
+
+def serialize_result(result: dict) -> dict:
+    """Результат агента в JSON, миниатюра изображения - в base64
+    """
+    data = dict(result)
+    if isinstance(data.get("output"), bytes):
+        data["image"] = base64.b64encode(data.pop("output")).decode()
+        data["output"] = None
+
+    return data
+
+
+def sse(event: dict) -> bytes:
+    """Событие агента в формате Server-Sent Events
+    """
+    data = dict(event)
+    name = data.pop("event")
+    if "docs" in data:
+        data["docs"] = serialize_docs(data["docs"])
+    if "result" in data:
+        data["result"] = serialize_result(data["result"])
+
+    return (
+        f"event: {name}\n"
+        f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    ).encode()
+
+
+class AgentAPI:
+    """HTTP API агента на aiohttp
+
+    Память сессий хранится во внешнем SessionStore, поэтому запросы
+    одной сессии может обслуживать любой воркер. Одновременно агент
+    обрабатывает не больше max_concurrency запросов, ещё max_queue
+    ожидают очереди, а остальные сразу получают 503 с Retry-After.
+    """
+    def __init__(self, loader, store: SessionStore,
+                 max_concurrency: int = 16, max_queue: int = 64,
+                 timeout: float = 120):
+        """Инициализация API
+
+        Args:
+            loader (AgentLoader): Фоновая загрузка агента
+            store (SessionStore): Хранилище памяти сессий
+            max_concurrency (int): Количество одновременных запросов
+                к агенту в воркере
+            max_queue (int): Количество запросов в очереди воркера
+            timeout (float): Максимальное время обработки запроса
+                в секундах
+        """
+        self.loader = loader
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.inflight = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.limit])
+        app.add_routes([
+            web.post("/chat", self.chat),
+            web.post("/chat/stream", self.chat_stream),
+            web.get("/image", self.image),
+            web.get("/health", self.health),
+            web.get("/metrics", self.metrics)
+        ])
+        app.cleanup_ctx.append(self.prune_sessions)
+
+        return app
+
+    def update_gauges(self):
+        METRICS.set("api_queue_size", self.waiting)
+        METRICS.set("api_inflight_requests", self.inflight)
+
+    @web.middleware
+    async def limit(self, request, handler):
+        """Ограничение одновременных запросов к агенту
+        """
+        if request.path not in LIMITED_PATHS:
+            return await handler(request)
+
+        if self.waiting >= self.max_queue:
+            METRICS.inc("api_rejected_total", path=request.path)
+            raise json_error(
+                web.HTTPServiceUnavailable, "Too many requests",
+                headers={"Retry-After": "1"}
+                )
+
+        start_time = time.perf_counter()
+        self.waiting += 1
+        self.update_gauges()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        status = 500
+        self.inflight += 1
+        try:
+            self.update_gauges()
+            response = await asyncio.wait_for(handler(request), self.timeout)
+            status = response.status
+            return response
+        except asyncio.TimeoutError:
+            status = 504
+            raise json_error(web.HTTPGatewayTimeout, "Request timed out")
+        except LLMOverloadedError:
+            status = 503
+            raise json_error(
+                web.HTTPServiceUnavailable, "LLM is overloaded",
+                headers={"Retry-After": "1"}
+                )
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            self.inflight -= 1
+            self.semaphore.release()
+            self.update_gauges()
+            METRICS.inc(
+                "api_requests_total", path=request.path, status=status
+                )
+            METRICS.observe(
+                "api_request_seconds", time.perf_counter() - start_time,
+                path=request.path
+                )
+
+    def agent(self):
+        """Загруженный агент или 503, пока идёт загрузка
+        """
+        if self.loader.state == "failed":
+            raise json_error(web.HTTPInternalServerError, "Agent failed")
+        if not self.loader.ready:
+            raise json_error(
+                web.HTTPServiceUnavailable, "Agent is loading",
+                headers={"Retry-After": "5"}
+                )
+
+        return self.loader.agent
+
+    async def parse_chat(self, request) -> tuple:
+        """Идентификатор сессии и запрос из тела запроса
+
+        Returns:
+            tuple: session_id (новый, если не передан) и запрос
+        """
+        try:
+            data = await request.json()
+        except ValueError:
+            raise json_error(web.HTTPBadRequest, "Invalid JSON")
+
+        query = data.get("query") if isinstance(data, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            raise json_error(web.HTTPBadRequest, "Field 'query' is required")
+        if len(query) > MAX_QUERY_LENGTH:
+            raise json_error(web.HTTPBadRequest, "Query is too long")
+
+        session_id = data.get("session_id") or uuid.uuid4().hex
+
+        return str(session_id), query.strip()
+
+    async def chat(self, request):
+        """POST /chat: ответ агента целиком
+        """
+        agent = self.agent()
+        session_id, query = await self.parse_chat(request)
+
+        loaded = await asyncio.to_thread(self.store.load, session_id)
+        memory = agent.new_memory(loaded)
+
+        result = await agent.ainvoke(query, memory)
+        await asyncio.to_thread(self.store.save, session_id, memory, loaded)
+
+        return web.json_response(
+            dict(serialize_result(result), session_id=session_id),
+            dumps=lambda data: json.dumps(data, ensure_ascii=False)
+            )
+
+    async def chat_stream(self, request):
+        """POST /chat/stream: события агента в формате Server-Sent Events
+        """
+        agent = self.agent()
+        session_id, query = await self.parse_chat(request)
+
+        loaded = await asyncio.to_thread(self.store.load, session_id)
+        memory = agent.new_memory(loaded)
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Session-Id": session_id
+        })
+        await response.prepare(request)
+
+        async for event in agent.astream(query, memory):
+            if event["event"] == "end":
+                event["result"] = dict(event["result"], session_id=session_id)
+            await response.write(sse(event))
+
+        await asyncio.to_thread(self.store.save, session_id, memory, loaded)
+        await response.write_eof()
+
+        return response
+
+    async def image(self, request):
+        """GET /image?query=...: миниатюра изображения блюда в JPEG
+        """
+        agent = self.agent()
+        query = request.query.get("query", "").strip()
+        if not query:
+            raise json_error(
+                web.HTTPBadRequest, "Parameter 'query' is required"
+                )
+
+        result = await agent.image_search.asearch({"query": query})
+        if result["output"] is None:
+            raise json_error(web.HTTPNotFound, "Image not found")
+
+        return web.Response(
+            body=result["output"],
+            content_type="image/jpeg",
+            headers={"X-Source-Url": result["url"] or ""}
+            )
+
+    async def health(self, request):
+        """GET /health: состояние загрузки агента, 503 до готовности
+        """
+        status = self.loader.status()
+
+        return web.json_response(
+            status, status=200 if self.loader.ready else 503
+            )
+
+    async def metrics(self, request):
+        """GET /metrics: метрики воркера в формате Prometheus
+        """
+        return web.Response(
+            text=METRICS.render(), content_type="text/plain",
+            headers={"X-Worker-Pid": str(os.getpid())}
+            )
+
+    async def prune_sessions(self, app):
+        """Периодическое удаление неактивных сессий
+        """
+        async def prune():
+            while True:
+                try:
+                    removed = await asyncio.to_thread(self.store.prune)
+                    if removed:
+                        logging.info(f"Pruned {removed} session messages")
+                except Exception as e:
+                    logging.warning(f"Session prune failed: {e!r}")
+                await asyncio.sleep(3600)
+
+        task = asyncio.create_task(prune())
+        yield
+        task.cancel()
+
+
+def serve(host: str, port: int, sessions_path: str, index_path: str,
+          cache_path: str, max_concurrency: int, max_queue: int,
+          timeout: float, trace_log: str, llm_concurrency: int,
+          hedge_after: float, intent_threshold: float,
+          intent_margin: float, reuse_port: bool):
+    """Запуск одного воркера API
+    """
+    loader = AgentLoader(
+        index_path=index_path, cache_path=cache_path, trace_log=trace_log,
+        llm_concurrency=llm_concurrency, hedge_after=hedge_after,
+        intent_threshold=intent_threshold, intent_margin=intent_margin
+        ).start()
+    api = AgentAPI(
+        loader=loader,
+        store=SessionStore(sessions_path),
+        max_concurrency=max_concurrency,
+        max_queue=max_queue,
+        timeout=timeout
+    )
+
+    web.run_app(
+        api.create_app(), host=host, port=port,
+        reuse_port=reuse_port, print=None
+        )
+
+
+@click.command()
+@click.option('--host', default="0.0.0.0", show_default=True)
+@click.option('--port', default=8080, show_default=True)
+@click.option('--workers', default=2, show_default=True,
+              help="Количество процессов на одном порту (SO_REUSEPORT)")
+@click.option('--sessions', 'sessions_path', default="data/sessions.sqlite",
+              show_default=True, help="SQLite-хранилище памяти сессий")
+@click.option('--index-path', default="data/processed/food_faiss_index",
+              show_default=True, help="Директория индекса FAISS")
+@click.option('--cache-path', default="data/cache", show_default=True,
+              help="Директория кэша артефактов и изображений")
+@click.option('--max-concurrency', default=16, show_default=True,
+              help="Одновременных запросов к агенту на воркер")
+@click.option('--max-queue', default=64, show_default=True,
+              help="Запросов в очереди воркера, сверх - 503")
+@click.option('--timeout', default=120.0, show_default=True,
+              help="Максимальное время обработки запроса в секундах")
+@click.option('--trace-log', default=None,
+              help="Файл лога этапов запросов в JSON Lines, - для stderr")
+@click.option('--llm-concurrency', default=8, show_default=True,
+              help="Одновременных вызовов LLM на воркер")
+@click.option('--hedge-after', default=None, type=float,
+              help="Дублирующий запрос к LLM после задержки в секундах")
+@click.option('--intent-threshold', default=0.75, show_default=True,
+              help="Близость к центроиду для локальной классификации")
+@click.option('--intent-margin', default=0.05, show_default=True,
+              help="Отрыв лучшего класса для локальной классификации")
+def main(host, port, workers, sessions_path, index_path, cache_path,
+         max_concurrency, max_queue, timeout, trace_log, llm_concurrency,
+         hedge_after, intent_threshold, intent_margin):
+    """HTTP API агента с несколькими воркерами
+
+    Каждый воркер загружает агента сам, индекс FAISS и хранилище
+    рецептов открываются через mmap и разделяются между процессами
+    через page cache.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    kwargs = dict(
+        host=host, port=port, sessions_path=sessions_path,
+        index_path=index_path, cache_path=cache_path,
+        max_concurrency=max_concurrency, max_queue=max_queue,
+        timeout=timeout, trace_log=trace_log,
+        llm_concurrency=llm_concurrency, hedge_after=hedge_after,
+        intent_threshold=intent_threshold, intent_margin=intent_margin,
+        reuse_port=workers > 1
+    )
+    if workers == 1:
+        serve(**kwargs)
+        return
+
+    # Схема создаётся до запуска воркеров
+    SessionStore(sessions_path)
+
+    processes = [
+        multiprocessing.Process(
+            target=serve, kwargs=kwargs, name=f"api-worker-{i}"
+            )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import time
+import sqlite3
+import logging
+import threading
+
+from functools import partial
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+ROLES = {"human": HumanMessage, "ai": AIMessage}
+
+
+class SessionStore:
+    """Память сессий чата в SQLite, общая для всех воркеров API
+
+    Сообщения хранятся построчно, поэтому одновременные запросы одной
+    сессии в разных процессах дописывают свои ходы, не перезаписывая
+    чужие. Для каждой сессии хранятся только последние k сообщений.
+    """
+    def __init__(self, path: str, k: int = 6, ttl: float = 7 * 24 * 3600):
+        """Инициализация хранилища
+
+        Args:
+            path (str): Путь к файлу SQLite
+            k (int): Количество последних сообщений сессии
+            ttl (float): Время жизни неактивной сессии в секундах
+        """
+        self.path = path
+        self.k = k
+        self.ttl = ttl
+        self._local = threading.local()
+
+        # WAL позволяет читать во время записи другого процесса
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session
+                ON messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS messages_created
+                ON messages (created_at);"""
+        )
+        self.connection.commit()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Отдельное соединение на каждый поток
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+
+        return connection
+
+    def load(self, session_id: str) -> list:
+        """История чата сессии
+
+        Args:
+            session_id (str): Идентификатор сессии
+
+        Returns:
+            list: Последние k сообщений сессии
+        """
+        rows = self.connection.execute(
+            "SELECT role, content FROM messages WHERE session_id = ? "
+            "ORDER BY id DESC LIMIT ?",
+            (session_id, self.k)
+        ).fetchall()
+
+        return [ROLES[role](content=content) for role, content in rows[::-1]]
+
+    def append(self, session_id: str, messages: list) -> list:
+        """Добавление сообщений в конец истории сессии
+
+        Args:
+            session_id (str): Идентификатор сессии
+            messages (list): Новые сообщения
+
+        Returns:
+            list: id записей сообщений
+        """
+        now = time.time()
+        with self.connection as connection:
+            ids = [
+                connection.execute(
+                    "INSERT INTO messages "
+                    "(session_id, role, content, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (session_id, message.type, message.content, now)
+                ).lastrowid
+                for message in messages
+            ]
+            connection.execute(
+                "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                "(SELECT id FROM messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, self.k)
+            )
+
+        return ids
+
+    def update(self, message_id: int, content: str):
+        with self.connection as connection:
+            connection.execute(
+                "UPDATE messages SET content = ? WHERE id = ?",
+                (content, message_id)
+            )
+
+    def save(self, session_id: str, memory, loaded: list):
+        """Сохранение нового хода диалога из памяти агента
+
+        Ответ сохраняется с временной записью, а резюме ответа
+        подставляется в хранилище, когда фоновая задача завершится.
+
+        Args:
+            session_id (str): Идентификатор сессии
+            memory (ChatMemory): Память после вызова агента
+            loaded (list): Сообщения, загруженные из хранилища
+        """
+        new = [
+            message for message in memory.messages
+            if not any(message is old for old in loaded)
+        ]
+        ids = self.append(session_id, new)
+
+        for future, message in memory.pending:
+            for message_id, saved in zip(ids, new):
+                if saved is message:
+                    future.add_done_callback(
+                        partial(self.summary_done, message_id)
+                        )
+
+    def summary_done(self, message_id: int, future):
+        if future.exception() is not None:
+            return
+
+        try:
+            self.update(message_id, f"Answer: {future.result()}")
+        except sqlite3.Error as e:
+            logging.warning(f"Session summary update failed: {e!r}")
+
+    def prune(self) -> int:
+        """Удаление сессий без активности дольше ttl
+
+        Returns:
+            int: Количество удалённых сообщений
+        """
+        with self.connection as connection:
+            return connection.execute(
+                "DELETE FROM messages WHERE session_id IN ("
+                "SELECT session_id FROM messages GROUP BY session_id "
+                "HAVING MAX(created_at) < ?)",
+                (time.time() - self.ttl,)
+            ).rowcount
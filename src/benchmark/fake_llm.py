@@ -0,0 +1,137 @@
+import re
+import time
+import asyncio
+import itertools
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from pydantic import PrivateAttr
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    ChatResult
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """Детерминированная LLM для бенчмарка агента без внешнего API
+
+    Тип запроса определяется по маркеру в конце промпта: классификатор
+    возвращает класс из classifications, переписывание запроса -
+    filter_query, резюме для памяти - summary, остальные промпты -
+    answer. Задержка до первого токена и на каждый токен задаются
+    latency и token_latency, а каждый slow_every-й вызов отвечает
+    с задержкой slow_latency (хвост латентности провайдера).
+    """
+    latency: float = 0.0
+    token_latency: float = 0.0
+    slow_every: int = 0
+    slow_latency: float = 0.0
+    classifications: dict = {}
+    filter_query: str = "курица рис"
+    summary: str = "Рекомендовал блюдо"
+    answer: str = (
+        "**Плов с курицей**. Ингредиенты: курица, рис, морковь, лук. "
+        "Обжарьте курицу с овощами, добавьте рис и воду, "
+        "тушите под крышкой 30 минут."
+        )
+
+    _calls = PrivateAttr(default_factory=itertools.count)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def first_latency(self) -> float:
+        """Задержка до первого токена очередного вызова
+        """
+        call = next(self._calls) + 1
+        if self.slow_every and call % self.slow_every == 0:
+            return self.slow_latency
+
+        return self.latency
+
+    def respond(self, messages: list) -> str:
+        prompt = messages[-1].content.rstrip()
+
+        if prompt.endswith("Classification:"):
+            question = re.search(
+                r"<question>\s*(.*?)\s*</question>", prompt, re.DOTALL
+                )
+            return self.classifications.get(
+                question.group(1) if question else "", "other"
+                )
+        elif prompt.endswith("Summary query:"):
+            return self.filter_query
+        elif prompt.endswith("Summary:"):
+            return self.summary
+
+        return self.answer
+
+    @staticmethod
+    def tokens(text: str) -> list:
+        return re.findall(r"\S+\s*", text)
+
+    def usage(self, messages: list, text: str) -> dict:
+        """Количество токенов как у провайдеров с usage_metadata
+        """
+        prompt_tokens = sum(
+            len(self.tokens(message.content)) for message in messages
+        )
+        completion_tokens = len(self.tokens(text))
+
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def result(self, messages: list, text: str) -> ChatResult:
+        message = AIMessage(
+            content=text, usage_metadata=self.usage(messages, text)
+            )
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def chunks(self, messages: list):
+        text = self.respond(messages)
+        tokens = self.tokens(text)
+        for i, token in enumerate(tokens):
+            # Количество токенов приходит в последнем фрагменте
+            usage = self.usage(messages, text) \
+                if i == len(tokens) - 1 else None
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content=token, usage_metadata=usage)
+                )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.respond(messages)
+        time.sleep(
+            self.first_latency()
+            + self.token_latency * len(self.tokens(text))
+            )
+
+        return self.result(messages, text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None,
+                         **kwargs):
+        text = self.respond(messages)
+        await asyncio.sleep(
+            self.first_latency()
+            + self.token_latency * len(self.tokens(text))
+            )
+
+        return self.result(messages, text)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_latency())
+        for chunk in self.chunks(messages):
+            time.sleep(self.token_latency)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None,
+                       **kwargs):
+        await asyncio.sleep(self.first_latency())
+        for chunk in self.chunks(messages):
+            await asyncio.sleep(self.token_latency)
+            yield chunk
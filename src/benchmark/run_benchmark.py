@@ -0,0 +1,392 @@
+import os
+import csv
+import json
+import time
+import random
+import asyncio
+import platform
+import click
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from PIL import Image
+
+from benchmark.fake_llm import FakeChatModel
+from data import make_index
+from data.pipeline import EmbeddingPipeline
+from model.agent import AgentSystem
+from model.intent import IntentClassifier
+from model.llm_client import LLMClient
+from tools.cache import SemanticCache
+from tools.images import ImageSearch, StubImageBackend
+from tools.metrics import METRICS
+from tools.retriever import load_retriever
+from tools.utils import clean_input
+
+
+ROUTES = {
+    "About Me": ("about me", [
+        "Привет!",
+        "Что ты умеешь?",
+        "Расскажи о своих функциях"
+    ]),
+    "Recommend": ("recommended", [
+        "Посоветуй блюдо с курицей и рисом",
+        "Что приготовить из тыквы и сливок?",
+        "Хочу суп с грибами на ужин",
+        "Порекомендуй итальянскую пасту до 30 минут"
+    ]),
+    "Generate": ("generate", [
+        "Придумай новое блюдо из лосося и авокадо",
+        "Создай необычный десерт с малиной",
+        "Придумай салат из того, что есть: огурцы, яйца, сыр"
+    ]),
+    "Search Image": ("image food", [
+        "Покажи фото борща",
+        "Найди картинку пиццы маргарита",
+        "Как выглядит плов?"
+    ])
+}
+
+MODES = ["invoke", "ainvoke", "stream", "astream"]
+
+
+def sample_csv(csv_path: str, output_path: str, n_rows: int, seed: int):
+    """Случайная выборка строк CSV для фикстуры индекса
+    """
+    with open(csv_path, encoding="utf-8", newline="") as file:
+        reader = csv.DictReader(file)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    rows = random.Random(seed).sample(rows, min(n_rows, len(rows)))
+
+    with open(output_path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def build_fixture(csv_path, fixture_dir, hf_model, n_rows, seed):
+    """Фикстура: индекс по выборке рецептов и локальные изображения
+
+    Returns:
+        tuple: Директория индекса и директория изображений
+    """
+    path_index = os.path.join(fixture_dir, "index")
+    images_dir = os.path.join(fixture_dir, "images")
+    sample_path = os.path.join(fixture_dir, f"sample-{n_rows}-{seed}.csv")
+
+    os.makedirs(images_dir, exist_ok=True)
+    if not os.path.exists(sample_path):
+        sample_csv(csv_path, sample_path, n_rows, seed)
+
+    # Сборка инкрементальная, готовый индекс не пересобирается
+    make_index.main.main(
+        [sample_path, path_index, hf_model, "--eval-queries", "0"],
+        standalone_mode=False
+        )
+
+    for i, color in enumerate([(200, 120, 40), (90, 160, 60)]):
+        path = os.path.join(images_dir, f"dish-{i}.jpg")
+        if not os.path.exists(path):
+            Image.new("RGB", (1600, 1200), color).save(path)
+
+    return path_index, images_dir
+
+
+def workload(n_sessions: int, requests_per_session: int, seed: int):
+    """Запросы каждой сессии по всем маршрутам
+
+    Returns:
+        list: Для каждой сессии список пар (маршрут, запрос)
+    """
+    queries = [
+        (route, query)
+        for route, (_, route_queries) in ROUTES.items()
+        for query in route_queries
+    ]
+    rng = random.Random(seed)
+
+    return [
+        [rng.choice(queries) for _ in range(requests_per_session)]
+        for _ in range(n_sessions)
+    ]
+
+
+def run_request(agent, mode, query, memory):
+    """Один запрос к агенту
+
+    Returns:
+        tuple: Задача из результата, задержка и время до первого
+            фрагмента ответа в секундах
+    """
+    start_time = time.perf_counter()
+    first_token = None
+
+    if mode == "invoke":
+        result = agent.invoke(query, memory)
+    else:
+        for event in agent.stream(query, memory):
+            if event["event"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start_time
+            result = event.get("result")
+
+    return result["task"], time.perf_counter() - start_time, first_token
+
+
+async def arun_request(agent, mode, query, memory):
+    start_time = time.perf_counter()
+    first_token = None
+
+    if mode == "ainvoke":
+        result = await agent.ainvoke(query, memory)
+    else:
+        async for event in agent.astream(query, memory):
+            if event["event"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start_time
+            result = event.get("result")
+
+    return result["task"], time.perf_counter() - start_time, first_token
+
+
+def run_sessions(agent, mode, sessions):
+    """Параллельные сессии, внутри сессии запросы идут по очереди
+
+    Returns:
+        list: Словари с маршрутом, задачей и временами каждого запроса
+    """
+    def record(route, measured):
+        task, latency, first_token = measured
+        return {
+            "route": route,
+            "task": task,
+            "latency": latency,
+            "ttft": first_token
+        }
+
+    if mode in ("invoke", "stream"):
+        def session(requests):
+            memory = agent.new_memory()
+            return [
+                record(route, run_request(agent, mode, query, memory))
+                for route, query in requests
+            ]
+
+        with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            results = list(executor.map(session, sessions))
+    else:
+        async def asession(requests):
+            memory = agent.new_memory()
+            return [
+                record(route, await arun_request(agent, mode, query, memory))
+                for route, query in requests
+            ]
+
+        async def gather():
+            return await asyncio.gather(*map(asession, sessions))
+
+        results = asyncio.run(gather())
+
+    return [item for session_results in results for item in session_results]
+
+
+def percentiles(values: list) -> dict:
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if not len(values):
+        return {}
+
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99))
+    }
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    """Перцентили задержки по маршрутам и пропускная способность
+    """
+    routes = {}
+    for route in ROUTES:
+        route_records = [r for r in records if r["route"] == route]
+        if not route_records:
+            continue
+        routes[route] = {
+            "latency": percentiles([r["latency"] for r in route_records]),
+            "ttft": percentiles([
+                r["ttft"] for r in route_records if r["ttft"] is not None
+            ]),
+            "misrouted": sum(r["task"] != route for r in route_records)
+        }
+
+    return {
+        "routes": routes,
+        "overall": percentiles([r["latency"] for r in records]),
+        "requests": len(records),
+        "elapsed_sec": elapsed,
+        "throughput_rps": len(records) / elapsed if elapsed else 0.0
+    }
+
+
+def stage_summary() -> dict:
+    """Средняя длительность этапов агента, токены и счётчики
+    LLMClient из метрик
+    """
+    stages = {}
+    for (name, labels), histogram in METRICS.histograms.items():
+        if name == "agent_stage_seconds" and histogram["count"]:
+            stages[dict(labels)["stage"]] = {
+                "count": histogram["count"],
+                "mean_ms": histogram["sum"] / histogram["count"] * 1000
+            }
+
+    tokens = {}
+    llm = {}
+    for (name, labels), value in METRICS.counters.items():
+        if name == "agent_llm_tokens_total":
+            labels = dict(labels)
+            tokens.setdefault(labels["stage"], {})[labels["type"]] = value
+        elif name.startswith("llm_"):
+            llm[name] = llm.get(name, 0) + value
+
+    return {"stages": stages, "tokens": tokens, "llm": llm}
+
+
+def print_report(mode: str, summary: dict):
+    click.echo(f"\n{mode}: {summary['requests']} requests, "
+               f"{summary['throughput_rps']:.2f} req/sec")
+    click.echo(f"{'route':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+               f"{'ttft p50':>9}")
+    for route, stats in summary["routes"].items():
+        latency = stats["latency"]
+        ttft = stats["ttft"].get("p50_ms")
+        click.echo(
+            f"{route:>14} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} "
+            f"{latency['p99_ms']:>9.1f} "
+            f"{'-' if ttft is None else f'{ttft:.1f}':>9}"
+            )
+
+
+@click.command()
+@click.argument('csv_path', default="data/raw/food-dataset-ru.csv")
+@click.argument('output', default="reports/benchmark.json")
+@click.option('--hf-model', default="sergeyzh/LaBSE-ru-turbo",
+              show_default=True, help="Модель эмбеддингов")
+@click.option('--fixture-dir', default="data/interim/benchmark",
+              show_default=True, help="Директория фикстуры индекса")
+@click.option('--fixture-rows', default=2000, show_default=True,
+              help="Количество рецептов в фикстуре индекса")
+@click.option('--mode', 'modes', type=click.Choice(MODES), multiple=True,
+              help="Способ вызова агента (по умолчанию все)")
+@click.option('--sessions', default=8, show_default=True,
+              help="Количество одновременных сессий")
+@click.option('--requests', 'requests_per_session', default=20,
+              show_default=True, help="Количество запросов в сессии")
+@click.option('--latency', default=0.3, show_default=True,
+              help="Задержка LLM до первого токена в секундах")
+@click.option('--token-latency', default=0.01, show_default=True,
+              help="Задержка LLM на токен в секундах")
+@click.option('--slow-every', default=0, show_default=True,
+              help="Каждый N-й вызов LLM отвечает медленно, 0 - никогда")
+@click.option('--slow-latency', default=2.0, show_default=True,
+              help="Задержка медленного вызова LLM в секундах")
+@click.option('--llm-concurrency', default=None, type=int,
+              help="Вызовы LLM через LLMClient с этим лимитом")
+@click.option('--hedge-after', default=None, type=float,
+              help="Дублирующий запрос LLMClient после задержки")
+@click.option('--local-intent', is_flag=True,
+              help="Локальный классификатор намерений перед LLM")
+@click.option('--response-cache', is_flag=True,
+              help="Семантический кэш ответов")
+@click.option('--seed', default=0, show_default=True)
+def main(csv_path, output, hf_model, fixture_dir, fixture_rows, modes,
+         sessions, requests_per_session, latency, token_latency,
+         slow_every, slow_latency, llm_concurrency, hedge_after,
+         local_intent, response_cache, seed):
+    path_index, images_dir = build_fixture(
+        csv_path, fixture_dir, hf_model, fixture_rows, seed
+        )
+
+    embeddings = EmbeddingPipeline(hf_model)
+    llm = FakeChatModel(
+        latency=latency,
+        token_latency=token_latency,
+        slow_every=slow_every,
+        slow_latency=slow_latency,
+        classifications={
+            clean_input(query): label
+            for label, queries in ROUTES.values()
+            for query in queries
+        }
+    )
+    if llm_concurrency or hedge_after is not None:
+        llm = LLMClient(
+            llm=llm,
+            max_concurrency=llm_concurrency or 8,
+            hedge_after=hedge_after
+        )
+
+    report = {
+        "config": {
+            "fixture_rows": fixture_rows,
+            "sessions": sessions,
+            "requests_per_session": requests_per_session,
+            "latency": latency,
+            "token_latency": token_latency,
+            "slow_every": slow_every,
+            "slow_latency": slow_latency,
+            "llm_concurrency": llm_concurrency,
+            "hedge_after": hedge_after,
+            "local_intent": local_intent,
+            "response_cache": response_cache,
+            "hf_model": hf_model,
+            "seed": seed
+        },
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "modes": {}
+    }
+
+    for mode in modes or MODES:
+        # Новый агент на каждый режим, чтобы кэши не переходили
+        agent = AgentSystem(
+            llm=llm,
+            retriever=load_retriever(path_index, embeddings, k=3),
+            intent_classifier=IntentClassifier(embeddings=embeddings)
+            if local_intent else None,
+            response_cache=SemanticCache(embeddings=embeddings)
+            if response_cache else None,
+            image_search=ImageSearch(backend=StubImageBackend(images_dir))
+        )
+
+        # Прогрев по одному запросу каждого маршрута
+        run_sessions(agent, mode, [[
+            (route, queries[0]) for route, (_, queries) in ROUTES.items()
+        ]])
+
+        METRICS.clear()
+        start_time = time.perf_counter()
+        records = run_sessions(
+            agent, mode, workload(sessions, requests_per_session, seed)
+            )
+        summary = summarize(records, time.perf_counter() - start_time)
+        # Фоновые резюме для памяти завершаются до снимка метрик
+        agent.summary_executor.shutdown(wait=True)
+        summary.update(stage_summary())
+
+        print_report(mode, summary)
+        report["modes"][mode] = summary
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+    click.echo(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,43 @@
+import os
+import json
+import time
 import click
+import functools
 
-from tqdm import tqdm
+import faiss
+import numpy as np
 
 from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+
+from data.pipeline import EmbeddingPipeline
+from data.recall import recall_at_k
+from data.manifest import (
+    IndexManifest,
+    EmbeddingCheckpoint,
+    content_hash,
+    document_keys
+)
+from tools.faiss_index import (
+    INDEX_FILE,
+    INDEX_TYPES,
+    build_index,
+    default_nlist,
+    index_factory_string,
+    load_index_config,
+    reconstruct_vectors,
+    save_index_config,
+    supports_remove,
+    write_index
+)
+from tools.dedup import GROUPS_FILE, MinHashLSH, recipe_tokens
+from tools.lexical import tokenize_ingredients
+from tools.metadata_filter import (
+    COLUMNS_DIR,
+    MetadataColumns,
+    build_columns,
+    save_columns
+)
+from tools.recipe_store import RecipeStore, store_path
 
 
 CONTENT_COLUMNS = [
@@ -28,11 +61,261 @@ METADATA_COLUMNS = [
 ]
 
 
+def embed_pending(make_embeddings, documents, hashes, checkpoint,
+                  reused=None):
+    """Эмбеддинги документов с продолжением из чекпоинта
+
+    Args:
+        make_embeddings: Создание пайплайна эмбеддингов, модель
+            загружается, только если есть документы без эмбеддинга
+        documents (list): Пары (ключ, документ) для эмбеддинга
+        hashes (dict): Ключ документа -> хэш содержимого
+        checkpoint: Чекпоинт прерванной сборки
+        reused (dict): Ключ документа -> (хэш содержимого, эмбеддинг)
+            из существующего индекса
+
+    Returns:
+        np.ndarray: Эмбеддинги документов в исходном порядке
+    """
+    done = dict(checkpoint.load(), **(reused or {}))
+
+    vectors = [None] * len(documents)
+    todo = []
+    for i, (key, _) in enumerate(documents):
+        saved = done.get(key)
+        if saved and saved[0] == hashes[key]:
+            vectors[i] = saved[1]
+        else:
+            todo.append(i)
+
+    if len(todo) < len(documents):
+        click.echo(f"Reused {len(documents) - len(todo)} embeddings "
+                   "from existing index and checkpoint")
+
+    texts = [documents[i][1].page_content for i in todo]
+    if not texts:
+        return np.asarray(vectors, dtype=np.float32)
+
+    with make_embeddings() as embeddings:
+        start_time = time.perf_counter()
+        for offset, chunk in embeddings.iter_embeddings(texts):
+            chunk_ids = todo[offset:offset + len(chunk)]
+            chunk_keys = [documents[i][0] for i in chunk_ids]
+
+            # Каждая посчитанная часть сразу сохраняется в чекпоинт
+            checkpoint.append(
+                keys=chunk_keys,
+                hashes=[hashes[key] for key in chunk_keys],
+                vectors=chunk
+            )
+            for i, vector in zip(chunk_ids, chunk):
+                vectors[i] = vector
+
+    elapsed = time.perf_counter() - start_time
+    if elapsed > 0:
+        click.echo(f"Embedded {len(texts)} documents: "
+                   f"{len(texts) / elapsed:.1f} docs/sec")
+
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def reusable_vectors(index, store, manifest, hashes):
+    """Эмбеддинги неизменённых строк из существующего индекса
+
+    Args:
+        index (faiss.Index): Существующий индекс
+        store (RecipeStore): Хранилище рецептов
+        manifest (IndexManifest): Манифест существующего индекса
+        hashes (dict): Ключ документа -> хэш содержимого
+
+    Returns:
+        dict: Ключ документа -> (хэш содержимого, эмбеддинг),
+            пустой, если индекс хранит векторы с потерями
+    """
+    unchanged = [
+        key for key, value in manifest.documents.items()
+        if hashes.get(key) == value
+    ]
+    key_ids = store.key_ids(unchanged)
+    keys = [key for key in unchanged if key in key_ids]
+
+    vectors = reconstruct_vectors(index, [key_ids[key] for key in keys])
+    if vectors is None:
+        return {}
+
+    return {key: (hashes[key], vector) for key, vector in zip(keys, vectors)}
+
+
+def load_existing(path_index, hf_model, index_type, store, hashes):
+    """Загрузка существующего индекса для инкрементальной сборки
+
+    Если индекс нужно пересобрать (сменился тип индекса или индекс
+    не поддерживает удаление изменённых строк), эмбеддинги
+    неизменённых строк берутся из него, а не считаются заново.
+
+    Args:
+        path_index (str): Директория индекса
+        hf_model (str): Название модели HuggingFace
+        index_type (str): Тип индекса FAISS
+        store (RecipeStore): Хранилище рецептов
+        hashes (dict): Ключ документа -> хэш содержимого
+
+    Returns:
+        tuple: Индекс FAISS (или None для пересборки), ключи документов
+            для эмбеддинга, ключи удалённых из индекса документов
+            и эмбеддинги для повторного использования
+    """
+    manifest = IndexManifest.load(path_index)
+
+    if (manifest is None or manifest.model_name != hf_model
+            or not os.path.exists(os.path.join(path_index, INDEX_FILE))):
+        return None, list(hashes), [], {}
+
+    index = faiss.read_index(os.path.join(path_index, INDEX_FILE))
+
+    # Изменённые строки удаляются и добавляются заново
+    stale, pending = manifest.diff(hashes)
+
+    reason = None
+    if load_index_config(path_index)["index_type"] != index_type:
+        reason = "index type changed"
+    elif not store.has_lexical_index():
+        reason = "lexical index is missing"
+    elif stale and not supports_remove(index):
+        reason = f"{index_type} index does not support removal"
+
+    if reason is not None:
+        reused = reusable_vectors(index, store, manifest, hashes)
+        click.echo(f"Rebuilding: {reason}, reusing {len(reused)} "
+                   f"of {len(hashes)} embeddings")
+        return None, list(hashes), [], reused
+
+    if stale:
+        stale_ids = store.ids_for_keys(stale)
+        index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+        store.delete(stale_ids)
+
+    removed = [key for key in stale if key not in hashes]
+    click.echo(f"Incremental build: {len(pending)} new or changed, "
+               f"{len(removed)} removed")
+
+    return index, pending, stale, {}
+
+
+def report_recall(index, vectors, ids, path_index, k, n_queries):
+    """Отчёт recall@k приближённого индекса относительно плоского
+
+    Args:
+        index (faiss.Index): Индекс со всеми векторами корпуса
+        vectors (np.ndarray): Эмбеддинги корпуса
+        ids (np.ndarray): id векторов в индексе
+        path_index (str): Директория индекса для сохранения отчёта
+        k (int): Количество документов в выдаче
+        n_queries (int): Количество запросов
+    """
+    report = recall_at_k(index, vectors, ids, k=k, n_queries=n_queries)
+
+    click.echo(f"{'param':>10} {'value':>6} {'recall@' + str(k):>9} "
+               f"{'ms/query':>9}")
+    for row in report:
+        click.echo(f"{str(row['param']):>10} {str(row['value']):>6} "
+                   f"{row[f'recall@{k}']:>9.4f} {row['ms_per_query']:>9.4f}")
+
+    with open(os.path.join(path_index, "recall_report.json"), "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def write_columns(path_index, store, dedup_threshold=0.7):
+    """Колонки метаданных для фильтрации и группы почти дубликатов
+    по всем рецептам хранилища
+
+    Порог групп сохраняется в конфигурацию индекса, а без поиска
+    дубликатов старые группы удаляются.
+
+    Args:
+        path_index (str): Директория индекса
+        store (RecipeStore): Хранилище рецептов
+        dedup_threshold (float): Минимальный коэффициент Жаккара
+            ингредиентов и названия дубликатов, 0 - без поиска
+    """
+    records = list(store.iter_metadata())
+    arrays, vocab = build_columns(records)
+
+    if dedup_threshold > 0:
+        start_time = time.perf_counter()
+        arrays["group"], duplicates = MinHashLSH(dedup_threshold).groups(
+            [doc_id for doc_id, _ in records],
+            [recipe_tokens(metadata) for _, metadata in records]
+            )
+        n_groups = len(np.unique(arrays["group"][arrays["group"] >= 0]))
+        click.echo(f"Near-duplicates: {duplicates} recipes in "
+                   f"{duplicates - len(records) + n_groups} groups "
+                   f"({time.perf_counter() - start_time:.1f}s)")
+    else:
+        groups_path = os.path.join(path_index, COLUMNS_DIR, GROUPS_FILE)
+        if os.path.exists(groups_path):
+            os.remove(groups_path)
+    save_columns(path_index, arrays, vocab)
+
+    config = load_index_config(path_index)
+    config["dedup_threshold"] = dedup_threshold
+    save_index_config(path_index, config)
+
+    parsed = {
+        field: int((~np.isnan(arrays[field])).sum())
+        for field in ["time", "kcal"]
+    }
+    click.echo(f"Metadata columns: {len(vocab['cuisine'])} cuisines, "
+               f"cook time parsed for {parsed['time']}, "
+               f"calories for {parsed['kcal']} recipes")
+
+
+def columns_outdated(path_index, dedup_threshold):
+    """Нужно ли пересчитать колонки метаданных актуального индекса
+
+    Колонки пересчитываются, если их нет или группы дубликатов
+    построены с другим порогом.
+    """
+    if not MetadataColumns.exists(path_index):
+        return True
+    if load_index_config(path_index).get("dedup_threshold") != \
+            dedup_threshold:
+        return True
+
+    return dedup_threshold > 0 and MetadataColumns(path_index).groups is None
+
+
 @click.command()
 @click.argument('csv_path', default="data/raw/food-dataset-ru.csv")
 @click.argument('path_index', default="data/processed/food_faiss_index")
 @click.argument('hf_model', default="sergeyzh/LaBSE-ru-turbo")
-def main(csv_path, path_index, hf_model):
+@click.option('--batch-size', default=64, show_default=True,
+              help="Размер батча для одного прохода модели")
+@click.option('--workers', default=0, show_default=True,
+              help="Количество процессов для эмбеддинга (0 - без пула)")
+@click.option('--full', is_flag=True,
+              help="Пересобрать индекс целиком, игнорируя манифест")
+@click.option('--index-type', type=click.Choice(INDEX_TYPES),
+              default="flat", show_default=True, help="Тип индекса FAISS")
+@click.option('--nlist', type=int, default=None,
+              help="Количество кластеров IVF (по умолчанию 4 * sqrt(N))")
+@click.option('--pq-m', default=16, show_default=True,
+              help="Количество подвекторов для IVF-PQ")
+@click.option('--hnsw-m', default=32, show_default=True,
+              help="Количество связей вершины графа HNSW")
+@click.option('--nprobe', default=16, show_default=True,
+              help="nprobe по умолчанию для поиска в IVF")
+@click.option('--ef-search', default=64, show_default=True,
+              help="efSearch по умолчанию для поиска в HNSW")
+@click.option('--eval-queries', default=1000, show_default=True,
+              help="Количество запросов для отчёта recall@k (0 - без отчёта)")
+@click.option('--eval-k', default=3, show_default=True,
+              help="k для отчёта recall@k")
+@click.option('--dedup-threshold', default=0.7, show_default=True,
+              help="Порог Жаккара для групп почти дубликатов (0 - без них)")
+def main(csv_path, path_index, hf_model, batch_size, workers, full,
+         index_type, nlist, pq_m, hnsw_m, nprobe, ef_search,
+         eval_queries, eval_k, dedup_threshold):
     loader = CSVLoader(
         file_path=csv_path,
         encoding="utf-8",
@@ -45,23 +328,70 @@ def main(csv_path, path_index, hf_model):
     )
 
     data_documents = loader.load()
+    documents = dict(zip(document_keys(data_documents), data_documents))
+    hashes = {
+        key: content_hash(d.page_content) for key, d in documents.items()
+    }
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name=hf_model
-    )
+    os.makedirs(path_index, exist_ok=True)
+    checkpoint = EmbeddingCheckpoint(path_index, hf_model)
+    store = RecipeStore(store_path(path_index), readonly=False)
+
+    index, pending, stale, reused = None, list(documents), [], {}
+    if not full:
+        index, pending, stale, reused = load_existing(
+            path_index, hf_model, index_type, store, hashes
+            )
+
+    if index is not None and not pending and not stale:
+        if columns_outdated(path_index, dedup_threshold):
+            write_columns(path_index, store, dedup_threshold)
+        click.echo("Index is up to date")
+        return
+
+    # Эмбеддинги считаются батчами, индекс заполняется одной вставкой
+    pending_documents = [documents[key] for key in pending]
+    vectors = embed_pending(
+        functools.partial(EmbeddingPipeline, hf_model, batch_size, workers),
+        list(zip(pending, pending_documents)), hashes, checkpoint, reused
+        )
+
+    # Приближённые индексы обучаются на векторах всего корпуса
+    rebuilt = index is None
+    if rebuilt:
+        factory_string = index_factory_string(
+            index_type, nlist or default_nlist(len(vectors)), pq_m, hnsw_m
+            )
+        index = build_index(vectors, factory_string)
+        store.clear()
+
+    first_id = store.next_id()
+    ids = np.arange(first_id, first_id + len(pending), dtype=np.int64)
+    if pending:
+        index.add_with_ids(vectors, ids)
+        store.add(ids, pending, pending_documents)
+        store.add_terms(ids, [
+            tokenize_ingredients(d.metadata.get("Ингредиенты") or "")
+            for d in pending_documents
+        ])
 
-    # Создаём векторное хранилище
-    db = None
-    with tqdm(total=len(data_documents), desc="Ingesting documents") as pbar:
-        for d in data_documents:
-            if db:
-                db.add_documents([d])
-            else:
-                db = FAISS.from_documents([d], embeddings)
-            pbar.update(1)
+    if rebuilt and index_type != "flat" and eval_queries > 0:
+        report_recall(index, vectors, ids, path_index, eval_k, eval_queries)
 
     # "food_faiss_index"
-    db.save_local(path_index)
+    write_index(index, path_index)
+    store.update_document_frequencies()
+    store.commit()
+    IndexManifest(hf_model, hashes).save(path_index)
+    if rebuilt:
+        save_index_config(path_index, {
+            "index_type": index_type,
+            "factory": factory_string,
+            "nprobe": nprobe,
+            "ef_search": ef_search
+        })
+    write_columns(path_index, store, dedup_threshold)
+    checkpoint.clear()
 
 
 if __name__ == "__main__":
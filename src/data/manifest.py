@@ -0,0 +1,181 @@
+import os
+import json
+import glob
+import shutil
+import hashlib
+
+import numpy as np
+
+
+MANIFEST_FILE = "manifest.json"
+CHECKPOINT_DIR = ".checkpoint"
+
+
+def content_hash(text: str) -> str:
+    """Хэш содержимого документа
+
+    Args:
+        text (str): Текст документа из CONTENT_COLUMNS
+
+    Returns:
+        str: SHA-1 хэш текста
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def document_keys(documents) -> list:
+    """Стабильные ключи документов по ссылке на рецепт
+
+    Порядок строк в CSV может меняться, поэтому ключом служит ссылка,
+    а повторяющиеся ссылки получают порядковый суффикс.
+
+    Args:
+        documents: Документы из CSVLoader
+
+    Returns:
+        list: Ключи документов
+    """
+    seen = {}
+    keys = []
+    for d in documents:
+        key = d.metadata.get("Ссылка") or f"row:{d.metadata['row']}"
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keys.append(key if count == 0 else f"{key}#{count}")
+
+    return keys
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+
+    os.replace(tmp_path, path)
+
+
+class IndexManifest:
+    """Манифест индекса: хэши содержимого всех проиндексированных строк
+    """
+    def __init__(self, model_name: str, documents: dict = None):
+        """Инициализация манифеста
+
+        Args:
+            model_name (str): Модель, которой посчитаны эмбеддинги
+            documents (dict): Ключ документа -> хэш содержимого
+        """
+        self.model_name = model_name
+        self.documents = documents or {}
+
+    @classmethod
+    def load(cls, path_index: str):
+        """Загрузка манифеста из директории индекса
+
+        Returns:
+            IndexManifest: Манифест или None, если его нет
+        """
+        path = os.path.join(path_index, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+
+        return cls(data["model"], data["documents"])
+
+    def save(self, path_index: str):
+        _write_json(
+            os.path.join(path_index, MANIFEST_FILE),
+            {"model": self.model_name, "documents": self.documents}
+        )
+
+    def diff(self, documents: dict):
+        """Сравнение манифеста с актуальным состоянием CSV
+
+        Args:
+            documents (dict): Ключ документа -> хэш содержимого
+
+        Returns:
+            tuple: Ключи для удаления из индекса и ключи для эмбеддинга
+        """
+        stale = [
+            key for key, value in self.documents.items()
+            if documents.get(key) != value
+        ]
+        pending = [
+            key for key, value in documents.items()
+            if self.documents.get(key) != value
+        ]
+
+        return stale, pending
+
+
+class EmbeddingCheckpoint:
+    """Чекпоинт посчитанных эмбеддингов для продолжения прерванной сборки
+    """
+    def __init__(self, path_index: str, model_name: str):
+        """Инициализация чекпоинта
+
+        Args:
+            path_index (str): Директория индекса
+            model_name (str): Модель эмбеддингов
+        """
+        self.path = os.path.join(path_index, CHECKPOINT_DIR)
+        self.model_name = model_name
+
+    def load(self) -> dict:
+        """Загрузка сохранённых частей
+
+        Returns:
+            dict: Ключ документа -> (хэш содержимого, эмбеддинг)
+        """
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            return {}
+
+        with open(meta_path, encoding="utf-8") as file:
+            if json.load(file)["model"] != self.model_name:
+                self.clear()
+                return {}
+
+        done = {}
+        for part_path in sorted(glob.glob(os.path.join(self.path, "*.npz"))):
+            part = np.load(part_path)
+            for key, value, vector in zip(
+                part["keys"], part["hashes"], part["vectors"]
+            ):
+                done[str(key)] = (str(value), vector)
+
+        return done
+
+    def append(self, keys: list, hashes: list, vectors: np.ndarray):
+        """Сохранение очередной части эмбеддингов
+
+        Args:
+            keys (list): Ключи документов
+            hashes (list): Хэши содержимого
+            vectors (np.ndarray): Эмбеддинги документов
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+            _write_json(
+                os.path.join(self.path, "meta.json"),
+                {"model": self.model_name}
+            )
+
+        part_number = len(glob.glob(os.path.join(self.path, "*.npz")))
+        part_path = os.path.join(self.path, f"part-{part_number:05d}")
+
+        # Часть появляется под итоговым именем только после полной записи
+        with open(part_path + ".tmp", "wb") as file:
+            np.savez(
+                file,
+                keys=np.array(keys),
+                hashes=np.array(hashes),
+                vectors=vectors
+            )
+
+        os.replace(part_path + ".tmp", part_path + ".npz")
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,110 @@
+import numpy as np
+
+from tqdm import tqdm
+
+from langchain_core.embeddings import Embeddings
+
+
+def iter_batches(items: list, batch_size: int):
+    """Разбиение списка на последовательные батчи
+
+    Args:
+        items (list): Исходный список
+        batch_size (int): Размер батча
+
+    Yields:
+        list: Очередной батч
+    """
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+class EmbeddingPipeline(Embeddings):
+    """Батчевое вычисление эмбеддингов SentenceTransformer
+
+    Векторы совпадают с HuggingFaceEmbeddings, поэтому индекс,
+    собранный пайплайном, используется в приложении без изменений.
+    """
+    def __init__(self, model_name: str, batch_size: int = 64,
+                 workers: int = 0):
+        """Инициализация пайплайна
+
+        Args:
+            model_name (str): Название модели HuggingFace
+            batch_size (int): Размер батча для одного прохода модели
+            workers (int): Количество процессов для токенизации
+                и эмбеддинга, 0 - без пула процессов
+        """
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 0:
+            self.pool = self.model.start_multi_process_pool(
+                target_devices=["cpu"] * self.workers
+                )
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def encode(self, texts: list) -> np.ndarray:
+        """Эмбеддинги для списка текстов
+
+        Args:
+            texts (list): Тексты документов
+
+        Returns:
+            np.ndarray: Матрица эмбеддингов float32
+        """
+        # Как в HuggingFaceEmbeddings, переносы строк заменяются пробелами
+        texts = [text.replace("\n", " ") for text in texts]
+
+        if self.pool is not None:
+            vectors = self.model.encode_multi_process(
+                texts,
+                self.pool,
+                batch_size=self.batch_size
+                )
+        else:
+            vectors = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                show_progress_bar=False
+                )
+
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: list) -> list:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self.encode([text])[0].tolist()
+
+    def iter_embeddings(self, texts: list,
+                        desc: str = "Embedding documents"):
+        """Эмбеддинги корпуса по частям с прогрессом
+
+        Args:
+            texts (list): Тексты документов
+            desc (str): Подпись прогресс-бара
+
+        Yields:
+            tuple: Смещение части в корпусе и её матрица эмбеддингов
+        """
+        # Пулу процессов отдаём сразу несколько батчей на воркер
+        chunk_size = self.batch_size * max(self.workers, 1) * 4
+
+        offset = 0
+        with tqdm(total=len(texts), desc=desc) as pbar:
+            for chunk in iter_batches(texts, chunk_size):
+                yield offset, self.encode(chunk)
+                offset += len(chunk)
+                pbar.update(len(chunk))
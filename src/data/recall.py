@@ -0,0 +1,70 @@
+import time
+
+import faiss
+import numpy as np
+
+from tools.faiss_index import base_index, tune_index
+
+
+NPROBE_VALUES = [1, 4, 8, 16, 32, 64, 128]
+EF_SEARCH_VALUES = [16, 32, 64, 128, 256]
+
+
+def recall_at_k(index: faiss.Index, vectors: np.ndarray, ids: np.ndarray,
+                k: int = 3, n_queries: int = 1000, seed: int = 0) -> list:
+    """Сравнение recall@k приближённого индекса с точным поиском
+
+    Запросами служат случайные документы корпуса, эталон -
+    плоский индекс по тем же векторам.
+
+    Args:
+        index (faiss.Index): Приближённый индекс с векторами корпуса
+        vectors (np.ndarray): Эмбеддинги корпуса
+        ids (np.ndarray): id векторов в индексе
+        k (int): Количество документов в выдаче
+        n_queries (int): Количество запросов
+        seed (int): Seed выборки запросов
+
+    Returns:
+        list: Строки отчёта с параметром поиска, recall@k и задержкой
+    """
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(
+        len(vectors), min(n_queries, len(vectors)), replace=False
+        )
+    queries = vectors[query_ids]
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+    truth = ids[truth]
+
+    if faiss.try_extract_index_ivf(index) is not None:
+        param, values = "nprobe", NPROBE_VALUES
+    elif hasattr(base_index(index), "hnsw"):
+        param, values = "ef_search", EF_SEARCH_VALUES
+    else:
+        param, values = None, [None]
+
+    report = []
+    for value in values:
+        if param:
+            tune_index(index, **{param: value})
+
+        start_time = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start_time
+
+        hits = sum(
+            len(set(row_found) & set(row_truth))
+            for row_found, row_truth in zip(found, truth)
+        )
+
+        report.append({
+            "param": param,
+            "value": value,
+            f"recall@{k}": hits / (len(queries) * k),
+            "ms_per_query": 1000 * elapsed / len(queries)
+        })
+
+    return report
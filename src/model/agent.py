@@ -1,10 +1,15 @@
+import time
+import asyncio
+import contextvars
+
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import AIMessage, HumanMessage
 
+from model.memory import ChatMemory, summary_fallback
 from model.prompt import (
     PROMPT_CLASSIFIER,
     PROMPT_ASSISTANT,
@@ -13,87 +18,409 @@ from model.prompt import (
     PROMPT_FILTER,
     PROMPT_ENTITY_MEMORY
 )
-from tools.utils import (
-    clean_input,
-    format_docs,
-    format_docs_with_links,
-    search_image
+from tools.utils import clean_input, docs_ids
+from tools.context import ContextBuilder
+from tools.images import ImageSearch
+from tools.metrics import (
+    METRICS,
+    LLMMetricsCallback,
+    start_trace,
+    stage
 )
 
 
+RAG_TASKS = ["Recommend", "Generate"]
+STREAM_TASKS = ["About Me"] + RAG_TASKS
+
+
 class AgentSystem:
     """AI Coocking Assistant
     """
-    def __init__(self, llm, retriever, k=6):
+    def __init__(self, llm, retriever, k=6, summary_workers=4,
+                 intent_classifier=None, response_cache=None,
+                 image_search=None, context_builder=None):
         """Инициализация агента
 
         Args:
             llm: Large Language Model
             retriever: FAISS Index Retriever
             k: Количество последних сообщений в памяти агента
+            summary_workers: Количество потоков для фонового
+                резюмирования ответов в память
+            intent_classifier: Локальный классификатор намерений,
+                None - все запросы классифицирует LLM
+            response_cache: Семантический кэш ответов рекомендаций
+                и генерации, None - без кэша
+            image_search: Поиск изображений блюд, по умолчанию
+                DuckDuckGo без дискового кэша
+            context_builder: Сборка истории и рецептов в промпт
+                в пределах бюджета токенов
         """
-        self.llm = llm
+        # Размер промпта и токены каждого вызова LLM в метриках этапа
+        self.llm = llm.with_config(callbacks=[LLMMetricsCallback()])
         self.retriever = retriever
+        self.intent_classifier = intent_classifier
+        self.response_cache = response_cache
+        self.image_search = image_search or ImageSearch()
+        self.context = context_builder or ContextBuilder()
 
         self.k = k
 
-        self.chat_history = []
         self.memory_entity = self.get_memory_entity_chain()
-
+        self.summary_executor = ThreadPoolExecutor(
+            max_workers=summary_workers,
+            thread_name_prefix="memory-entity"
+            )
+
+        self.retrieve_chain = RunnableLambda(
+            self.retrieve, afunc=self.aretrieve
+            )
+
+        self.llm_classifier_chain = self.get_classifier_chain()
+        self.classifier_chain = RunnableLambda(
+            self.classify, afunc=self.aclassify
+            )
+        self.llm_filter_chain = self.get_filter_chain()
+        self.filter_chain = RunnableLambda(
+            self.rewrite, afunc=self.arewrite
+            )
+
+        self.prompt_chains = {
+            task: self.get_prompt_chain(task) for task in STREAM_TASKS
+        }
+        self.answer_chains = {
+            task: self.get_answer_chain(task) for task in STREAM_TASKS
+        }
         self.assistant_chain = self.get_assistant_chain()
         self.recommender_chain = self.get_recommender_chain()
         self.generater_chain = self.get_generater_chain()
         self.search_chain = self.get_search_chain()
+        self.task_chains = {
+            "About Me": self.assistant_chain,
+            "Recommend": self.recommender_chain,
+            "Generate": self.generater_chain,
+            "Search Image": self.search_chain
+        }
 
         self.full_chain = self.initial_chain()
 
-    def invoke(self, query: str):
+    def invoke(self, query: str, memory: ChatMemory):
         """Вызов цепочки
 
         Args:
             query (str): Запрос пользователя
+            memory (ChatMemory): Память сессии пользователя
 
         Returns:
-            dict: Результат системы цепочек
+            dict: Результат системы цепочек с trace_id запроса
         """
-        result = self.full_chain.invoke({
+        trace_id = start_trace()
+        with stage("request", mode="invoke") as span:
+            result = self.full_chain.invoke({
+                "input": query,
+                "chat_history": memory.get_messages()
+                })
+            span["task"] = result["task"]
+
+        self.count_request("invoke", result["task"])
+        self.remember(query, result, memory)
+
+        return dict(result, trace_id=trace_id)
+
+    async def ainvoke(self, query: str, memory: ChatMemory):
+        """Асинхронный вызов цепочки
+
+        Классификация запроса и его переписывание для поиска
+        не зависят друг от друга и выполняются одновременно,
+        а ненужное задаче переписывание отменяется.
+
+        Args:
+            query (str): Запрос пользователя
+            memory (ChatMemory): Память сессии пользователя
+
+        Returns:
+            dict: Результат системы цепочек с trace_id запроса
+        """
+        trace_id = start_trace()
+        with stage("request", mode="ainvoke") as span:
+            result = await self.aroute(query, memory)
+            span["task"] = result["task"]
+
+        self.count_request("ainvoke", result["task"])
+        self.remember(query, result, memory)
+
+        return dict(result, trace_id=trace_id)
+
+    async def aroute(self, query: str, memory: ChatMemory) -> dict:
+        # Ожидание фоновых резюме не блокирует цикл событий
+        dict_chain = {
             "input": query,
-            "chat_history": self.chat_history
-            })
+            "chat_history": await asyncio.to_thread(memory.get_messages)
+        }
 
-        if result['task'] == "Unknown":
-            return result
+        await self.aclassify_with_rewrite(query, dict_chain)
 
-        self.chat_history.append(HumanMessage(content=f"Query: {query}"))
+        route = self.route_chain(dict_chain)
+        if isinstance(route, dict):
+            return route
 
-        if result['task'] == "Search Image":
-            self.chat_history.append(
-                AIMessage(content="Answer: Нашел изображение.")
-                )
+        # Ретривер и поиск изображения выполняются в executor
+        return await route.ainvoke(dict_chain)
+
+    def stream(self, query: str, memory: ChatMemory):
+        """Потоковый вызов цепочки
+
+        Токены ответа LLM отдаются по мере генерации, поэтому
+        пользователь видит начало ответа до его завершения.
+
+        Args:
+            query (str): Запрос пользователя
+            memory (ChatMemory): Память сессии пользователя
+
+        Yields:
+            dict: События route (задача), retrieval (найденные рецепты),
+                token (фрагмент ответа) и end (итоговый результат
+                с trace_id запроса)
+        """
+        trace_id = start_trace()
+        start_time = time.perf_counter()
+        with stage("request", mode="stream") as span:
+            dict_chain = {
+                "input": query,
+                "chat_history": memory.get_messages()
+            }
+
+            task = self.route_task(self.classifier_chain.invoke(query))
+            yield {"event": "route", "task": task or "Unknown"}
+
+            if task is not None and task != "About Me":
+                dict_chain["filter_query"] = self.filter_chain.invoke(
+                    dict_chain
+                    )
+
+            if task is None:
+                result = self.unknown_result()
+            elif task == "Search Image":
+                result = self.search_chain.invoke(dict_chain)
+            else:
+                if task in RAG_TASKS:
+                    dict_chain["docs"] = self.retrieve(dict_chain)
+                    yield {"event": "retrieval", "docs": dict_chain["docs"]}
+
+                tokens = []
+                for token in self.stream_answer(task, dict_chain):
+                    if not tokens:
+                        self.first_token(task, start_time, span)
+                    tokens.append(token)
+                    yield {"event": "token", "text": token}
+                result = {"output": "".join(tokens), "task": task}
+            span["task"] = result["task"]
+
+        self.count_request("stream", result["task"])
+        self.remember(query, result, memory)
+
+        yield {"event": "end", "result": dict(result, trace_id=trace_id)}
+
+    async def astream(self, query: str, memory: ChatMemory):
+        """Асинхронный потоковый вызов цепочки
+
+        Классификация и переписывание запроса выполняются
+        одновременно, события те же, что у stream.
+
+        Args:
+            query (str): Запрос пользователя
+            memory (ChatMemory): Память сессии пользователя
+
+        Yields:
+            dict: События route, retrieval, token и end
+        """
+        trace_id = start_trace()
+        start_time = time.perf_counter()
+        with stage("request", mode="astream") as span:
+            # Ожидание фоновых резюме не блокирует цикл событий
+            dict_chain = {
+                "input": query,
+                "chat_history": await asyncio.to_thread(memory.get_messages)
+            }
+
+            task = await self.aclassify_with_rewrite(query, dict_chain)
+            yield {"event": "route", "task": task or "Unknown"}
+
+            if task is None:
+                result = self.unknown_result()
+            elif task == "Search Image":
+                result = await self.search_chain.ainvoke(dict_chain)
+            else:
+                if task in RAG_TASKS:
+                    dict_chain["docs"] = await self.aretrieve(dict_chain)
+                    yield {"event": "retrieval", "docs": dict_chain["docs"]}
+
+                tokens = []
+                async for token in self.astream_answer(task, dict_chain):
+                    if not tokens:
+                        self.first_token(task, start_time, span)
+                    tokens.append(token)
+                    yield {"event": "token", "text": token}
+                result = {"output": "".join(tokens), "task": task}
+            span["task"] = result["task"]
+
+        self.count_request("astream", result["task"])
+        self.remember(query, result, memory)
+
+        yield {"event": "end", "result": dict(result, trace_id=trace_id)}
+
+    async def aclassify_with_rewrite(self, query: str, dict_chain: dict):
+        """Классификация запроса и переписывание его для поиска
+
+        Переписывание запускается одновременно с классификацией
+        и отменяется, если задаче не нужен поиск (About Me или
+        нераспознанный запрос).
+
+        Args:
+            query (str): Запрос пользователя
+            dict_chain (dict): Вход цепочки, дополняется полями topic
+                и, для задач с поиском, filter_query
+
+        Returns:
+            str: Задача агента или None для нераспознанного запроса
+        """
+        rewrite = asyncio.create_task(self.filter_chain.ainvoke(dict_chain))
+        try:
+            topic = await self.classifier_chain.ainvoke(query)
+        except BaseException:
+            rewrite.cancel()
+            raise
+
+        dict_chain["topic"] = topic
+        task = self.route_task(topic)
+        if task is None or task == "About Me":
+            rewrite.cancel()
         else:
-            summary_response = self.memory_entity.invoke(result['output'])
-            summary_response = f"Answer: {summary_response}"
-            self.chat_history.append(AIMessage(content=summary_response))
+            dict_chain["filter_query"] = await rewrite
 
-        self.chat_history = self.chat_history[-self.k:]
+        return task
+
+    @staticmethod
+    def first_token(task: str, start_time: float, span: dict):
+        """Время до первого фрагмента ответа в потоковом режиме
+        """
+        seconds = time.perf_counter() - start_time
+        span["first_token_ms"] = round(seconds * 1000, 2)
+        METRICS.observe("agent_first_token_seconds", seconds, task=task)
+
+    @staticmethod
+    def count_request(mode: str, task: str):
+        METRICS.inc("agent_requests_total", mode=mode, task=task)
+
+    def stream_answer(self, task: str, dict_chain: dict):
+        """Фрагменты ответа LLM, ответ из кэша отдаётся целиком
+
+        Args:
+            task (str): Задача агента
+            dict_chain (dict): Запрос, история и найденные рецепты
+
+        Yields:
+            str: Фрагмент ответа
+        """
+        cached = self.cache_lookup(task, dict_chain)
+        if cached is not None:
+            yield cached["output"]
+            return
+
+        tokens = []
+        with stage("answer", task=task):
+            for chunk in (self.prompt_chains[task] | self.llm).stream(
+                dict_chain
+            ):
+                tokens.append(chunk.content)
+                yield chunk.content
+
+        self.cache_store(task, dict_chain, "".join(tokens))
+
+    async def astream_answer(self, task: str, dict_chain: dict):
+        cached = await asyncio.to_thread(self.cache_lookup, task, dict_chain)
+        if cached is not None:
+            yield cached["output"]
+            return
+
+        tokens = []
+        with stage("answer", task=task):
+            async for chunk in (self.prompt_chains[task] | self.llm).astream(
+                dict_chain
+            ):
+                tokens.append(chunk.content)
+                yield chunk.content
+
+        await asyncio.to_thread(
+            self.cache_store, task, dict_chain, "".join(tokens)
+            )
+
+    def cache_lookup(self, task: str, dict_chain: dict):
+        if self.response_cache is None or task not in RAG_TASKS:
+            return None
+
+        with stage("response_cache", task=task) as span:
+            result = self.response_cache.lookup(
+                task, dict_chain["input"], docs_ids(dict_chain["docs"]),
+                history=self.context.history(dict_chain["chat_history"])
+                )
+            span["hit"] = result is not None
 
         return result
 
-    def initial_memory(self, chat_history: list):
-        """Инициализация памяти для агента
+    def cache_store(self, task: str, dict_chain: dict, output: str):
+        if self.response_cache is None or task not in RAG_TASKS:
+            return
+
+        self.response_cache.store(
+            task, dict_chain["input"], docs_ids(dict_chain["docs"]),
+            {"output": output, "task": task},
+            history=self.context.history(dict_chain["chat_history"])
+            )
+
+    def remember(self, query: str, result: dict, memory: ChatMemory):
+        """Сохранение хода диалога в память сессии
+
+        Резюме ответа считается LLM в фоновом потоке и не задерживает
+        ответ пользователю; до его готовности в памяти хранится
+        детерминированная запись с названием блюда.
 
         Args:
-            chat_history (list): История чата
+            query (str): Запрос пользователя
+            result (dict): Результат системы цепочек
+            memory (ChatMemory): Память сессии пользователя
         """
-        self.chat_history = chat_history
+        if result['task'] == "Unknown":
+            return
 
-    def get_chat_history(self):
-        """Возвращает текущие состояние памяти
+        if result['task'] == "Search Image":
+            memory.add_turn(query, "Нашел изображение.")
+            return
+
+        # Резюме попадает в trace запроса
+        summary_future = self.summary_executor.submit(
+            contextvars.copy_context().run, self.summarize, result['output']
+            )
+        memory.add_turn(
+            query,
+            summary_future,
+            fallback=summary_fallback(result['output'], result['task'])
+            )
+
+    def summarize(self, output: str) -> str:
+        with stage("memory_summary"):
+            return self.memory_entity.invoke(output)
+
+    def new_memory(self, chat_history: list = None):
+        """Создание памяти для новой сессии
 
-        Returns:
+        Args:
             chat_history (list): История чата
+
+        Returns:
+            ChatMemory: Память сессии
         """
-        return self.chat_history
+        return ChatMemory(k=self.k, messages=chat_history)
 
     def get_memory_entity_chain(self):
         """Создание цепочки для сохранение сущностей
@@ -109,11 +436,8 @@ class AgentSystem:
 
         return memory_entity
 
-    def initial_chain(self):
-        """Создание цепочки агентов
-
-        Returns:
-            full_chain: Итоговая цепочка системы
+    def get_classifier_chain(self):
+        """Создание цепочки классификации запроса пользователя
         """
         classifier_chain = (
             clean_input
@@ -122,10 +446,81 @@ class AgentSystem:
             | StrOutputParser()
         )
 
+        return classifier_chain
+
+    def classify(self, query: str) -> str:
+        """Классификация запроса: локально, при низкой уверенности - LLM
+
+        Args:
+            query (str): Запрос пользователя
+
+        Returns:
+            str: Класс запроса
+        """
+        with stage("classify") as span:
+            label = self.local_intent(query)
+            span["source"] = "llm" if label is None else "local"
+            if label is None:
+                label = self.llm_classifier_chain.invoke(query)
+            span["label"] = label
+
+        return label
+
+    async def aclassify(self, query: str) -> str:
+        with stage("classify") as span:
+            # Эмбеддинг запроса считается в executor
+            label = await asyncio.to_thread(self.local_intent, query)
+            span["source"] = "llm" if label is None else "local"
+            if label is None:
+                label = await self.llm_classifier_chain.ainvoke(query)
+            span["label"] = label
+
+        return label
+
+    def local_intent(self, query: str):
+        if self.intent_classifier is None:
+            return None
+
+        label, _ = self.intent_classifier.predict(query)
+
+        return label
+
+    def get_filter_chain(self):
+        """Создание цепочки переписывания запроса для поиска
+        """
+        filter_chain = (
+            {
+                "query": itemgetter("input"),
+                "chat_history": itemgetter("chat_history")
+                | RunnableLambda(lambda x: self.context.history(x))
+            }
+            | PromptTemplate.from_template(PROMPT_FILTER)
+            | self.llm
+            | StrOutputParser()
+        )
+
+        return filter_chain
+
+    def rewrite(self, dict_chain: dict) -> str:
+        """Переписывание запроса для поиска
+        """
+        with stage("filter"):
+            return self.llm_filter_chain.invoke(dict_chain)
+
+    async def arewrite(self, dict_chain: dict) -> str:
+        with stage("filter"):
+            return await self.llm_filter_chain.ainvoke(dict_chain)
+
+    def initial_chain(self):
+        """Создание цепочки агентов
+
+        Returns:
+            full_chain: Итоговая цепочка системы
+        """
         full_chain = (
             {
                 "input": itemgetter("input"),
-                "topic": itemgetter("input") | classifier_chain,
+                "topic": itemgetter("input") | self.classifier_chain,
                 "chat_history": itemgetter("chat_history")
             }
             | RunnableLambda(self.route_chain)
@@ -133,38 +528,126 @@ class AgentSystem:
 
         return full_chain
 
-    def get_assistant_chain(self):
-        """Создание цепочки для для ассистента
+    def get_prompt_chain(self, task: str):
+        """Создание цепочки промпта ответа для задачи
+
+        Args:
+            task (str): Задача агента из STREAM_TASKS
+
+        Returns:
+            Runnable: Цепочка, собирающая промпт из запроса,
+                истории и найденных рецептов в пределах бюджета
+                токенов
         """
-        assistant_chain = (
-            {"query": itemgetter("input")}
-            | PromptTemplate.from_template(PROMPT_ASSISTANT)
+        prompt = {
+            "About Me": PROMPT_ASSISTANT,
+            "Recommend": PROMPT_RECOMMENDER,
+            "Generate": PROMPT_GENERATER
+        }[task]
+
+        return (
+            RunnableLambda(lambda x: self.context.assemble(task, x))
+            | PromptTemplate.from_template(prompt)
+            | RunnableLambda(lambda x: self.context.report(task, x))
+        )
+
+    def get_answer_chain(self, task: str):
+        """Создание цепочки ответа LLM для задачи
+
+        Args:
+            task (str): Задача агента из STREAM_TASKS
+
+        Returns:
+            Runnable: Цепочка от запроса, истории и найденных рецептов
+                до результата агента, для задач с рецептами -
+                с семантическим кэшем ответов
+        """
+        answer_chain = self.traced(
+            "answer",
+            self.prompt_chains[task]
             | self.llm
-            | {"output": lambda x: x.content, "task": lambda x: "About Me"}
+            | {"output": lambda x: x.content, "task": lambda x: task},
+            task=task
         )
+        if task not in RAG_TASKS:
+            return answer_chain
 
-        return assistant_chain
+        return self.with_response_cache(task, answer_chain)
+
+    def get_assistant_chain(self):
+        """Создание цепочки для для ассистента
+        """
+        return self.answer_chains["About Me"]
+
+    def retrieval_kwargs(self, dict_chain: dict) -> dict:
+        """Фильтр по метаданным из исходного запроса пользователя
+
+        Переписанный запрос для поиска может потерять ограничения
+        вроде «до 30 минут», поэтому они извлекаются из input.
+        """
+        extract = getattr(self.retriever, "extract_filter", None)
+        metadata_filter = extract(dict_chain["input"]) if extract else None
+
+        return {"metadata_filter": metadata_filter} if metadata_filter else {}
+
+    def retrieve(self, dict_chain: dict) -> list:
+        kwargs = self.retrieval_kwargs(dict_chain)
+        with stage("retrieve", **kwargs) as span:
+            docs = self.retriever.invoke(dict_chain["filter_query"], **kwargs)
+            span["docs"] = len(docs)
+
+        return docs
+
+    async def aretrieve(self, dict_chain: dict) -> list:
+        kwargs = self.retrieval_kwargs(dict_chain)
+        with stage("retrieve", **kwargs) as span:
+            docs = await self.retriever.ainvoke(
+                dict_chain["filter_query"], **kwargs
+                )
+            span["docs"] = len(docs)
+
+        return docs
+
+    def retrieve_batch(self, dict_chains: list) -> list:
+        """Поиск рецептов для нескольких запросов одним вызовом
+        ретривера
+
+        Args:
+            dict_chains (list): Входы цепочек с filter_query
+
+        Returns:
+            list: Списки документов в порядке dict_chains
+        """
+        filters = [
+            self.retrieval_kwargs(dict_chain).get("metadata_filter")
+            for dict_chain in dict_chains
+        ]
+        queries = [dict_chain["filter_query"] for dict_chain in dict_chains]
+
+        with stage("retrieve", batch=len(queries)) as span:
+            retrieve_batch = getattr(self.retriever, "retrieve_batch", None)
+            if retrieve_batch is not None:
+                docs = retrieve_batch(queries, filters)
+            else:
+                docs = [
+                    self.retriever.invoke(
+                        dict_chain["filter_query"],
+                        **self.retrieval_kwargs(dict_chain)
+                        )
+                    for dict_chain in dict_chains
+                ]
+            span["docs"] = sum(len(d) for d in docs)
+
+        return docs
 
     def get_recommender_chain(self):
         """Создание цепочки для рекомендации блюда по запросу пользователя
         """
         recommender_chain = (
-            {
-                "descripition": {
-                    "query": itemgetter("input"),
-                    "chat_history": itemgetter("chat_history")
-                    }
-                | PromptTemplate.from_template(PROMPT_FILTER)
-                | self.llm
-                | StrOutputParser()
-                | self.retriever
-                | format_docs_with_links,
-                "query": itemgetter("input"),
-                "chat_history": itemgetter("chat_history")
-            }
-            | PromptTemplate.from_template(PROMPT_RECOMMENDER)
-            | self.llm
-            | {"output": lambda x: x.content, "task": lambda x: "Recommend"}
+            RunnablePassthrough.assign(
+                docs=self.retrieve_chain
+                )
+            | self.answer_chains["Recommend"]
         )
 
         return recommender_chain
@@ -174,57 +657,133 @@ class AgentSystem:
         по запросу пользователя
         """
         generater_chain = (
-            {
-                "descripition": {
-                    "query": itemgetter("input"),
-                    "chat_history": itemgetter("chat_history")
-                    }
-                | PromptTemplate.from_template(PROMPT_FILTER)
-                | self.llm
-                | StrOutputParser()
-                | self.retriever
-                | format_docs,
-                "query": itemgetter("input"),
-                "chat_history": itemgetter("chat_history")
-            }
-            | PromptTemplate.from_template(PROMPT_GENERATER)
-            | self.llm
-            | {"output": lambda x: x.content, "task": lambda x: "Generate"}
+            RunnablePassthrough.assign(
+                docs=self.retrieve_chain
+                )
+            | self.answer_chains["Generate"]
         )
 
         return generater_chain
 
+    def with_response_cache(self, task: str, answer_chain):
+        """Обёртка цепочки ответа семантическим кэшем
+
+        Args:
+            task (str): Задача агента
+            answer_chain: Цепочка ответа по найденным рецептам
+
+        Returns:
+            Runnable: Цепочка, которая сначала ищет ответ в кэше
+        """
+        if self.response_cache is None:
+            return answer_chain
+
+        def answer(dict_chain, config):
+            result = self.cache_lookup(task, dict_chain)
+            if result is None:
+                result = answer_chain.invoke(dict_chain, config)
+                self.cache_store(task, dict_chain, result["output"])
+
+            return result
+
+        async def aanswer(dict_chain, config):
+            # Эмбеддинг запроса считается в executor
+            result = await asyncio.to_thread(
+                self.cache_lookup, task, dict_chain
+                )
+            if result is None:
+                result = await answer_chain.ainvoke(dict_chain, config)
+                await asyncio.to_thread(
+                    self.cache_store, task, dict_chain, result["output"]
+                    )
+
+            return result
+
+        return RunnableLambda(answer, afunc=aanswer)
+
+    @staticmethod
+    def traced(name: str, chain, **fields):
+        """Обёртка цепочки замером этапа
+
+        Args:
+            name (str): Название этапа
+            chain: Цепочка этапа
+            **fields: Дополнительные поля лога этапа
+
+        Returns:
+            Runnable: Цепочка с записью длительности и токенов этапа
+        """
+        def run(dict_chain, config):
+            with stage(name, **fields):
+                return chain.invoke(dict_chain, config)
+
+        async def arun(dict_chain, config):
+            with stage(name, **fields):
+                return await chain.ainvoke(dict_chain, config)
+
+        return RunnableLambda(run, afunc=arun)
+
     def get_search_chain(self):
         """Создание цепочки для поиска изображения блюда
         с помощью DuckDuckGo Search
         """
         search_chain = (
-            {
-                "query": itemgetter("input"),
-                "chat_history": itemgetter("chat_history")
-            }
-            | PromptTemplate.from_template(PROMPT_FILTER)
-            | self.llm
-            | {"query": lambda x: x.content}
-            | search_image
+            {"query": itemgetter("filter_query")}
+            | RunnableLambda(
+                self.image_search.search, afunc=self.image_search.asearch
+                )
         )
 
         return search_chain
 
-    def route_chain(self, dict_chain):
-        """Маршрутизация запроса пользователя по цепочкам
+    def with_filter_query(self, chain, dict_chain):
+        """Добавление переписывания запроса для поиска перед цепочкой,
+        если запрос не был переписан заранее
+        """
+        if "filter_query" in dict_chain:
+            return chain
+
+        return RunnablePassthrough.assign(
+            filter_query=self.filter_chain
+            ) | chain
+
+    def route_task(self, topic: str):
+        """Задача агента по классу запроса
+
+        Args:
+            topic (str): Класс запроса от классификатора
+
+        Returns:
+            str: Задача агента или None для нераспознанного запроса
         """
-        info_class = dict_chain["topic"].lower()
+        info_class = topic.lower()
 
         if "hello" in info_class or "about me" in info_class:
-            return self.assistant_chain
+            return "About Me"
         elif "recommended" in info_class:
-            return self.recommender_chain
+            return "Recommend"
         elif "generate" in info_class:
-            return self.generater_chain
+            return "Generate"
         elif "image food" in info_class:
-            return self.search_chain
+            return "Search Image"
 
+        return None
+
+    def route_chain(self, dict_chain):
+        """Маршрутизация запроса пользователя по цепочкам
+        """
+        task = self.route_task(dict_chain["topic"])
+
+        if task is None:
+            return self.unknown_result()
+        elif task == "About Me":
+            return self.assistant_chain
+
+        return self.with_filter_query(self.task_chains[task], dict_chain)
+
+    def unknown_result(self) -> dict:
+        """Ответ на нераспознанный запрос
+        """
         other_task = {
             "output": (
                 "Я не понял запроса.🤯 " +
@@ -0,0 +1,410 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import itertools
+import click
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from model.agent import RAG_TASKS
+from model.loader import AgentLoader
+from tools.metrics import METRICS, start_trace, stage
+from tools.utils import serialize_docs
+
+
+ROLES = {"human": HumanMessage, "ai": AIMessage}
+
+
+class BatchRunner:
+    """Пакетная обработка запросов к агенту
+
+    Запросы обрабатываются батчами по этапам: классификатор намерений
+    считает эмбеддинги всего батча одним вызовом, ретривер ищет
+    рецепты всех запросов одним поиском FAISS, а вызовы LLM
+    выполняются одновременно, но не больше concurrency за раз.
+    Запросы независимы: история каждого берётся из входных данных,
+    а память сессий не меняется.
+    """
+    def __init__(self, agent, batch_size: int = 32, concurrency: int = 8,
+                 max_batches: int = 2):
+        """Инициализация обработки
+
+        Args:
+            agent (AgentSystem): Агент
+            batch_size (int): Количество запросов в батче
+            concurrency (int): Количество одновременных вызовов LLM
+            max_batches (int): Количество батчей в обработке, следующий
+                батч начинается, пока LLM отвечает на предыдущий
+        """
+        self.agent = agent
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_batches = max_batches
+
+        self._semaphore = None
+
+    async def gather(self, coroutines) -> list:
+        """Выполнение корутин с ограничением одновременных вызовов
+
+        Returns:
+            list: Результаты или исключения в исходном порядке
+        """
+        async def bounded(coroutine):
+            async with self._semaphore:
+                return await coroutine
+
+        return await asyncio.gather(
+            *(bounded(coroutine) for coroutine in coroutines),
+            return_exceptions=True
+            )
+
+    async def classify(self, queries: list) -> list:
+        """Классы запросов батча
+
+        Локальный классификатор обрабатывает батч целиком,
+        а одинаковые неуверенные запросы классифицирует один вызов LLM.
+        """
+        labels = [None] * len(queries)
+        with stage("classify", batch=len(queries)) as span:
+            if self.agent.intent_classifier is not None:
+                labels = [
+                    label for label, _ in await asyncio.to_thread(
+                        self.agent.intent_classifier.predict_batch, queries
+                        )
+                ]
+
+            todo = list(dict.fromkeys(
+                query for query, label in zip(queries, labels)
+                if label is None
+            ))
+            span.update(
+                local=len(labels) - labels.count(None), llm=len(todo)
+                )
+            found = dict(zip(todo, await self.gather(
+                self.agent.llm_classifier_chain.ainvoke(query)
+                for query in todo
+            )))
+
+        return [
+            found[query] if label is None else label
+            for query, label in zip(queries, labels)
+        ]
+
+    async def rewrite(self, dict_chains: list) -> list:
+        with stage("filter", batch=len(dict_chains)):
+            return await self.gather(
+                self.agent.llm_filter_chain.ainvoke(dict_chain)
+                for dict_chain in dict_chains
+            )
+
+    async def retrieve(self, dict_chains: list) -> list:
+        try:
+            return await asyncio.to_thread(
+                self.agent.retrieve_batch, dict_chains
+                )
+        except Exception as e:
+            logging.exception("Batch retrieval failed")
+            return [e] * len(dict_chains)
+
+    async def answer(self, task: str, dict_chain: dict) -> dict:
+        if task == "Search Image":
+            return await self.agent.search_chain.ainvoke(dict_chain)
+
+        return await self.agent.answer_chains[task].ainvoke(dict_chain)
+
+    def route(self, topics: list, results: list) -> list:
+        """Задачи по классам, нераспознанные запросы и ошибки
+        классификации сразу попадают в results
+        """
+        tasks = []
+        for i, topic in enumerate(topics):
+            task = None
+            if isinstance(topic, Exception):
+                results[i] = topic
+            else:
+                task = self.agent.route_task(topic)
+                if task is None:
+                    results[i] = self.agent.unknown_result()
+            tasks.append(task)
+
+        return tasks
+
+    async def prepare(self, tasks: list, dict_chains: list, results: list):
+        """Переписывание запросов и поиск рецептов для батча
+        """
+        todo = [
+            i for i, task in enumerate(tasks)
+            if task not in (None, "About Me") and results[i] is None
+        ]
+        rewrites = await self.rewrite([dict_chains[i] for i in todo])
+        for i, filter_query in zip(todo, rewrites):
+            if isinstance(filter_query, Exception):
+                results[i] = filter_query
+            else:
+                dict_chains[i]["filter_query"] = filter_query
+
+        todo = [
+            i for i, task in enumerate(tasks)
+            if task in RAG_TASKS and results[i] is None
+        ]
+        if todo:
+            found = await self.retrieve([dict_chains[i] for i in todo])
+            for i, docs in zip(todo, found):
+                if isinstance(docs, Exception):
+                    results[i] = docs
+                else:
+                    dict_chains[i]["docs"] = docs
+
+    async def run_batch(self, items: list) -> list:
+        """Обработка одного батча
+
+        Args:
+            items (list): Запросы с полями id, query и history
+
+        Returns:
+            list: Записи результатов в порядке items
+        """
+        trace_id = start_trace()
+        with stage("batch", size=len(items)):
+            dict_chains = [
+                {"input": item["query"], "chat_history": item["history"]}
+                for item in items
+            ]
+            results = [None] * len(items)
+
+            topics = await self.classify([item["query"] for item in items])
+            tasks = self.route(topics, results)
+            await self.prepare(tasks, dict_chains, results)
+
+            todo = [i for i, result in enumerate(results) if result is None]
+            answers = await self.gather(
+                self.answer(tasks[i], dict_chains[i]) for i in todo
+            )
+            for i, result in zip(todo, answers):
+                results[i] = result
+
+        return [
+            self.record(item, dict_chain, result, trace_id)
+            for item, dict_chain, result in zip(items, dict_chains, results)
+        ]
+
+    @staticmethod
+    def record(item: dict, dict_chain: dict, result, trace_id: str) -> dict:
+        """Запись результата запроса для JSON Lines
+        """
+        record = {"id": item["id"], "query": item["query"]}
+        if isinstance(result, Exception):
+            METRICS.inc("batch_items_total", status="error")
+            return dict(record, error=repr(result), trace_id=trace_id)
+
+        METRICS.inc("batch_items_total", status="ok")
+        record.update(
+            task=result["task"],
+            # Миниатюра изображения не пишется в JSON, только источник
+            output=result["output"]
+            if isinstance(result["output"], str) else None,
+            trace_id=trace_id
+        )
+        if "docs" in dict_chain:
+            record["docs"] = serialize_docs(dict_chain["docs"])
+        if result.get("url"):
+            record["url"] = result["url"]
+
+        return record
+
+    async def arun(self, items):
+        """Обработка потока запросов батчами
+
+        Args:
+            items: Итератор запросов с полями id, query и history
+
+        Yields:
+            list: Записи результатов батча, батчи в исходном порядке
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        items = iter(items)
+
+        pending = []
+        while True:
+            batch = list(itertools.islice(items, self.batch_size))
+            if batch:
+                pending.append(asyncio.create_task(self.run_batch(batch)))
+            if not pending:
+                break
+            if len(pending) >= self.max_batches or not batch:
+                yield await pending.pop(0)
+
+
+def history_messages(history: list) -> list:
+    """История из входных данных в сообщения LangChain
+
+    Args:
+        history (list): Сообщения вида {"role": "human", "content": ...}
+
+    Returns:
+        list: Сообщения чата
+    """
+    return [
+        ROLES[message.get("role", "human")](content=message["content"])
+        for message in history or []
+    ]
+
+
+def read_checkpoint(path: str) -> set:
+    """id запросов, уже обработанных без ошибок
+
+    Файл результатов переписывается без записей с ошибками
+    и незавершённой последней строки (прерванная запись), поэтому
+    после продолжения обработки каждый id встречается в файле
+    один раз. Файл заменяется атомарно.
+
+    Args:
+        path (str): Файл результатов в JSON Lines
+
+    Returns:
+        set: id обработанных запросов строками
+    """
+    if not os.path.exists(path):
+        return set()
+
+    done = set()
+    lines = []
+    dropped = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                dropped += 1
+                break
+            record = json.loads(line)
+            if "error" in record:
+                dropped += 1
+                continue
+            lines.append(line)
+            done.add(str(record["id"]))
+
+    if dropped:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    return done
+
+
+def read_queries(path: str, done: set):
+    """Запросы из файла JSON Lines
+
+    Строка файла - объект с полями query, id (по умолчанию номер
+    строки) и history или просто строка запроса.
+
+    Args:
+        path (str): Файл запросов
+        done (set): id уже обработанных запросов
+
+    Yields:
+        dict: Запрос с полями id, query и history
+    """
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                data = json.loads(line)
+            except ValueError:
+                logging.warning(f"Skipped invalid JSON at line {line_number}")
+                continue
+            if isinstance(data, str):
+                data = {"query": data}
+
+            item_id = data.get("id", line_number)
+            if str(item_id) in done or not data.get("query"):
+                continue
+
+            yield {
+                "id": item_id,
+                "query": data["query"],
+                "history": history_messages(data.get("history"))
+            }
+
+
+async def process_file(runner: BatchRunner, input_path: str,
+                       output_path: str) -> int:
+    """Обработка файла запросов с продолжением после прерывания
+
+    Результаты дописываются в output_path после каждого батча,
+    поэтому файл результатов служит чекпоинтом: при повторном
+    запуске обработанные запросы пропускаются, а записи с ошибками
+    удаляются из файла, и эти запросы обрабатываются заново.
+
+    Args:
+        runner (BatchRunner): Пакетная обработка
+        input_path (str): Файл запросов в JSON Lines
+        output_path (str): Файл результатов в JSON Lines
+
+    Returns:
+        int: Количество обработанных запросов
+    """
+    done = read_checkpoint(output_path)
+    if done:
+        click.echo(f"Resumed: {len(done)} queries already processed")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    processed = 0
+    start_time = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as file:
+        async for records in runner.arun(read_queries(input_path, done)):
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+            processed += len(records)
+            elapsed = time.perf_counter() - start_time
+            click.echo(f"Processed {processed} queries: "
+                       f"{processed / elapsed:.1f} queries/sec")
+
+    return processed
+
+
+@click.command()
+@click.argument('input_path')
+@click.argument('output_path')
+@click.option('--batch-size', default=32, show_default=True,
+              help="Количество запросов в батче")
+@click.option('--concurrency', default=8, show_default=True,
+              help="Количество одновременных вызовов LLM")
+@click.option('--index-path', default="data/processed/food_faiss_index",
+              show_default=True, help="Директория индекса FAISS")
+@click.option('--cache-path', default="data/cache", show_default=True,
+              help="Директория кэша артефактов и изображений")
+@click.option('--trace-log', default=None,
+              help="Файл лога этапов в JSON Lines, - для stderr")
+def main(input_path, output_path, batch_size, concurrency, index_path,
+         cache_path, trace_log):
+    """Пакетная обработка запросов из файла JSON Lines
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    loader = AgentLoader(
+        index_path=index_path, cache_path=cache_path, trace_log=trace_log,
+        llm_concurrency=concurrency
+        )
+    agent = loader.wait()
+    if agent is None:
+        raise click.ClickException(f"Agent startup failed: {loader.error}")
+
+    runner = BatchRunner(
+        agent, batch_size=batch_size, concurrency=concurrency
+        )
+    asyncio.run(process_file(runner, input_path, output_path))
+    agent.summary_executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import re
+import threading
+
+import numpy as np
+
+from tools.metrics import METRICS
+
+
+# Правила проверяются по порядку, более узкие намерения раньше
+KEYWORD_RULES = [
+    ("image food", [
+        r"\bфот", r"картинк", r"изображени", r"как выгляд"
+    ]),
+    ("generate", [
+        r"придума", r"сгенериру", r"\bсоздай", r"нов(ое|ый|ую) (блюд|рецепт)"
+    ]),
+    ("recommended", [
+        r"посоветуй", r"порекоменду", r"что (можно )?приготовить",
+        r"\bрецепт", r"что поесть"
+    ]),
+    ("about me", [
+        r"что ты (умеешь|можешь)", r"\bкто ты", r"твои функци"
+    ]),
+    ("hello", [
+        r"^\W*(привет|здравствуй|добр(ый|ое) (день|вечер|утро)|хай|"
+        r"hello|hi)\b"
+    ]),
+]
+
+EXAMPLES = {
+    "recommended": [
+        "что приготовить из курицы и риса",
+        "посоветуй блюдо на ужин",
+        "хочу что-нибудь с тыквой и сливками",
+        "есть картошка, грибы и лук",
+        "порекомендуй итальянскую пасту",
+    ],
+    "generate": [
+        "придумай новое блюдо из курицы",
+        "создай необычный рецепт с имбирём",
+        "сгенерируй уникальный десерт",
+        "придумай оригинальный салат",
+    ],
+    "image food": [
+        "покажи фото борща",
+        "как выглядит рататуй",
+        "найди картинку пиццы маргарита",
+        "изображение тирамису",
+    ],
+    "hello": [
+        "привет",
+        "здравствуйте",
+        "добрый вечер",
+        "hello",
+    ],
+    "about me": [
+        "что ты умеешь",
+        "расскажи о себе",
+        "какие у тебя функции",
+        "кто ты такой",
+    ],
+    "other": [
+        "какая сегодня погода",
+        "кто выиграл матч вчера",
+        "напиши код на python",
+        "курс доллара",
+    ],
+}
+
+
+class IntentClassifier:
+    """Локальный классификатор намерений перед LLM-классификатором
+
+    Уверенные случаи определяются ключевыми словами или близостью
+    эмбеддинга запроса к центроидам примеров, остальные уходят в LLM.
+    """
+    def __init__(self, embeddings=None, use_keywords: bool = True,
+                 embedding_threshold: float = 0.75, margin: float = 0.05):
+        """Инициализация классификатора
+
+        Args:
+            embeddings: Модель эмбеддингов ретривера, None - только
+                ключевые слова
+            use_keywords (bool): Использовать правила по ключевым словам
+            embedding_threshold (float): Минимальная косинусная близость
+                к центроиду класса
+            margin (float): Минимальный отрыв лучшего класса от второго
+        """
+        self.embeddings = embeddings
+        self.use_keywords = use_keywords
+        self.embedding_threshold = embedding_threshold
+        self.margin = margin
+
+        self.rules = [
+            (label, [re.compile(pattern) for pattern in patterns])
+            for label, patterns in KEYWORD_RULES
+        ]
+        self.labels = list(EXAMPLES)
+        self.centroids = None
+
+        self._lock = threading.Lock()
+        self.counters = {"keyword": 0, "embedding": 0, "llm": 0}
+
+    def get_centroids(self) -> np.ndarray:
+        """Нормированные центроиды примеров, считаются один раз
+        """
+        if self.centroids is None:
+            centroids = []
+            for label in self.labels:
+                vectors = self.normalize(
+                    self.embeddings.embed_documents(EXAMPLES[label])
+                    )
+                centroids.append(vectors.mean(axis=0))
+            self.centroids = self.normalize(centroids)
+
+        return self.centroids
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+        return vectors / np.maximum(norms, 1e-12)
+
+    def match_keywords(self, query: str):
+        for label, patterns in self.rules:
+            if any(pattern.search(query) for pattern in patterns):
+                return label
+
+        return None
+
+    def match_embedding(self, query: str):
+        """Класс по близости к центроидам
+
+        Returns:
+            tuple: Класс (или None при низкой уверенности) и близость
+        """
+        vector = self.normalize(self.embeddings.embed_query(query))
+
+        return self.match_scores(self.get_centroids() @ vector)
+
+    def match_scores(self, scores: np.ndarray):
+        top = np.argsort(scores)[::-1]
+        confidence = float(scores[top[0]])
+        if (confidence >= self.embedding_threshold
+                and confidence - scores[top[1]] >= self.margin):
+            return self.labels[top[0]], confidence
+
+        return None, confidence
+
+    def predict(self, query: str):
+        """Классификация запроса без LLM
+
+        Args:
+            query (str): Запрос пользователя
+
+        Returns:
+            tuple: Класс и уверенность, класс None - нужен LLM
+        """
+        query = query.lower().strip()
+
+        if self.use_keywords:
+            label = self.match_keywords(query)
+            if label is not None:
+                self.count("keyword")
+                return label, 1.0
+
+        confidence = 0.0
+        if self.embeddings is not None:
+            label, confidence = self.match_embedding(query)
+            if label is not None:
+                self.count("embedding")
+                return label, confidence
+
+        self.count("llm")
+
+        return None, confidence
+
+    def predict_batch(self, queries: list) -> list:
+        """Классификация списка запросов без LLM
+
+        Эмбеддинги запросов, не распознанных по ключевым словам,
+        считаются одним батчем.
+
+        Args:
+            queries (list): Запросы пользователей
+
+        Returns:
+            list: Пары (класс, уверенность) в порядке queries
+        """
+        queries = [query.lower().strip() for query in queries]
+        results = [(None, 0.0)] * len(queries)
+
+        todo = []
+        for i, query in enumerate(queries):
+            label = self.match_keywords(query) if self.use_keywords else None
+            if label is not None:
+                self.count("keyword")
+                results[i] = (label, 1.0)
+            else:
+                todo.append(i)
+
+        if todo and self.embeddings is not None:
+            vectors = self.normalize(self.embeddings.embed_documents(
+                [queries[i] for i in todo]
+                ))
+            for i, scores in zip(todo, vectors @ self.get_centroids().T):
+                results[i] = self.match_scores(scores)
+
+        for label, _ in (results[i] for i in todo):
+            self.count("llm" if label is None else "embedding")
+
+        return results
+
+    def count(self, source: str):
+        with self._lock:
+            self.counters[source] += 1
+        METRICS.inc("agent_intent_total", source=source)
+
+    def stats(self) -> dict:
+        """Счётчики классификатора
+
+        Returns:
+            dict: Количество решений по источникам и доля запросов
+                без обращения к LLM
+        """
+        with self._lock:
+            counters = dict(self.counters)
+
+        total = sum(counters.values())
+        counters["total"] = total
+        counters["hit_rate"] = (
+            (counters["keyword"] + counters["embedding"]) / total
+            if total else 0.0
+        )
+
+        return counters
@@ -0,0 +1,554 @@
+import time
+import random
+import asyncio
+import threading
+import contextvars
+
+from typing import Any, Optional
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait
+)
+
+from pydantic import PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    ChatResult
+)
+
+from tools.metrics import METRICS
+
+
+class LLMOverloadedError(RuntimeError):
+    """Очередь вызовов LLM переполнена
+    """
+
+
+class StreamTimeoutError(TimeoutError):
+    """Первый фрагмент потока не пришёл вовремя, слот LLM освободится
+    после завершения зависшего вызова
+    """
+
+
+class LeaderCancelledError(Exception):
+    """Первый вызов с этим промптом отменён, ожидающие повторяют его
+    """
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Ошибка 429 от API провайдера LLM
+    """
+    status = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None), "status_code", None
+        )
+
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Пауза из заголовка Retry-After ответа 429
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class ConcurrencyLimiter:
+    """Ограничение одновременных вызовов с очередью FIFO
+
+    Общее для синхронных и асинхронных вызовов: освобождённый слот
+    передаётся первому ожидающему, будь то поток или корутина.
+    """
+    def __init__(self, limit: int, max_queue: int):
+        """Инициализация ограничителя
+
+        Args:
+            limit (int): Максимальное количество одновременных вызовов
+            max_queue (int): Максимальное количество ожидающих вызовов
+        """
+        self.limit = limit
+        self.max_queue = max_queue
+        self.inflight = 0
+
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def update_gauges(self):
+        METRICS.set("llm_inflight_calls", self.inflight)
+        METRICS.set("llm_queue_size", len(self._waiters))
+
+    def _try_acquire(self) -> bool:
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            return True
+
+        return False
+
+    def try_acquire(self) -> bool:
+        """Слот без ожидания, если он свободен
+        """
+        with self._lock:
+            acquired = self._try_acquire()
+        self.update_gauges()
+
+        return acquired
+
+    def _enqueue(self, wake) -> bool:
+        """Постановка в очередь, False - слот получен сразу
+        """
+        with self._lock:
+            if self._try_acquire():
+                return False
+            if len(self._waiters) >= self.max_queue:
+                METRICS.inc("llm_rejected_total")
+                raise LLMOverloadedError("LLM queue is full")
+            self._waiters.append(wake)
+
+        return True
+
+    def _dequeue(self, wake) -> bool:
+        """Удаление из очереди, False - слот уже был передан
+        """
+        with self._lock:
+            try:
+                self._waiters.remove(wake)
+                return True
+            except ValueError:
+                return False
+
+    def acquire(self, timeout: float = None):
+        """Ожидание слота в потоке
+
+        Raises:
+            LLMOverloadedError: Очередь переполнена
+            TimeoutError: Слот не освободился за timeout секунд
+        """
+        event = threading.Event()
+        queued = self._enqueue(event.set)
+        self.update_gauges()
+        start_time = time.perf_counter()
+
+        if queued and not event.wait(timeout) and self._dequeue(event.set):
+            METRICS.inc("llm_queue_timeouts_total")
+            raise TimeoutError("LLM queue wait timed out")
+
+        METRICS.observe(
+            "llm_queue_wait_seconds", time.perf_counter() - start_time
+            )
+
+    async def aacquire(self, timeout: float = None):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+                )
+
+        queued = self._enqueue(wake)
+        self.update_gauges()
+        start_time = time.perf_counter()
+
+        if queued:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if not self._dequeue(wake):
+                    # Слот передан одновременно с отменой
+                    self.release()
+                if isinstance(e, asyncio.TimeoutError):
+                    METRICS.inc("llm_queue_timeouts_total")
+                    raise TimeoutError("LLM queue wait timed out")
+                raise
+
+        METRICS.observe(
+            "llm_queue_wait_seconds", time.perf_counter() - start_time
+            )
+
+    def release(self):
+        with self._lock:
+            wake = self._waiters.popleft() if self._waiters else None
+            if wake is None:
+                self.inflight -= 1
+        self.update_gauges()
+
+        if wake is not None:
+            wake()
+
+
+class LLMClient(BaseChatModel):
+    """Обёртка LLM для AgentSystem с защитой от перегрузки
+
+    - не больше max_concurrency одновременных вызовов, ещё max_queue
+      ждут очереди, остальные сразу получают LLMOverloadedError;
+    - одинаковые промпты, которые уже выполняются, не отправляются
+      повторно, а ждут результата первого вызова;
+    - вызов ограничен timeout секунд, а если ответа нет дольше
+      hedge_after и есть свободный слот, отправляется дублирующий
+      запрос и используется первый ответ;
+    - на ответ 429 все вызовы клиента делают паузу (Retry-After или
+      экспоненциальная с джиттером) и вызов повторяется.
+
+    Потоковые вызовы не дедуплицируются и не дублируются, таймаут
+    действует до первого фрагмента ответа.
+    """
+    llm: Any
+    max_concurrency: int = 8
+    max_queue: int = 64
+    queue_timeout: float = 30.0
+    timeout: float = 60.0
+    hedge_after: Optional[float] = None
+    max_retries: int = 3
+    backoff: float = 1.0
+    max_backoff: float = 20.0
+    dedup: bool = True
+
+    _limiter: Any = PrivateAttr(default=None)
+    _executor: Any = PrivateAttr(default=None)
+    _inflight: dict = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _cooldown_until: float = PrivateAttr(default=0.0)
+
+    def model_post_init(self, __context):
+        self._limiter = ConcurrencyLimiter(
+            self.max_concurrency, self.max_queue
+            )
+        # Потоков столько же, сколько слотов: зависший вызов держит оба
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="llm-client"
+            )
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-client"
+
+    @staticmethod
+    def dedup_key(messages: list, stop, kwargs: dict) -> tuple:
+        return (
+            tuple((m.type, str(m.content)) for m in messages),
+            tuple(stop or ()),
+            repr(sorted(kwargs.items()))
+        )
+
+    def join_inflight(self, key) -> tuple:
+        """Регистрация вызова среди выполняющихся
+
+        Returns:
+            tuple: Признак первого вызова с этим промптом и Future
+                с его результатом
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                METRICS.inc("llm_dedup_total")
+                return False, future
+
+            future = self._inflight[key] = Future()
+
+        return True, future
+
+    def leave_inflight(self, key, future: Future, result=None,
+                       error: BaseException = None):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+        # Отмена первого вызова не должна отменять ожидающих
+        if isinstance(error, asyncio.CancelledError):
+            error = LeaderCancelledError()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def backoff_delay(self, error: Exception, attempt: int) -> float:
+        """Пауза после 429, общая для всех вызовов клиента
+        """
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+
+        with self._lock:
+            self._cooldown_until = max(
+                self._cooldown_until, time.monotonic() + delay
+                )
+        METRICS.inc("llm_rate_limited_total")
+
+        return delay
+
+    def cooldown(self) -> float:
+        return max(0.0, self._cooldown_until - time.monotonic())
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        if not is_rate_limit(error) or attempt == self.max_retries:
+            return False
+
+        self.backoff_delay(error, attempt)
+        METRICS.inc("llm_retries_total")
+
+        return True
+
+    @staticmethod
+    def to_result(message) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def submit(self, messages: list, stop, kwargs: dict) -> Future:
+        """Вызов LLM в потоке, слот освобождается по завершении
+        """
+        future = self._executor.submit(
+            contextvars.copy_context().run,
+            self.llm.invoke, messages, stop=stop, **kwargs
+            )
+        future.add_done_callback(lambda _: self._limiter.release())
+
+        return future
+
+    def call(self, messages: list, stop, kwargs: dict):
+        """Один вызов LLM с таймаутом и дублирующим запросом
+        """
+        self._limiter.acquire(self.queue_timeout)
+        start_time = time.perf_counter()
+        futures = [self.submit(messages, stop, kwargs)]
+
+        if self.hedge_after is not None:
+            done, _ = wait(
+                futures, timeout=min(self.hedge_after, self.timeout)
+                )
+            if not done and self._limiter.try_acquire():
+                METRICS.inc("llm_hedges_total")
+                futures.append(self.submit(messages, stop, kwargs))
+
+        pending = set(futures)
+        while pending:
+            remaining = self.timeout - (time.perf_counter() - start_time)
+            done, pending = wait(
+                pending, timeout=max(0.0, remaining),
+                return_when=FIRST_COMPLETED
+                )
+            if not done:
+                break
+
+            future = done.pop()
+            # Ошибка одного из запросов не отменяет второй
+            if future.exception() is None or not pending:
+                if future is not futures[0]:
+                    METRICS.inc("llm_hedge_wins_total")
+                METRICS.observe(
+                    "llm_call_seconds", time.perf_counter() - start_time
+                    )
+                return future.result()
+
+        METRICS.inc("llm_timeouts_total")
+        raise TimeoutError(f"LLM call timed out after {self.timeout}s")
+
+    def create_task(self, messages: list, stop, kwargs: dict):
+        """Асинхронный вызов LLM, слот освобождается по завершении
+        или отмене
+        """
+        task = asyncio.ensure_future(
+            self.llm.ainvoke(messages, stop=stop, **kwargs)
+            )
+        task.add_done_callback(lambda _: self._limiter.release())
+
+        return task
+
+    async def acall(self, messages: list, stop, kwargs: dict):
+        await self._limiter.aacquire(self.queue_timeout)
+        start_time = time.perf_counter()
+        tasks = [self.create_task(messages, stop, kwargs)]
+
+        try:
+            if self.hedge_after is not None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=min(self.hedge_after, self.timeout)
+                    )
+                if not done and self._limiter.try_acquire():
+                    METRICS.inc("llm_hedges_total")
+                    tasks.append(self.create_task(messages, stop, kwargs))
+
+            pending = set(tasks)
+            while pending:
+                remaining = self.timeout - (time.perf_counter() - start_time)
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, remaining),
+                    return_when=asyncio.FIRST_COMPLETED
+                    )
+                if not done:
+                    break
+
+                task = done.pop()
+                if task.exception() is None or not pending:
+                    if task is not tasks[0]:
+                        METRICS.inc("llm_hedge_wins_total")
+                    METRICS.observe(
+                        "llm_call_seconds", time.perf_counter() - start_time
+                        )
+                    return task.result()
+        finally:
+            # Отмена проигравшего запроса освобождает его слот
+            for task in tasks:
+                task.cancel()
+
+        METRICS.inc("llm_timeouts_total")
+        raise TimeoutError(f"LLM call timed out after {self.timeout}s")
+
+    def invoke_with_retries(self, messages: list, stop, kwargs: dict):
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.cooldown())
+            try:
+                return self.call(messages, stop, kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+
+    async def ainvoke_with_retries(self, messages: list, stop, kwargs: dict):
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.cooldown())
+            try:
+                return await self.acall(messages, stop, kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.dedup:
+            return self.to_result(
+                self.invoke_with_retries(messages, stop, kwargs)
+                )
+
+        key = self.dedup_key(messages, stop, kwargs)
+        while True:
+            leader, future = self.join_inflight(key)
+            if leader:
+                break
+            try:
+                return self.to_result(future.result().model_copy())
+            except LeaderCancelledError:
+                # Ожидающий повторяет вызов и может стать первым
+                continue
+
+        try:
+            message = self.invoke_with_retries(messages, stop, kwargs)
+        except BaseException as e:
+            self.leave_inflight(key, future, error=e)
+            raise
+        self.leave_inflight(key, future, result=message)
+
+        return self.to_result(message)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None,
+                         **kwargs):
+        if not self.dedup:
+            return self.to_result(
+                await self.ainvoke_with_retries(messages, stop, kwargs)
+                )
+
+        key = self.dedup_key(messages, stop, kwargs)
+        while True:
+            leader, future = self.join_inflight(key)
+            if leader:
+                break
+            try:
+                # Отмена ожидающего не отменяет общий вызов
+                message = await asyncio.shield(asyncio.wrap_future(future))
+            except LeaderCancelledError:
+                # Ожидающий повторяет вызов и может стать первым
+                continue
+            return self.to_result(message.model_copy())
+
+        try:
+            message = await self.ainvoke_with_retries(messages, stop, kwargs)
+        except BaseException as e:
+            self.leave_inflight(key, future, error=e)
+            raise
+        self.leave_inflight(key, future, result=message)
+
+        return self.to_result(message)
+
+    def first_chunk(self, iterator):
+        """Первый фрагмент потока с таймаутом
+
+        При таймауте поток пула всё ещё ждёт фрагмент, поэтому слот
+        освобождается только по завершении этого потока.
+
+        Raises:
+            StreamTimeoutError: Фрагмент не пришёл за timeout секунд
+        """
+        future = self._executor.submit(
+            contextvars.copy_context().run, next, iterator, None
+            )
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise
+            future.add_done_callback(lambda _: self._limiter.release())
+            METRICS.inc("llm_timeouts_total")
+            raise StreamTimeoutError(
+                f"LLM stream timed out after {self.timeout}s"
+                )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.cooldown())
+            self._limiter.acquire(self.queue_timeout)
+            holds_slot = True
+            try:
+                iterator = iter(self.llm.stream(messages, stop=stop, **kwargs))
+                try:
+                    chunk = self.first_chunk(iterator)
+                except StreamTimeoutError:
+                    holds_slot = False
+                    raise
+                except Exception as e:
+                    if self.should_retry(e, attempt):
+                        continue
+                    raise
+
+                while chunk is not None:
+                    yield ChatGenerationChunk(message=chunk)
+                    chunk = next(iterator, None)
+                return
+            finally:
+                if holds_slot:
+                    self._limiter.release()
+
+    async def _astream(self, messages, stop=None, run_manager=None,
+                       **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.cooldown())
+            await self._limiter.aacquire(self.queue_timeout)
+            iterator = self.llm.astream(messages, stop=stop, **kwargs)
+            try:
+                try:
+                    chunk = await asyncio.wait_for(
+                        iterator.__anext__(), self.timeout
+                        )
+                except asyncio.TimeoutError:
+                    METRICS.inc("llm_timeouts_total")
+                    raise TimeoutError(
+                        f"LLM stream timed out after {self.timeout}s"
+                        )
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    if self.should_retry(e, attempt):
+                        continue
+                    raise
+
+                yield ChatGenerationChunk(message=chunk)
+                async for chunk in iterator:
+                    yield ChatGenerationChunk(message=chunk)
+                return
+            finally:
+                await iterator.aclose()
+                self._limiter.release()
@@ -0,0 +1,241 @@
+import os
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+
+
+# Версия опубликованного индекса FAISS на Yandex диске. SHA-256
+# закрепляется при публикации версии (значения из checksums.json
+# в кэше артефактов), до этого загрузка сверяется с суммой,
+# которую возвращает Yandex диск
+INDEX_VERSION = "food_faiss_index-v1"
+INDEX_ARTIFACTS = [
+    {
+        "name": "index.faiss",
+        "link": "https://disk.yandex.ru/d/P2qlEw1CgZNMIA",
+        "sha256": None
+    },
+    {
+        "name": "index.pkl",
+        "link": "https://disk.yandex.ru/d/W-P2GCK64yNufQ",
+        "sha256": None
+    }
+]
+
+WARM_UP_QUERY = "курица с рисом"
+
+
+class AgentLoader:
+    """Загрузка агента в фоновом потоке с отчётом о готовности
+
+    Тяжёлые модули (langchain, transformers, torch) импортируются
+    только в потоке загрузки, поэтому интерфейс отображается сразу,
+    а длительность каждого этапа запуска сохраняется в timings.
+    """
+    def __init__(self, index_path: str = "data/processed/food_faiss_index",
+                 cache_path: str = "data/cache", metrics_port: int = None,
+                 trace_log: str = None, llm_concurrency: int = 8,
+                 hedge_after: float = None, intent_threshold: float = 0.75,
+                 intent_margin: float = 0.05):
+        """Инициализация загрузчика
+
+        Args:
+            index_path (str): Директория локально собранного индекса
+            cache_path (str): Директория кэша артефактов и изображений
+            metrics_port (int): Порт эндпоинта /metrics в формате
+                Prometheus, None - без эндпоинта
+            trace_log (str): Файл лога этапов запросов в JSON Lines,
+                "-" - stderr, None - без лога
+            llm_concurrency (int): Количество одновременных вызовов LLM
+            hedge_after (float): Задержка в секундах, после которой
+                отправляется дублирующий запрос к LLM, None - без
+                дублирования
+            intent_threshold (float): Минимальная косинусная близость
+                запроса к центроиду класса для локальной классификации
+            intent_margin (float): Минимальный отрыв лучшего класса
+                от второго для локальной классификации
+        """
+        self.index_path = index_path
+        self.cache_path = cache_path
+        self.metrics_port = metrics_port
+        self.trace_log = trace_log
+        self.llm_concurrency = llm_concurrency
+        self.hedge_after = hedge_after
+        self.intent_threshold = intent_threshold
+        self.intent_margin = intent_margin
+
+        self.state = "pending"
+        self.phase = None
+        self.error = None
+        self.timings = {}
+
+        self.agent = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замер длительности этапа запуска
+        """
+        self.phase = name
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start_time
+
+    def start(self):
+        """Запуск загрузки в фоновом потоке
+        """
+        if self._thread is None:
+            self.state = "loading"
+            self._thread = threading.Thread(
+                target=self.run, name="agent-loader", daemon=True
+                )
+            self._thread.start()
+
+        return self
+
+    def run(self):
+        start_time = time.perf_counter()
+        try:
+            self.agent = self.load()
+            self.state = "ready"
+            self.phase = None
+        except Exception as e:
+            logging.exception("Agent startup failed")
+            self.state = "failed"
+            self.error = repr(e)
+        finally:
+            self.timings["total"] = time.perf_counter() - start_time
+            self._ready.set()
+
+        logging.info("Startup timings: " + ", ".join(
+            f"{name}={seconds:.2f}s" for name, seconds in self.timings.items()
+            ))
+
+    def wait(self, timeout: float = None):
+        """Ожидание готовности агента
+
+        Args:
+            timeout (float): Максимальное время ожидания в секундах
+
+        Returns:
+            AgentSystem: Агент или None, если он ещё не готов
+        """
+        self.start()
+        self._ready.wait(timeout)
+
+        return self.agent
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> dict:
+        """Состояние загрузки для интерфейса
+
+        Returns:
+            dict: Состояние, текущий этап, длительность этапов и ошибка
+        """
+        return {
+            "state": self.state,
+            "phase": self.phase,
+            "timings": dict(self.timings),
+            "error": self.error
+        }
+
+    def index_dir(self) -> str:
+        """Локально собранный индекс или скачанный в кэш артефактов
+        """
+        if os.path.exists(os.path.join(self.index_path, "index.faiss")):
+            return self.index_path
+
+        from tools.downloader import ArtifactCache
+
+        return ArtifactCache(
+            os.path.join(self.cache_path, "artifacts"), INDEX_VERSION
+            ).fetch(INDEX_ARTIFACTS)
+
+    def load(self):
+        """Загрузка агента по этапам
+
+        Returns:
+            AgentSystem: Агент
+        """
+        with self.stage("download_index"):
+            index_path = self.index_dir()
+
+        with self.stage("imports"):
+            from langchain_openai import ChatOpenAI
+            from langchain_huggingface import HuggingFaceEmbeddings
+
+            from model.agent import AgentSystem
+            from model.intent import IntentClassifier
+            from model.llm_client import LLMClient
+            from tools.cache import CachedEmbeddings, SemanticCache
+            from tools.images import ImageCache, ImageSearch
+            from tools.metrics import configure_trace_log, start_metrics_server
+            from tools.retriever import CachedRetriever, load_retriever
+
+        if self.metrics_port:
+            start_metrics_server(self.metrics_port)
+        if self.trace_log:
+            configure_trace_log(self.trace_log)
+
+        with self.stage("embeddings"):
+            embeddings = CachedEmbeddings(
+                HuggingFaceEmbeddings(model_name="sergeyzh/LaBSE-ru-turbo"),
+                capacity=4096
+            )
+
+        with self.stage("index"):
+            retriever = CachedRetriever.wrap(
+                load_retriever(
+                    path_index=index_path,
+                    embeddings=embeddings,
+                    k=3
+                ),
+                capacity=1024
+            )
+
+        with self.stage("agent"):
+            # Повторы на 429 делает LLMClient с общей паузой
+            llm = LLMClient(
+                llm=ChatOpenAI(
+                    base_url="https://api.groq.com/openai/v1",
+                    model="llama-3.3-70b-versatile",
+                    api_key=os.environ.get("OPENAI_API_KEY"),
+                    temperature=0.0,
+                    stream_usage=True,
+                    max_retries=0
+                ),
+                max_concurrency=self.llm_concurrency,
+                hedge_after=self.hedge_after
+            )
+            intent_classifier = IntentClassifier(
+                embeddings=embeddings,
+                embedding_threshold=self.intent_threshold,
+                margin=self.intent_margin
+            )
+
+            agent = AgentSystem(
+                llm=llm,
+                retriever=retriever,
+                k=6,
+                intent_classifier=intent_classifier,
+                response_cache=SemanticCache(embeddings=embeddings),
+                image_search=ImageSearch(
+                    cache=ImageCache(os.path.join(self.cache_path, "images"))
+                    )
+            )
+
+        # Первый проход модели и поиска, эталоны намерений
+        with self.stage("warm_up"):
+            embeddings.embed_query(WARM_UP_QUERY)
+            retriever.retriever.invoke(WARM_UP_QUERY)
+            intent_classifier.get_centroids()
+
+        return agent
@@ -0,0 +1,127 @@
+import re
+import time
+
+from concurrent.futures import Future
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+TASK_ACTIONS = {
+    "About Me": "Рассказал о своих функциях",
+    "Recommend": "Порекомендовал блюдо",
+    "Generate": "Придумал новое блюдо",
+    "Search Image": "Нашел изображение"
+}
+
+
+def summary_fallback(output: str, task: str) -> str:
+    """Детерминированная краткая запись ответа для памяти
+
+    Используется, пока LLM-резюме ответа ещё не готово: действие
+    агента и название блюда (первый жирный текст или первая строка).
+
+    Args:
+        output (str): Ответ агента
+        task (str): Задача, которую выполнил агент
+
+    Returns:
+        str: Краткая запись ответа
+    """
+    action = TASK_ACTIONS.get(task, task)
+    if task == "About Me":
+        return action
+
+    match = re.search(r"\*\*(.+?)\*\*", output)
+    if match:
+        name = match.group(1)
+    else:
+        lines = [line.strip("#*-: ") for line in output.splitlines()]
+        name = next((line for line in lines if line), "")
+
+    return f"{action}: {name[:100]}" if name else action
+
+
+class ChatMemory:
+    """Память агента для одной сессии чата
+
+    AgentSystem не хранит состояние диалога, поэтому один агент
+    обслуживает сколько угодно сессий, каждая со своей памятью.
+    """
+    def __init__(self, k: int = 6, messages: list = None,
+                 summary_timeout: float = 1.0):
+        """Инициализация памяти
+
+        Args:
+            k (int): Количество последних сообщений в памяти
+            messages (list): Начальная история чата
+            summary_timeout (float): Сколько секунд ждать фоновое
+                резюме ответа перед следующим запросом
+        """
+        self.k = k
+        self.messages = list(messages or [])
+        self.summary_timeout = summary_timeout
+
+        # Ответы, резюме которых ещё считается в фоне
+        self.pending = []
+
+    def get_messages(self) -> list:
+        """Возвращает текущие состояние памяти
+
+        Готовые фоновые резюме подставляются вместо временных записей,
+        неготовые ожидаются не дольше summary_timeout.
+
+        Returns:
+            list: История чата
+        """
+        self.resolve_pending()
+
+        return list(self.messages)
+
+    def add_turn(self, query: str, answer, fallback: str = None):
+        """Сохранение запроса пользователя и ответа агента
+
+        Args:
+            query (str): Запрос пользователя
+            answer: Краткий ответ агента для памяти или Future
+                с его фоновым вычислением
+            fallback (str): Запись в памяти, пока Future не завершён
+        """
+        self.messages.append(HumanMessage(content=f"Query: {query}"))
+
+        if isinstance(answer, Future):
+            message = AIMessage(content=f"Answer: {fallback}")
+            self.pending.append((answer, message))
+        else:
+            message = AIMessage(content=f"Answer: {answer}")
+
+        self.messages.append(message)
+        self.messages = self.messages[-self.k:]
+
+    def resolve_pending(self):
+        """Подстановка готовых фоновых резюме в историю
+        """
+        deadline = time.monotonic() + self.summary_timeout
+
+        still_pending = []
+        for future, message in self.pending:
+            if not any(m is message for m in self.messages):
+                continue
+
+            try:
+                summary = future.result(
+                    timeout=max(0.0, deadline - time.monotonic())
+                    )
+            except TimeoutError:
+                still_pending.append((future, message))
+                continue
+            except Exception:
+                # Остаётся детерминированная запись
+                continue
+
+            self.messages = [
+                AIMessage(content=f"Answer: {summary}") if m is message
+                else m
+                for m in self.messages
+            ]
+
+        self.pending = still_pending
@@ -36,7 +36,9 @@ Return answer in the same language as the query.
 {descripition}
 </descripition>
 
+<chat_history>
 {chat_history}
+</chat_history>
 Query: {query}
 
 Answer:"""
@@ -52,7 +54,9 @@ Return answer in the same language as the query.
 {descripition}
 </descripition>
 
+<chat_history>
 {chat_history}
+</chat_history>
 Query: {query}
 
 Answer:"""
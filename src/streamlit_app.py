@@ -1,60 +1,83 @@
 import os
+import time
 import logging
-import asyncio
 import streamlit as st
 
-from langchain_openai import ChatOpenAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from model.loader import AgentLoader
+from tools.images import enforce_image_budget
+from tools.speech import (
+    HFInferenceBackend,
+    SpeechClient,
+    WhisperServerBackend
+)
 
-from model.agent import AgentSystem
-from tools.downloader import download_from_yandex
-from tools.utils import spech2text
+
+# Бюджет памяти на изображения в истории чата одной сессии
+SESSION_IMAGE_BUDGET = 2 * 2 ** 20
 
 
 @st.cache_resource
 def load_agent():
-    """Инициализация агента из cache streamlit
+    """Запуск фоновой загрузки агента, общей для всех сессий
     """
-    # Инициализация LLM
-    llm = ChatOpenAI(
-        base_url="https://api.groq.com/openai/v1",
-        model="llama-3.3-70b-versatile",
-        api_key=os.environ.get("OPENAI_API_KEY"),
-        temperature=0.0
-    )
+    metrics_port = os.environ.get("METRICS_PORT")
+    hedge_after = os.environ.get("LLM_HEDGE_AFTER")
 
-    # Скачивание FAISS индекса
-    faiss_index_path = "data/processed/food_faiss_index"
-
-    if not os.path.exists(faiss_index_path + "index.faiss"):
-        download_from_yandex(
-            public_link="https://disk.yandex.ru/d/P2qlEw1CgZNMIA",
-            save_path=faiss_index_path
-            )
-
-    if not os.path.exists(faiss_index_path + "index.pkl"):
-        download_from_yandex(
-            public_link="https://disk.yandex.ru/d/W-P2GCK64yNufQ",
-            save_path=faiss_index_path
-            )
-
-    # Инициализация ретривера
-    db = FAISS.load_local(
-        folder_path="data/processed/food_faiss_index",
-        embeddings=HuggingFaceEmbeddings(model_name="sergeyzh/LaBSE-ru-turbo"),
-        allow_dangerous_deserialization=True
-    )
+    return AgentLoader(
+        metrics_port=int(metrics_port) if metrics_port else None,
+        trace_log=os.environ.get("TRACE_LOG"),
+        llm_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8)),
+        hedge_after=float(hedge_after) if hedge_after else None,
+        intent_threshold=float(os.environ.get("INTENT_THRESHOLD", 0.75)),
+        intent_margin=float(os.environ.get("INTENT_MARGIN", 0.05))
+    ).start()
 
-    retriever = db.as_retriever(
-        search_type="similarity",
-        search_kwargs={'k': 3}
-    )
 
-    # Инициализация агента
-    agent_executor = AgentSystem(llm=llm, retriever=retriever, k=6)
+@st.cache_resource
+def load_speech_client():
+    """Клиент распознавания речи, общий для всех сессий
+
+    Если задан WHISPER_URL, используется локальный сервер,
+    совместимый с OpenAI Whisper, иначе HuggingFace Inference API.
+    """
+    whisper_url = os.environ.get("WHISPER_URL")
+    backend = WhisperServerBackend(whisper_url) if whisper_url \
+        else HFInferenceBackend()
+
+    return SpeechClient(backend=backend)
+
+
+def stream_answer(loader: AgentLoader, user_query: str, placeholder) -> dict:
+    """Вызов агента с выводом ответа по мере генерации
+
+    Args:
+        loader (AgentLoader): Загрузчик агента
+        user_query (str): Запрос пользователя
+        placeholder: Элемент streamlit для вывода ответа
+
+    Returns:
+        dict: Результат системы цепочек
+    """
+    # Запрос, отправленный во время загрузки, ждёт готовности
+    agent_executor = loader.wait()
+    if agent_executor is None:
+        raise RuntimeError(loader.error)
+
+    if "agent_memory" not in st.session_state:
+        st.session_state.agent_memory = agent_executor.new_memory()
+
+    agent_result = {"output": None}
+    answer = ""
+    for event in agent_executor.stream(
+        user_query, st.session_state.agent_memory
+    ):
+        if event["event"] == "token":
+            answer += event["text"]
+            placeholder.markdown(answer + "▌")
+        elif event["event"] == "end":
+            agent_result = event["result"]
 
-    return agent_executor
+    return agent_result
 
 
 # Параметры страницы
@@ -64,8 +87,9 @@ st.set_page_config(
         layout="wide"
     )
 
-# Инициализация агента
-agent_executor = load_agent()
+# Фоновая загрузка агента
+agent_loader = load_agent()
+startup = agent_loader.status()
 
 # Левый sidebar
 with st.sidebar:
@@ -97,17 +121,30 @@ with st.sidebar:
     # Голосовой ввод
     audio_input = st.experimental_audio_input("Голосовой ввод 🎙️")
 
-st.title("🤖AI ChatBot💬 (Online 🟢)")
-
-# Инициализация сессии и памяти агента
+    # Длительность этапов запуска
+    if startup["timings"]:
+        with st.expander("Запуск агента"):
+            st.table({
+                "Этап": list(startup["timings"]),
+                "Секунды": [
+                    round(seconds, 2)
+                    for seconds in startup["timings"].values()
+                ]
+            })
+
+if startup["state"] == "ready":
+    st.title("🤖AI ChatBot💬 (Online 🟢)")
+elif startup["state"] == "failed":
+    st.title("🤖AI ChatBot💬 (Offline 🔴)")
+    st.error(f"Не удалось запустить агента: {startup['error']}")
+else:
+    st.title("🤖AI ChatBot💬 (Загрузка ⏳)")
+    st.caption(f"Этап запуска: {startup['phase'] or 'подготовка'}")
+
+# Инициализация сессии
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-if "agent_memory" not in st.session_state:
-    st.session_state.agent_memory = []
-
-agent_executor.initial_memory(st.session_state.agent_memory)
-
 # Ввод запроса пользователя
 text_input = st.chat_input("Какие ингредиенты предпочитаете?")
 
@@ -128,7 +165,7 @@ for message in st.session_state.messages:
 if text_input or audio_input:
     user_query = text_input
     if text_input is None:
-        speech_text = asyncio.run(spech2text(audio_file=audio_input))
+        speech_text = load_speech_client().transcribe(audio_input)
         user_query = speech_text['text'].strip()
 
     # Запрос пользователя
@@ -141,34 +178,34 @@ if text_input or audio_input:
             "content": user_query
         })
 
-    # Вызов агента
-    try:
-        agent_result = agent_executor.invoke(user_query)
-        st.session_state.agent_memory = agent_executor.get_chat_history()
-    except Exception as e:
-        agent_result = {
-            "output": None
-            }
-        logging.error(e)
-
-    # Ответ агента
+    # Вызов агента с выводом ответа по мере генерации
     with st.chat_message("assistant"):
+        placeholder = st.empty()
+
+        try:
+            agent_result = stream_answer(agent_loader, user_query, placeholder)
+        except Exception as e:
+            agent_result = {
+                "output": None
+                }
+            logging.error(e)
+
         if isinstance(agent_result['output'], str):
             agent_content = agent_result['output']
 
-            st.markdown(agent_result['output'])
+            placeholder.markdown(agent_content)
         elif agent_result['output'] is None:
             agent_content = "Не могу обработать запрос, " + \
                 "попробуйте чуть позже!😓"
 
-            st.markdown(agent_content)
+            placeholder.markdown(agent_content)
         else:
             agent_content = {
                 "image": agent_result['output'],
                 "caption": "Источник: " + agent_result['url']
             }
 
-            st.image(
+            placeholder.image(
                 image=agent_content['image'],
                 caption=agent_content['caption']
                 )
@@ -178,6 +215,10 @@ if text_input or audio_input:
             "role": "assistant",
             "content": agent_content
         })
-
+    enforce_image_budget(st.session_state.messages, SESSION_IMAGE_BUDGET)
+elif startup["state"] == "loading":
+    # Обновление статуса загрузки
+    time.sleep(1)
+    st.rerun()
 
 
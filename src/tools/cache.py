@@ -0,0 +1,255 @@
+import re
+import time
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+from tools.metrics import record_cache
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация текста запроса для ключа кэша
+
+    Args:
+        query (str): Текст запроса
+
+    Returns:
+        str: Запрос в нижнем регистре без лишних пробелов и пунктуации
+            по краям
+    """
+    return re.sub(r"\s+", " ", query.lower()).strip(" .,!?;:\"'")
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением размера и TTL
+    """
+    def __init__(self, capacity: int = 1024, ttl: float = None,
+                 name: str = None):
+        """Инициализация кэша
+
+        Args:
+            capacity (int): Максимальное количество записей
+            ttl (float): Время жизни записи в секундах, None - бессрочно
+            name (str): Имя кэша в метриках, None - без метрик
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.name = name
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            hit = item is not None and (
+                item[1] is None or item[1] > time.monotonic()
+            )
+            if hit:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+
+        if self.name is not None:
+            record_cache(self.name, hit)
+
+        return item[0] if hit else default
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Статистика кэша
+
+        Returns:
+            dict: Размер, попадания, промахи и доля попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Модель эмбеддингов с LRU-кэшем по нормализованному тексту
+    """
+    def __init__(self, embeddings, capacity: int = 4096):
+        """Инициализация кэша
+
+        Args:
+            embeddings: Исходная модель эмбеддингов
+            capacity (int): Максимальное количество эмбеддингов в кэше
+        """
+        self.embeddings = embeddings
+        self.cache = LRUCache(capacity=capacity, name="embeddings")
+
+    def embed_query(self, text: str) -> list:
+        key = normalize_query(text)
+
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+
+        return vector
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [normalize_query(text) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+
+        # Модель вызывается одним батчем только для промахов
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents(
+                [texts[i] for i in missing]
+                )
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+
+        return vectors
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+class SemanticCache:
+    """Семантический кэш ответов агента
+
+    Ответ переиспользуется, если совпадают задача, найденные
+    ретривером рецепты и история чата, а эмбеддинг запроса
+    достаточно близок к эмбеддингу запроса из кэша.
+    """
+    def __init__(self, embeddings, threshold: float = 0.92,
+                 max_size: int = 1000, ttl: float = 3600,
+                 variants: int = 8):
+        """Инициализация кэша
+
+        Args:
+            embeddings: Модель эмбеддингов запросов
+            threshold (float): Минимальная косинусная близость запросов
+            max_size (int): Максимальное количество наборов рецептов
+            ttl (float): Время жизни ответа в секундах
+            variants (int): Количество запросов на один набор рецептов
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.variants = variants
+
+        self.entries = LRUCache(capacity=max_size, ttl=ttl)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(
+            self.embeddings.embed_query(query), dtype=np.float32
+            )
+
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    @staticmethod
+    def key(task: str, doc_ids: tuple, history: str) -> tuple:
+        return (
+            task, doc_ids, hashlib.sha1(history.encode("utf-8")).hexdigest()
+            )
+
+    def lookup(self, task: str, query: str, doc_ids: tuple,
+               history: str = ""):
+        """Поиск ответа в кэше
+
+        Args:
+            task (str): Задача агента
+            query (str): Запрос пользователя
+            doc_ids (tuple): id найденных рецептов
+            history (str): История чата в том виде, в котором она
+                попадает в промпт
+
+        Returns:
+            dict: Ответ из кэша или None
+        """
+        variants = self.entries.get(self.key(task, doc_ids, history))
+
+        result = None
+        if variants:
+            vector = self.embed(query)
+            score, cached = max(
+                ((float(vector @ v), r) for v, r in variants),
+                key=lambda item: item[0]
+            )
+            if score >= self.threshold:
+                result = dict(cached)
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache("response", result is not None)
+
+        return result
+
+    def store(self, task: str, query: str, doc_ids: tuple, result: dict,
+              history: str = ""):
+        """Сохранение ответа в кэш
+
+        Args:
+            task (str): Задача агента
+            query (str): Запрос пользователя
+            doc_ids (tuple): id найденных рецептов
+            result (dict): Ответ агента
+            history (str): История чата в том виде, в котором она
+                попадает в промпт
+        """
+        key = self.key(task, doc_ids, history)
+        variants = list(self.entries.get(key) or [])
+        variants.append((self.embed(query), dict(result)))
+
+        self.entries.put(key, variants[-self.variants:])
+
+    def stats(self) -> dict:
+        """Статистика кэша
+
+        Returns:
+            dict: Количество наборов рецептов, попадания, промахи
+                и доля попаданий
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
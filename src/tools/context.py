@@ -0,0 +1,333 @@
+import re
+import logging
+import threading
+
+from tools.metrics import METRICS, SIZE_BUCKETS, annotate
+
+
+TOKEN_ENCODING = "cl100k_base"
+# Оценка для русского текста, если словарь tiktoken недоступен
+CHARS_PER_TOKEN = 3.0
+
+# Поля рецепта в порядке важности для каждой задачи
+TASK_FIELDS = {
+    "Recommend": [
+        "Название",
+        "Ссылка",
+        "Ингредиенты",
+        "Время приготовления",
+        "Пищевая ценность",
+        "Тип кухни"
+    ],
+    "Generate": [
+        "Название",
+        "Ингредиенты",
+        "Тип кухни"
+    ]
+}
+FIELD_LABELS = {"Ссылка": "Подробнее"}
+# Для генерации нового блюда граммовки ингредиентов не нужны
+NAMES_ONLY = {"Generate": {"Ингредиенты"}}
+
+MIN_FIELD_TOKENS = 8
+
+
+class TokenCounter:
+    """Подсчёт токенов через tiktoken
+
+    Если tiktoken или его словарь недоступен (нет сети при первом
+    запуске), количество токенов оценивается по длине текста.
+    """
+    def __init__(self, encoding: str = TOKEN_ENCODING,
+                 chars_per_token: float = CHARS_PER_TOKEN):
+        """Инициализация счётчика
+
+        Args:
+            encoding (str): Название словаря tiktoken
+            chars_per_token (float): Символов на токен для оценки
+        """
+        self.encoding_name = encoding
+        self.chars_per_token = chars_per_token
+
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        import tiktoken
+
+                        self._encoding = tiktoken.get_encoding(
+                            self.encoding_name
+                            )
+                    except Exception as e:
+                        logging.warning(
+                            "tiktoken unavailable, estimating tokens: "
+                            f"{type(e).__name__}"
+                            )
+                    self._loaded = True
+
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+
+        return int(-(-len(text) // self.chars_per_token))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до max_tokens токенов
+
+        Args:
+            text (str): Текст
+            max_tokens (int): Максимальное количество токенов
+
+        Returns:
+            str: Текст целиком или обрезанный по слову с «…»
+        """
+        if self.count(text) <= max_tokens:
+            return text
+        if max_tokens <= 1:
+            return ""
+
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)[:max_tokens - 1]
+            cut = self.encoding.decode(tokens)
+        else:
+            cut = text[:int((max_tokens - 1) * self.chars_per_token)]
+
+        # Без обрывка последнего слова
+        if " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+
+        return cut.rstrip(" ,;:") + "…"
+
+
+def recipe_fields(doc) -> dict:
+    """Поля рецепта из документа ретривера
+
+    Поля берутся из метаданных, а недостающие - из строк
+    «Поле: значение» текста документа.
+
+    Args:
+        doc: Документ ретривера
+
+    Returns:
+        dict: Значения полей рецепта
+    """
+    fields = {}
+    for line in doc.page_content.splitlines():
+        name, sep, value = line.partition(": ")
+        if sep:
+            fields[name.strip()] = value.strip()
+
+    fields.update({
+        name: str(value).strip() for name, value in doc.metadata.items()
+        if isinstance(value, str) and value.strip()
+    })
+
+    return fields
+
+
+def ingredient_names(ingredients: str) -> str:
+    """Названия ингредиентов без количества
+
+    Args:
+        ingredients (str): Строка вида «курица: 300 г, рис: 1 стакан»
+
+    Returns:
+        str: Строка вида «курица, рис»
+    """
+    return ", ".join(
+        item.split(":")[0].strip()
+        for item in re.split(r",\s*(?![^()]*\))", ingredients)
+        if item.strip()
+    )
+
+
+class ContextBuilder:
+    """Сборка переменных промпта ответа в пределах бюджета токенов
+
+    История чата выводится строками без repr объектов сообщений,
+    от новых к старым, пока хватает доли бюджета истории. Остаток
+    бюджета делится между найденными рецептами по порядку выдачи,
+    из каждого рецепта берутся только нужные задаче поля, а длинные
+    поля обрезаются.
+    """
+    def __init__(self, max_context_tokens: int = 1500,
+                 history_share: float = 0.3, max_query_tokens: int = 256,
+                 max_message_tokens: int = 64, counter: TokenCounter = None):
+        """Инициализация сборщика
+
+        Args:
+            max_context_tokens (int): Бюджет на историю и рецепты
+            history_share (float): Максимальная доля бюджета на историю
+            max_query_tokens (int): Максимальная длина запроса
+            max_message_tokens (int): Максимальная длина сообщения
+                в истории
+            counter (TokenCounter): Счётчик токенов
+        """
+        self.max_context_tokens = max_context_tokens
+        self.history_share = history_share
+        self.max_query_tokens = max_query_tokens
+        self.max_message_tokens = max_message_tokens
+        self.counter = counter or TokenCounter()
+
+    def history(self, messages: list, max_tokens: int = None) -> str:
+        """Компактная история чата
+
+        Args:
+            messages (list): Сообщения памяти сессии
+            max_tokens (int): Бюджет истории, по умолчанию доля
+                history_share общего бюджета
+
+        Returns:
+            str: Сообщения строками от старых к новым
+        """
+        if max_tokens is None:
+            max_tokens = int(self.max_context_tokens * self.history_share)
+
+        lines = []
+        left = max_tokens
+        for message in reversed(messages or []):
+            line = self.counter.truncate(
+                " ".join(str(message.content).split()),
+                self.max_message_tokens
+                )
+            tokens = self.counter.count(line) + 1
+            if tokens > left:
+                break
+            lines.append(line)
+            left -= tokens
+
+        return "\n".join(reversed(lines))
+
+    def recipe(self, doc, task: str, max_tokens: int) -> tuple:
+        """Поля одного рецепта в пределах бюджета
+
+        Returns:
+            tuple: Текст рецепта и признак обрезки
+        """
+        fields = recipe_fields(doc)
+
+        lines = []
+        left = max_tokens
+        truncated = False
+        for name in TASK_FIELDS[task]:
+            value = fields.get(name)
+            if not value:
+                continue
+            if name in NAMES_ONLY.get(task, ()):
+                value = ingredient_names(value)
+
+            label = f"{FIELD_LABELS.get(name, name)}: "
+            line = label + value
+            tokens = self.counter.count(line) + 1
+            if tokens > left:
+                truncated = True
+                # Обрезается значение поля, а не его название
+                value_tokens = left - self.counter.count(label) - 1
+                if value_tokens >= MIN_FIELD_TOKENS:
+                    lines.append(
+                        label + self.counter.truncate(value, value_tokens)
+                        )
+                break
+            lines.append(line)
+            left -= tokens
+
+        return "\n".join(lines), truncated
+
+    def recipes(self, docs: list, task: str, max_tokens: int) -> str:
+        """Рецепты для промпта, бюджет делится по порядку выдачи
+
+        Неизрасходованная часть бюджета коротких рецептов переходит
+        к следующим.
+
+        Args:
+            docs (list): Документы ретривера
+            task (str): Задача агента из TASK_FIELDS
+            max_tokens (int): Бюджет на рецепты
+
+        Returns:
+            str: Рецепты через пустую строку
+        """
+        blocks = []
+        left = max_tokens
+        truncated = 0
+        for i, doc in enumerate(docs):
+            share = left // (len(docs) - i)
+            if share < MIN_FIELD_TOKENS:
+                break
+
+            block, cut = self.recipe(doc, task, share)
+            if not block:
+                continue
+            blocks.append(block)
+            truncated += cut
+            left -= self.counter.count(block) + 2
+
+        annotate(docs_in_prompt=len(blocks), docs_truncated=truncated)
+
+        return "\n\n".join(blocks)
+
+    def assemble(self, task: str, dict_chain: dict) -> dict:
+        """Переменные промпта ответа
+
+        Args:
+            task (str): Задача агента
+            dict_chain (dict): Запрос, история и найденные рецепты
+
+        Returns:
+            dict: query, chat_history и, для задач с рецептами,
+                descripition
+        """
+        query = self.counter.truncate(
+            dict_chain["input"], self.max_query_tokens
+            )
+        if task not in TASK_FIELDS:
+            return {"query": query}
+
+        chat_history = self.history(dict_chain.get("chat_history"))
+        history_tokens = self.counter.count(chat_history)
+        descripition = self.recipes(
+            dict_chain["docs"], task, self.max_context_tokens - history_tokens
+            )
+        docs_tokens = self.counter.count(descripition)
+
+        for part, tokens in (("history", history_tokens),
+                             ("docs", docs_tokens)):
+            METRICS.observe(
+                "agent_context_tokens", tokens, buckets=SIZE_BUCKETS,
+                task=task, part=part
+                )
+        annotate(history_tokens=history_tokens, docs_tokens=docs_tokens)
+
+        return {
+            "descripition": descripition,
+            "chat_history": chat_history,
+            "query": query
+        }
+
+    def report(self, task: str, prompt):
+        """Запись количества токенов итогового промпта
+
+        Args:
+            task (str): Задача агента
+            prompt: Промпт после подстановки переменных
+
+        Returns:
+            Промпт без изменений
+        """
+        tokens = self.counter.count(prompt.to_string())
+        METRICS.observe(
+            "agent_prompt_tokens", tokens, buckets=SIZE_BUCKETS, task=task
+            )
+        annotate(prompt_tokens_estimate=tokens)
+
+        return prompt
@@ -0,0 +1,221 @@
+import zlib
+
+import numpy as np
+
+from tools.lexical import tokenize_ingredients
+
+
+# Простое число Мерсенна 2^31 - 1: a * x помещается в uint64
+MERSENNE_PRIME = (1 << 31) - 1
+
+GROUPS_FILE = "group.npy"
+
+
+def recipe_tokens(metadata: dict) -> set:
+    """Множество признаков рецепта для поиска почти дубликатов
+
+    Args:
+        metadata (dict): Метаданные рецепта
+
+    Returns:
+        set: Основы слов ингредиентов и, с префиксом «#», названия
+    """
+    tokens = set(tokenize_ingredients(metadata.get("Ингредиенты") or ""))
+    tokens.update(
+        "#" + token
+        for token in tokenize_ingredients(metadata.get("Название") or "")
+    )
+
+    return tokens
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+
+    return len(a & b) / len(a | b)
+
+
+class MinHashLSH:
+    """Поиск почти дубликатов по MinHash и LSH
+
+    Сигнатура рецепта - минимумы num_perm хэш-функций по его
+    признакам. Сигнатуры делятся на bands полос, и рецепты,
+    совпавшие хотя бы в одной полосе, становятся кандидатами.
+    Кандидаты проверяются точным коэффициентом Жаккара.
+    """
+    def __init__(self, threshold: float = 0.7, num_perm: int = 128,
+                 bands: int = 32, max_bucket: int = 64, seed: int = 0):
+        """Инициализация поиска
+
+        Args:
+            threshold (float): Минимальный коэффициент Жаккара
+                признаков дубликатов
+            num_perm (int): Длина сигнатуры MinHash
+            bands (int): Количество полос LSH, num_perm делится
+                на bands без остатка
+            max_bucket (int): Размер корзины LSH, начиная с которого
+                рецепты сравниваются только с первым рецептом корзины,
+                а не попарно
+            seed (int): Seed хэш-функций
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_bucket = max_bucket
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signatures(self, token_sets: list,
+                   chunk_size: int = 2048) -> np.ndarray:
+        """Сигнатуры MinHash
+
+        Args:
+            token_sets (list): Множества признаков рецептов
+            chunk_size (int): Количество рецептов в одном проходе
+
+        Returns:
+            np.ndarray: Матрица (рецепты, num_perm), у рецептов
+                без признаков - максимальное значение
+        """
+        hashes = {}
+        signatures = np.full(
+            (len(token_sets), self.num_perm), MERSENNE_PRIME, dtype=np.uint64
+            )
+
+        for start in range(0, len(token_sets), chunk_size):
+            chunk = token_sets[start:start + chunk_size]
+            rows = [i for i, tokens in enumerate(chunk) if tokens]
+            if not rows:
+                continue
+
+            values = np.asarray([
+                hashes.setdefault(token, zlib.crc32(token.encode()))
+                for i in rows for token in chunk[i]
+            ], dtype=np.uint64) % MERSENNE_PRIME
+            offsets = np.cumsum([0] + [len(chunk[i]) for i in rows[:-1]])
+
+            permuted = (values[:, None] * self.a + self.b) % MERSENNE_PRIME
+            signatures[start + np.asarray(rows)] = np.minimum.reduceat(
+                permuted, offsets, axis=0
+                )
+
+        return signatures
+
+    def candidates(self, signatures: np.ndarray):
+        """Пары кандидатов, совпавших хотя бы в одной полосе
+
+        Yields:
+            tuple: Номера двух рецептов
+        """
+        filled = np.flatnonzero(signatures[:, 0] < MERSENNE_PRIME)
+        for band in range(self.bands):
+            rows = signatures[
+                filled, band * self.rows:(band + 1) * self.rows
+                ]
+            _, inverse, counts = np.unique(
+                rows, axis=0, return_inverse=True, return_counts=True
+                )
+            inverse = inverse.ravel()
+
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.cumsum(counts)
+            for bucket in np.flatnonzero(counts > 1):
+                members = filled[
+                    order[bounds[bucket] - counts[bucket]:bounds[bucket]]
+                    ]
+                if len(members) > self.max_bucket:
+                    # Большая корзина сравнивается со своим первым рецептом
+                    for other in members[1:]:
+                        yield members[0], other
+                    continue
+                for i, first in enumerate(members):
+                    for second in members[i + 1:]:
+                        yield first, second
+
+    def groups(self, ids: list, token_sets: list) -> tuple:
+        """Группы почти дубликатов
+
+        Args:
+            ids (list): id векторов рецептов
+            token_sets (list): Множества признаков рецептов
+
+        Returns:
+            tuple: Массив номера группы по id вектора (наименьший id
+                группы, -1 для отсутствующих id) и количество
+                рецептов в группах из нескольких рецептов
+        """
+        parent = list(range(len(ids)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        checked = set()
+        for first, second in self.candidates(self.signatures(token_sets)):
+            pair = (int(first), int(second))
+            if pair in checked:
+                continue
+            checked.add(pair)
+
+            if jaccard(token_sets[first], token_sets[second]) >= \
+                    self.threshold:
+                root_first, root_second = find(first), find(second)
+                if root_first != root_second:
+                    parent[max(root_first, root_second)] = min(
+                        root_first, root_second
+                        )
+
+        ids = np.asarray(ids, dtype=np.int64)
+        roots = np.asarray([find(i) for i in range(len(ids))], dtype=np.int64)
+
+        size = int(ids.max()) + 1 if len(ids) else 0
+        groups = np.full(size, -1, dtype=np.int64)
+        # Номер группы - наименьший id её рецептов
+        representatives = np.full(len(ids), np.iinfo(np.int64).max)
+        np.minimum.at(representatives, roots, ids)
+        groups[ids] = representatives[roots]
+
+        _, counts = np.unique(roots, return_counts=True)
+
+        return groups, int(counts[counts > 1].sum())
+
+
+def collapse(ids: list, groups: np.ndarray, k: int) -> tuple:
+    """Первый рецепт каждой группы дубликатов в порядке выдачи
+
+    Args:
+        ids (list): id рецептов в порядке релевантности
+        groups (np.ndarray): Номер группы по id вектора
+        k (int): Количество рецептов
+
+    Returns:
+        tuple: Не больше k id из разных групп и количество
+            пропущенных дубликатов
+    """
+    seen = set()
+    result = []
+    skipped = 0
+    for doc_id in ids:
+        group = int(groups[doc_id]) if doc_id < len(groups) else -1
+        # Рецепты, добавленные после поиска дубликатов, без группы
+        if group < 0:
+            group = doc_id
+        if group in seen:
+            skipped += 1
+            continue
+
+        seen.add(group)
+        result.append(doc_id)
+        if len(result) == k:
+            break
+
+    return result, skipped
@@ -1,31 +1,330 @@
 import os
+import json
+import time
+import hashlib
+import logging
 import requests
+import threading
 import urllib.parse
 
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHUNK_SIZE = 2 ** 20
+PART_SIZE = 16 * 2 ** 20
+TIMEOUT = (5, 60)
+RETRIES = 3
 
-def download_from_yandex(public_link: str, save_path: str):
-    """Скачивание файла из Yandex диска
+
+def resolve_yandex(public_link: str) -> tuple:
+    """Прямая ссылка на файл из Yandex диска
 
     Args:
         public_link (str): Публичная ссылка на файл
-        save_path (str): Путь директории куда сохранить файл
+
+    Returns:
+        tuple: Ссылка для скачивания и имя файла
     """
     url = "https://cloud-api.yandex.net/v1/disk/public/resources/" + \
         f"download?public_key={public_link}"
-    download_url = requests.get(url).json()["href"]
+    response = requests.get(url, timeout=TIMEOUT)
+    response.raise_for_status()
+
+    download_url = response.json()["href"]
     file_name = urllib.parse.unquote(
         download_url.split("filename=")[1].split("&")[0]
         )
 
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
+    return download_url, file_name
 
-    file_save_path = os.path.join(save_path, file_name)
 
-    with open(file_save_path, "wb") as file:
-        download_response = requests.get(download_url, stream=True)
+def public_sha256(public_link: str) -> str:
+    """SHA-256 файла из метаданных Yandex диска
+
+    Args:
+        public_link (str): Публичная ссылка на файл
+
+    Returns:
+        str: Контрольная сумма или None, если диск её не вернул
+    """
+    response = requests.get(
+        "https://cloud-api.yandex.net/v1/disk/public/resources",
+        params={"public_key": public_link, "fields": "sha256"},
+        timeout=TIMEOUT
+        )
+    response.raise_for_status()
+
+    return response.json().get("sha256")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def probe(url: str) -> tuple:
+    """Размер файла и поддержка HTTP Range
+
+    Returns:
+        tuple: Размер в байтах (или None) и поддержка диапазонов
+    """
+    response = requests.get(
+        url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT
+        )
+    response.close()
+
+    if response.status_code == 206:
+        size = response.headers.get("Content-Range", "").split("/")[-1]
+        return (int(size) if size.isdigit() else None), True
+
+    size = response.headers.get("Content-Length")
+
+    return (int(size) if size else None), False
+
+
+class PartState:
+    """Скачанные части файла, сохраняемые для продолжения загрузки
+    """
+    def __init__(self, path: str, size: int):
+        self.path = path + ".state.json"
+        self.size = size
+        self._lock = threading.Lock()
+
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                state = json.load(file)
+            if state["size"] == size:
+                self.done = set(state["done"])
+
+    def mark(self, part: int):
+        with self._lock:
+            self.done.add(part)
+            with open(self.path + ".tmp", "w") as file:
+                json.dump({"size": self.size, "done": sorted(self.done)}, file)
+            os.replace(self.path + ".tmp", self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def download_part(url: str, path: str, start: int, end: int):
+    """Скачивание диапазона байт в заранее созданный файл
+    """
+    response = requests.get(
+        url, headers={"Range": f"bytes={start}-{end}"},
+        stream=True, timeout=TIMEOUT
+        )
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise IOError(f"Server ignored range request for {url}")
+
+    with open(path, "r+b") as file:
+        file.seek(start)
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            file.write(chunk)
+
+        if file.tell() != end + 1:
+            raise IOError(f"Incomplete part {start}-{end} of {url}")
+
+
+def download_ranges(url: str, path: str, size: int, workers: int):
+    """Параллельное скачивание файла частями с продолжением
+
+    Args:
+        url (str): Ссылка на файл
+        path (str): Путь временного файла
+        size (int): Размер файла в байтах
+        workers (int): Количество потоков
+    """
+    state = PartState(path, size)
+    if not state.done or not os.path.exists(path):
+        state.done = set()
+        with open(path, "wb") as file:
+            file.truncate(size)
+
+    parts = [
+        (i, start, min(start + PART_SIZE, size) - 1)
+        for i, start in enumerate(range(0, size, PART_SIZE))
+        if i not in state.done
+    ]
+    if len(parts) < -(-size // PART_SIZE):
+        logging.info(f"Resuming {path}: {len(parts)} parts left")
+
+    def task(part):
+        i, start, end = part
+        for attempt in range(RETRIES + 1):
+            try:
+                download_part(url, path, start, end)
+                break
+            except (requests.RequestException, IOError) as e:
+                if attempt == RETRIES:
+                    raise
+                logging.warning(f"Part {i} of {url}: {e!r}")
+                time.sleep(2 ** attempt)
+        state.mark(i)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() пробрасывает первую ошибку скачивания
+        list(executor.map(task, parts))
+
+    state.clear()
 
-        for chunk in download_response.iter_content(chunk_size=1024):
-            if chunk:
+
+def download_stream(url: str, path: str):
+    """Последовательное скачивание, если сервер не поддерживает Range
+    """
+    with requests.get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        with open(path, "wb") as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
                 file.write(chunk)
-                file.flush()
+
+
+def download_file(url: str, path: str, sha256: str = None,
+                  workers: int = 4) -> str:
+    """Скачивание файла с проверкой контрольной суммы
+
+    Файл скачивается во временный .part и переименовывается только
+    после полной загрузки и проверки, поэтому прерванная загрузка
+    не оставляет повреждённый файл и продолжается при следующем вызове.
+
+    Args:
+        url (str): Ссылка на файл
+        path (str): Путь сохранения
+        sha256 (str): Ожидаемая контрольная сумма SHA-256
+        workers (int): Количество потоков для загрузки частями
+
+    Returns:
+        str: SHA-256 скачанного файла
+
+    Raises:
+        IOError: Контрольная сумма не совпала
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    part_path = path + ".part"
+
+    size, ranges = probe(url)
+    if ranges and size:
+        download_ranges(url, part_path, size, workers)
+    else:
+        download_stream(url, part_path)
+
+    digest = file_sha256(part_path)
+    if sha256 and digest != sha256:
+        os.remove(part_path)
+        raise IOError(f"Checksum mismatch for {path}: {digest}")
+
+    os.replace(part_path, path)
+
+    return digest
+
+
+def download_from_yandex(public_link: str, save_path: str,
+                         sha256: str = None) -> str:
+    """Скачивание файла из Yandex диска
+
+    Args:
+        public_link (str): Публичная ссылка на файл
+        save_path (str): Путь директории куда сохранить файл
+        sha256 (str): Ожидаемая контрольная сумма SHA-256
+
+    Returns:
+        str: Путь к скачанному файлу
+    """
+    download_url, file_name = resolve_yandex(public_link)
+
+    file_save_path = os.path.join(save_path, file_name)
+    download_file(download_url, file_save_path, sha256=sha256)
+
+    return file_save_path
+
+
+class ArtifactCache:
+    """Локальный кэш артефактов по версии
+
+    Артефакты версии хранятся в отдельной директории, и уже скачанная
+    версия используется без сетевых запросов. Перед использованием
+    файл кэша сверяется с закреплённой контрольной суммой (или
+    с checksums.json, если сумма не закреплена), а повреждённый
+    файл скачивается заново.
+    """
+    def __init__(self, root: str, version: str):
+        """Инициализация кэша
+
+        Args:
+            root (str): Корневая директория кэша
+            version (str): Версия набора артефактов
+        """
+        self.path = os.path.join(root, version)
+
+    def is_valid(self, path: str, sha256: str) -> bool:
+        """Проверка файла кэша по контрольной сумме
+
+        Args:
+            path (str): Путь к файлу
+            sha256 (str): Ожидаемая контрольная сумма
+
+        Returns:
+            bool: Файл есть и сумма совпала
+        """
+        if not os.path.exists(path):
+            return False
+
+        if sha256 and file_sha256(path) == sha256:
+            return True
+
+        logging.warning(f"Cached {path} failed checksum verification, "
+                        "downloading again")
+        os.remove(path)
+
+        return False
+
+    def fetch(self, artifacts: list) -> str:
+        """Скачивание недостающих или повреждённых артефактов версии
+
+        Args:
+            artifacts (list): Словари с именем файла (name), публичной
+                ссылкой Yandex диска (link) и SHA-256 (sha256). Если
+                сумма не закреплена, загрузка сверяется с суммой
+                из метаданных Yandex диска
+
+        Returns:
+            str: Директория с артефактами
+
+        Raises:
+            IOError: Контрольная сумма скачанного файла не совпала
+        """
+        checksums_path = os.path.join(self.path, "checksums.json")
+        checksums = {}
+        if os.path.exists(checksums_path):
+            with open(checksums_path) as file:
+                checksums = json.load(file)
+
+        for artifact in artifacts:
+            name = artifact["name"]
+            path = os.path.join(self.path, name)
+            sha256 = artifact.get("sha256")
+            if self.is_valid(path, sha256 or checksums.get(name)):
+                continue
+
+            if sha256 is None:
+                sha256 = public_sha256(artifact["link"])
+            if sha256 is None:
+                logging.warning(f"No checksum for {name}, "
+                                "download is not verified")
+
+            download_url, _ = resolve_yandex(artifact["link"])
+            checksums[name] = download_file(
+                download_url, path, sha256=sha256
+                )
+
+            with open(checksums_path, "w") as file:
+                json.dump(checksums, file, indent=2)
+
+        return self.path
@@ -0,0 +1,203 @@
+import os
+import json
+import math
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ["flat", "ivf-flat", "ivf-pq", "hnsw"]
+INDEX_FILE = "index.faiss"
+INDEX_CONFIG_FILE = "index_config.json"
+
+
+def default_nlist(n_vectors: int) -> int:
+    """Количество кластеров IVF по эвристике 4 * sqrt(N)
+    """
+    return max(1, int(4 * math.sqrt(n_vectors)))
+
+
+def index_factory_string(index_type: str, nlist: int = None,
+                         pq_m: int = 16, hnsw_m: int = 32) -> str:
+    """Описание индекса для faiss.index_factory
+
+    Индексы без собственных id (Flat, HNSW) оборачиваются в IDMap2,
+    чтобы id вектора совпадал с id рецепта в хранилище.
+
+    Args:
+        index_type (str): Тип индекса из INDEX_TYPES
+        nlist (int): Количество кластеров IVF
+        pq_m (int): Количество подвекторов Product Quantization
+        hnsw_m (int): Количество связей вершины графа HNSW
+
+    Returns:
+        str: Строка для faiss.index_factory
+    """
+    if index_type == "flat":
+        return "IDMap2,Flat"
+    elif index_type == "ivf-flat":
+        return f"IVF{nlist},Flat"
+    elif index_type == "ivf-pq":
+        return f"IVF{nlist},PQ{pq_m}"
+    elif index_type == "hnsw":
+        return f"IDMap2,HNSW{hnsw_m}"
+
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def build_index(vectors: np.ndarray, factory_string: str,
+                max_train: int = 100_000) -> faiss.Index:
+    """Создание и обучение пустого индекса FAISS
+
+    Args:
+        vectors (np.ndarray): Эмбеддинги корпуса для обучения
+        factory_string (str): Описание индекса для faiss.index_factory
+        max_train (int): Максимальный размер обучающей выборки
+
+    Returns:
+        faiss.Index: Обученный индекс без векторов
+    """
+    index = faiss.index_factory(
+        vectors.shape[1], factory_string, faiss.METRIC_L2
+        )
+
+    if not index.is_trained:
+        train_vectors = vectors
+        if len(vectors) > max_train:
+            rng = np.random.default_rng(0)
+            train_vectors = vectors[
+                rng.choice(len(vectors), max_train, replace=False)
+                ]
+        index.train(train_vectors)
+
+    return index
+
+
+def base_index(index: faiss.Index) -> faiss.Index:
+    """Индекс под обёрткой IDMap
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+
+    return index
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """Поддерживает ли индекс удаление векторов (у HNSW его нет)
+    """
+    return not hasattr(base_index(index), "hnsw")
+
+
+def reconstruct_vectors(index: faiss.Index, ids: list) -> np.ndarray:
+    """Векторы из индекса по id
+
+    Args:
+        index (faiss.Index): Индекс FAISS
+        ids (list): id векторов
+
+    Returns:
+        np.ndarray: Векторы в порядке ids или None, если индекс
+            хранит их с потерями (PQ)
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if not isinstance(faiss.downcast_index(ivf), faiss.IndexIVFFlat):
+            return None
+        # id рецептов не последовательны, нужна хэш-таблица id
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    if not len(ids):
+        return np.empty((0, index.d), dtype=np.float32)
+
+    return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+
+def read_index(path_index: str) -> faiss.Index:
+    """Чтение индекса через mmap, чтобы процессы делили одни страницы
+
+    Args:
+        path_index (str): Директория индекса
+
+    Returns:
+        faiss.Index: Индекс FAISS
+    """
+    path = os.path.join(path_index, INDEX_FILE)
+    try:
+        return faiss.read_index(
+            path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def write_index(index: faiss.Index, path_index: str):
+    """Атомарная запись индекса в директорию
+    """
+    path = os.path.join(path_index, INDEX_FILE)
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def tune_index(index: faiss.Index, nprobe: int = None,
+               ef_search: int = None):
+    """Настройка параметров поиска индекса
+
+    Args:
+        index (faiss.Index): Индекс FAISS
+        nprobe (int): Количество просматриваемых кластеров IVF
+        ef_search (int): Размер очереди кандидатов при поиске HNSW
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = nprobe
+
+    hnsw = getattr(base_index(index), "hnsw", None)
+    if hnsw is not None and ef_search:
+        hnsw.efSearch = ef_search
+
+
+def search_params(index: faiss.Index, selector):
+    """Параметры поиска с фильтром по id для типа индекса
+
+    IVF и HNSW принимают только свои параметры поиска, поэтому
+    текущие nprobe и efSearch индекса переносятся в них.
+
+    Args:
+        index (faiss.Index): Индекс FAISS
+        selector (faiss.IDSelector): Допустимые id векторов
+
+    Returns:
+        faiss.SearchParameters: Параметры для index.search
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+
+    hnsw = getattr(base_index(index), "hnsw", None)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(
+            sel=selector, efSearch=hnsw.efSearch
+            )
+
+    return faiss.SearchParameters(sel=selector)
+
+
+def save_index_config(path_index: str, config: dict):
+    with open(os.path.join(path_index, INDEX_CONFIG_FILE), "w") as file:
+        json.dump(config, file, indent=2)
+
+
+def load_index_config(path_index: str) -> dict:
+    """Параметры индекса, сохранённые при сборке
+
+    Returns:
+        dict: Тип индекса и параметры поиска, для старых
+            индексов без конфигурации - плоский индекс
+    """
+    path = os.path.join(path_index, INDEX_CONFIG_FILE)
+    if not os.path.exists(path):
+        return {"index_type": "flat"}
+
+    with open(path) as file:
+        return json.load(file)
@@ -0,0 +1,324 @@
+import io
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import aiohttp
+
+from PIL import Image
+
+from tools.cache import normalize_query
+from tools.metrics import record_cache, stage
+
+
+class DuckDuckGoBackend:
+    """Поиск изображений через DuckDuckGo Search
+    """
+    def __init__(self, region: str = "ru-ru"):
+        self.region = region
+
+    def search(self, query: str, max_results: int) -> list:
+        """Ссылки на изображения по запросу
+
+        Args:
+            query (str): Запрос
+            max_results (int): Количество результатов
+
+        Returns:
+            list: Словари со ссылкой на изображение (image)
+                и на страницу-источник (url)
+        """
+        from duckduckgo_search import DDGS
+
+        return DDGS().images(
+            keywords=query,
+            region=self.region,
+            safesearch='off',
+            type_image="photo",
+            max_results=max_results
+            )
+
+
+class StubImageBackend:
+    """Локальный поиск изображений для тестов и офлайн-запуска
+
+    Возвращает изображения из директории в виде ссылок file://,
+    которые загружаются без сетевых запросов.
+    """
+    def __init__(self, images_dir: str):
+        self.images_dir = images_dir
+
+    def search(self, query: str, max_results: int) -> list:
+        names = sorted(os.listdir(self.images_dir))[:max_results]
+
+        return [
+            {
+                "image": "file://" + os.path.abspath(
+                    os.path.join(self.images_dir, name)
+                    ),
+                "url": "file://" + os.path.abspath(self.images_dir)
+            }
+            for name in names
+        ]
+
+
+class ImageCache:
+    """Дисковый кэш миниатюр по названию блюда
+    """
+    def __init__(self, path: str, max_entries: int = 2000):
+        """Инициализация кэша
+
+        Args:
+            path (str): Директория кэша
+            max_entries (int): Максимальное количество изображений,
+                при превышении удаляются давно не запрошенные
+        """
+        self.path = path
+        self.max_entries = max_entries
+
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, query: str) -> str:
+        return hashlib.sha1(normalize_query(query).encode()).hexdigest()
+
+    def get(self, query: str):
+        """Миниатюра и метаданные из кэша
+
+        Попадание обновляет время изменения файлов, поэтому prune
+        удаляет давно не запрошенные изображения (LRU).
+
+        Returns:
+            tuple: Байты JPEG и метаданные или None
+        """
+        key = self.key(query)
+        try:
+            with open(os.path.join(self.path, key + ".json")) as file:
+                meta = json.load(file)
+            with open(os.path.join(self.path, key + ".jpg"), "rb") as file:
+                data = file.read()
+        except (OSError, ValueError):
+            return None
+
+        for name in [key + ".jpg", key + ".json"]:
+            try:
+                os.utime(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+        return data, meta
+
+    def put(self, query: str, data: bytes, meta: dict):
+        key = self.key(query)
+        for name, content in [
+            (key + ".jpg", data),
+            (key + ".json", json.dumps(meta, ensure_ascii=False).encode())
+        ]:
+            path = os.path.join(self.path, name)
+            with open(path + ".tmp", "wb") as file:
+                file.write(content)
+            os.replace(path + ".tmp", path)
+
+        self.prune()
+
+    def prune(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.path)
+             if entry.name.endswith(".jpg")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries[:max(0, len(entries) - self.max_entries)]:
+            for path in [entry.path, entry.path[:-4] + ".json"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def make_thumbnail(data: bytes, size: int = 512, quality: int = 85) -> bytes:
+    """Уменьшение изображения до миниатюры для чата
+
+    Args:
+        data (bytes): Исходное изображение
+        size (int): Максимальная сторона миниатюры
+        quality (int): Качество JPEG
+
+    Returns:
+        bytes: Миниатюра в JPEG
+    """
+    img = Image.open(io.BytesIO(data))
+    # JPEG декодируется сразу в уменьшенном масштабе
+    img.draft("RGB", (size, size))
+    img.thumbnail((size, size))
+
+    output = io.BytesIO()
+    img.convert("RGB").save(output, format="JPEG", quality=quality)
+
+    return output.getvalue()
+
+
+class ImageSearch:
+    """Асинхронный поиск изображения блюда
+
+    Изображения скачиваются с таймаутами и ограничением размера,
+    уменьшаются до миниатюры и кэшируются на диске по названию
+    блюда. При ошибке загрузки берётся следующий результат поиска.
+    """
+    def __init__(self, backend=None, cache: ImageCache = None,
+                 max_results: int = 5, max_bytes: int = 5 * 2 ** 20,
+                 connect_timeout: float = 3.0, read_timeout: float = 5.0,
+                 thumbnail_size: int = 512):
+        """Инициализация поиска
+
+        Args:
+            backend: Поиск ссылок на изображения, по умолчанию DuckDuckGo
+            cache (ImageCache): Дисковый кэш миниатюр, None - без кэша
+            max_results (int): Количество ссылок для перебора
+            max_bytes (int): Максимальный размер скачиваемого изображения
+            connect_timeout (float): Таймаут соединения в секундах
+            read_timeout (float): Таймаут чтения в секундах
+            thumbnail_size (int): Максимальная сторона миниатюры
+        """
+        self.backend = backend or DuckDuckGoBackend()
+        self.cache = cache
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+            )
+        self.thumbnail_size = thumbnail_size
+
+    async def download(self, session, link: str) -> bytes:
+        """Скачивание изображения с ограничением размера
+
+        Raises:
+            ValueError: Изображение больше max_bytes
+        """
+        if link.startswith("file://"):
+            path = url2pathname(urlparse(link).path)
+            if os.path.getsize(path) > self.max_bytes:
+                raise ValueError(f"Image is too large: {link}")
+            return await asyncio.to_thread(_read_file, path)
+
+        async with session.get(link) as response:
+            response.raise_for_status()
+            if (response.content_length or 0) > self.max_bytes:
+                raise ValueError(f"Image is too large: {link}")
+
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(2 ** 16):
+                data.extend(chunk)
+                if len(data) > self.max_bytes:
+                    raise ValueError(f"Image is too large: {link}")
+
+        return bytes(data)
+
+    async def fetch(self, query: str):
+        """Поиск и загрузка первого доступного изображения
+
+        Args:
+            query (str): Название блюда
+
+        Returns:
+            tuple: Миниатюра в JPEG и метаданные или None
+        """
+        candidates = await asyncio.to_thread(
+            self.backend.search, query, self.max_results
+            )
+
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            for candidate in candidates or []:
+                try:
+                    data = await self.download(session, candidate["image"])
+                    thumbnail = await asyncio.to_thread(
+                        make_thumbnail, data, self.thumbnail_size
+                        )
+                except Exception as e:
+                    logging.warning(f"Image {candidate['image']}: {e!r}")
+                    continue
+
+                return thumbnail, {
+                    "image": candidate["image"],
+                    "url": candidate["url"].rstrip("/")
+                }
+
+        return None
+
+    async def asearch(self, dict_input: dict) -> dict:
+        """Поиск изображения по запросу
+
+        Args:
+            dict_input (dict): Входная цепочка с запросом query
+
+        Returns:
+            dict: Цепочка с миниатюрой в JPEG (bytes) и мета данными
+        """
+        query = dict_input["query"]
+
+        with stage("image_search") as span:
+            found = None
+            if self.cache is not None:
+                found = await asyncio.to_thread(self.cache.get, query)
+                record_cache("image", found is not None)
+            span["cache_hit"] = found is not None
+
+            if found is None:
+                try:
+                    found = await self.fetch(query)
+                except Exception as e:
+                    logging.error(e)
+
+                if found is not None and self.cache is not None:
+                    await asyncio.to_thread(self.cache.put, query, *found)
+
+            thumbnail, meta = found or (None, {})
+            span["bytes"] = len(thumbnail or b"")
+
+        return {
+            "output": thumbnail,
+            "image": meta.get("image"),
+            "url": meta.get("url"),
+            "task": "Search Image"
+            }
+
+    def search(self, dict_input: dict) -> dict:
+        return asyncio.run(self.asearch(dict_input))
+
+
+def enforce_image_budget(messages: list, max_bytes: int) -> int:
+    """Ограничение памяти изображений в истории чата сессии
+
+    Самые старые изображения сверх бюджета заменяются текстовой
+    ссылкой на источник.
+
+    Args:
+        messages (list): Сообщения чата, изображения хранятся
+            как {"image": bytes, "caption": str}
+        max_bytes (int): Бюджет на изображения одной сессии
+
+    Returns:
+        int: Размер изображений сессии после ограничения
+    """
+    images = [
+        message for message in messages
+        if isinstance(message["content"], dict)
+    ]
+    total = sum(len(message["content"]["image"]) for message in images)
+
+    for message in images:
+        if total <= max_bytes:
+            break
+        total -= len(message["content"]["image"])
+        message["content"] = "🖼️ " + message["content"]["caption"]
+
+    return total
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
@@ -0,0 +1,143 @@
+import re
+import math
+
+from collections import Counter
+
+
+STOPWORDS = {
+    "для", "или", "без", "по", "вкусу", "шт", "штук", "штука", "грамм",
+    "граммов", "кг", "мл", "литр", "литра", "ложка", "ложки", "ложек",
+    "столовая", "столовые", "чайная", "чайные", "стакан", "стакана",
+    "щепотка", "зубчик", "зубчика", "зубчиков", "пучок", "кусок", "куска",
+    "штуки", "упаковка", "банка", "веточка", "веточки", "лист", "листа",
+    "свежий", "свежая", "свежие", "крупный", "крупная", "средний",
+    "средняя", "мелкий", "небольшой", "большой", "рецепт", "блюдо",
+}
+
+ENDINGS = sorted([
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ов", "ев", "ей", "ой", "ый", "ий", "ая", "яя", "ое", "ее", "ые",
+    "ие", "ом", "ем", "ам", "ям", "ах", "ях", "ую", "юю",
+    "а", "я", "ы", "и", "у", "ю", "е", "о", "ь",
+], key=len, reverse=True)
+
+
+def stem(word: str) -> str:
+    """Грубый стемминг русского слова отсечением окончания
+
+    Args:
+        word (str): Слово в нижнем регистре
+
+    Returns:
+        str: Основа слова не короче 4 символов
+    """
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 4:
+            return word[:-len(ending)]
+
+    return word
+
+
+def tokenize_ingredients(text: str) -> list:
+    """Термины ингредиентов из текста
+
+    Количества, единицы измерения и служебные слова отбрасываются.
+
+    Args:
+        text (str): Текст столбца Ингредиенты или запроса
+
+    Returns:
+        list: Основы слов
+    """
+    words = re.findall(r"[а-яa-z]{3,}", text.lower().replace("ё", "е"))
+
+    return [stem(word) for word in words if word not in STOPWORDS]
+
+
+class BM25Searcher:
+    """Поиск BM25 по инвертированному индексу ингредиентов в RecipeStore
+    """
+    def __init__(self, store, k1: float = 1.2, b: float = 0.75,
+                 max_df_ratio: float = 0.5):
+        """Инициализация поиска
+
+        Args:
+            store (RecipeStore): Хранилище с индексом ингредиентов
+            k1 (float): Насыщение частоты термина
+            b (float): Нормировка по длине списка ингредиентов
+            max_df_ratio (float): Термины, встречающиеся в большей доле
+                рецептов (соль, вода), не учитываются
+        """
+        self.store = store
+        self.k1 = k1
+        self.b = b
+
+        self.n_docs, self.avg_length = store.lexical_stats()
+        self.max_df = max_df_ratio * self.n_docs
+
+    def idf(self, df: int) -> float:
+        return math.log((self.n_docs - df + 0.5) / (df + 0.5) + 1.0)
+
+    def search(self, terms: list, k: int, mask=None) -> list:
+        """Поиск рецептов по терминам ингредиентов
+
+        Args:
+            terms (list): Термины запроса
+            k (int): Количество рецептов
+            mask (np.ndarray): Маска допустимых id рецептов
+
+        Returns:
+            list: Пары (id рецепта, доля совпавших терминов запроса)
+                по убыванию BM25
+        """
+        scores = Counter()
+        matched = Counter()
+
+        frequencies = {
+            term: df
+            for term, df in self.store.document_frequencies(set(terms)).items()
+            if df <= self.max_df
+        }
+
+        for term, df in frequencies.items():
+            idf = self.idf(df)
+            for doc_id, tf, length in self.store.postings(term):
+                if mask is not None and not (
+                    doc_id < len(mask) and mask[doc_id]
+                ):
+                    continue
+                norm = self.k1 * (
+                    1 - self.b + self.b * length / self.avg_length
+                    )
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_id] += 1
+
+        return [(doc_id, matched[doc_id] / len(frequencies))
+                for doc_id, _ in scores.most_common(k)]
+
+    def is_known(self, terms: list) -> bool:
+        """Все ли термины встречаются в индексе ингредиентов
+        """
+        terms = set(terms)
+
+        return bool(terms) and len(
+            self.store.document_frequencies(terms)
+            ) == len(terms)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """Объединение ранжирований методом Reciprocal Rank Fusion
+
+    Args:
+        rankings (list): Списки id в порядке убывания релевантности
+        k (int): Сглаживающая константа RRF
+
+    Returns:
+        list: id в порядке убывания суммарного score
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+
+    return [doc_id for doc_id, _ in scores.most_common()]
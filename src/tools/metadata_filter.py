@@ -0,0 +1,315 @@
+import os
+import re
+import json
+
+import faiss
+import numpy as np
+
+from tools.cache import LRUCache
+from tools.dedup import GROUPS_FILE
+
+
+COLUMNS_DIR = "columns"
+
+NUMERIC_FIELDS = {
+    "time": "Время приготовления",
+    "kcal": "Пищевая ценность",
+}
+CATEGORICAL_FIELDS = {
+    "cuisine": "Тип кухни",
+    "category": "Класс",
+}
+
+OPERATORS = {
+    "<=": np.less_equal,
+    ">=": np.greater_equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    ">": np.greater,
+    "=": np.equal,
+}
+
+CONDITION_PATTERN = re.compile(
+    r"^\s*(\w+)\s*(<=|>=|!=|<|>|=)\s*(?:\"([^\"]*)\"|'([^']*)'|([\d.,]+))\s*$"
+)
+
+
+def parse_cook_time(text: str) -> float:
+    """Время приготовления в минутах
+
+    Args:
+        text (str): Значение столбца, например «1 час 20 минут»
+
+    Returns:
+        float: Минуты или NaN, если время не распознано
+    """
+    text = (text or "").lower()
+    parts = {
+        "days": re.search(r"(\d+)\s*(?:дн|день|сут)", text),
+        "hours": re.search(r"(\d+)\s*(?:час|ч\b)", text),
+        "minutes": re.search(r"(\d+)\s*мин", text),
+    }
+    if not any(parts.values()):
+        return np.nan
+
+    weights = {"days": 1440, "hours": 60, "minutes": 1}
+
+    return float(sum(
+        int(match.group(1)) * weights[name]
+        for name, match in parts.items() if match
+    ))
+
+
+def parse_calories(text: str) -> float:
+    """Калорийность порции в ккал
+
+    Args:
+        text (str): Значение столбца Пищевая ценность
+
+    Returns:
+        float: Калории или NaN, если они не распознаны
+    """
+    text = (text or "").lower()
+    for pattern in [
+        r"(\d+(?:[.,]\d+)?)\s*ккал",
+        r"(?:ккал|калорийность)\D{0,5}(\d+(?:[.,]\d+)?)",
+    ]:
+        match = re.search(pattern, text)
+        if match:
+            return float(match.group(1).replace(",", "."))
+
+    return np.nan
+
+
+def build_columns(records: list) -> tuple:
+    """Колонки метаданных, индексированные id вектора
+
+    Args:
+        records (list): Пары (id вектора, метаданные рецепта)
+
+    Returns:
+        tuple: Словарь массивов и словари категориальных значений
+    """
+    size = max((doc_id for doc_id, _ in records), default=-1) + 1
+
+    arrays = {
+        "time": np.full(size, np.nan, dtype=np.float32),
+        "kcal": np.full(size, np.nan, dtype=np.float32),
+    }
+    parsers = {"time": parse_cook_time, "kcal": parse_calories}
+
+    vocab = {field: [] for field in CATEGORICAL_FIELDS}
+    codes = {field: {} for field in CATEGORICAL_FIELDS}
+    for field in CATEGORICAL_FIELDS:
+        arrays[field] = np.full(size, -1, dtype=np.int16)
+
+    for doc_id, metadata in records:
+        for field, column in NUMERIC_FIELDS.items():
+            arrays[field][doc_id] = parsers[field](metadata.get(column))
+
+        for field, column in CATEGORICAL_FIELDS.items():
+            value = (metadata.get(column) or "").strip()
+            if not value:
+                continue
+            if value not in codes[field]:
+                codes[field][value] = len(vocab[field])
+                vocab[field].append(value)
+            arrays[field][doc_id] = codes[field][value]
+
+    return arrays, vocab
+
+
+def save_columns(path_index: str, arrays: dict, vocab: dict):
+    path = os.path.join(path_index, COLUMNS_DIR)
+    os.makedirs(path, exist_ok=True)
+
+    for field, array in arrays.items():
+        with open(os.path.join(path, f"{field}.npy.tmp"), "wb") as file:
+            np.save(file, array)
+        os.replace(
+            os.path.join(path, f"{field}.npy.tmp"),
+            os.path.join(path, f"{field}.npy")
+            )
+
+    with open(os.path.join(path, "vocab.json"), "w") as file:
+        json.dump(vocab, file, ensure_ascii=False, indent=2)
+
+
+class MetadataFilter:
+    """Фильтр по метаданным рецепта — конъюнкция условий
+
+    Пример выражения: cuisine = "итальянская" and time <= 30
+    and kcal <= 400. Для категориальных полей (cuisine, category)
+    значение ищется как подстрока без учёта регистра.
+    """
+    def __init__(self, conditions: list):
+        """Инициализация фильтра
+
+        Args:
+            conditions (list): Тройки (поле, оператор, значение)
+        """
+        self.conditions = conditions
+
+    @classmethod
+    def parse(cls, expression: str):
+        """Разбор выражения фильтра
+
+        Args:
+            expression (str): Условия, соединённые через and
+
+        Returns:
+            MetadataFilter: Фильтр
+        """
+        conditions = []
+        for clause in re.split(r"\s+and\s+", expression.strip(),
+                               flags=re.IGNORECASE):
+            match = CONDITION_PATTERN.match(clause)
+            if match is None:
+                raise ValueError(f"Invalid filter condition: {clause}")
+
+            field, op = match.group(1), match.group(2)
+            if field in NUMERIC_FIELDS:
+                value = float(match.group(5).replace(",", "."))
+            elif field in CATEGORICAL_FIELDS and op in ("=", "!="):
+                value = match.group(3) or match.group(4) or match.group(5)
+            else:
+                raise ValueError(f"Unsupported filter condition: {clause}")
+
+            conditions.append((field, op, value))
+
+        return cls(conditions)
+
+    def __str__(self) -> str:
+        return " and ".join(
+            f'{field} {op} "{value}"' if isinstance(value, str)
+            else f"{field} {op} {value:g}"
+            for field, op, value in self.conditions
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.conditions)
+
+
+def extract_filter(text: str, vocab: dict) -> MetadataFilter:
+    """Условия фильтра из запроса на естественном языке
+
+    Распознаются ограничения «до 30 минут», «до 400 ккал»
+    и названия кухонь из словаря значений.
+
+    Args:
+        text (str): Запрос пользователя
+        vocab (dict): Словари категориальных значений
+
+    Returns:
+        MetadataFilter: Фильтр, возможно пустой
+    """
+    text = text.lower().replace("ё", "е")
+    conditions = []
+
+    time_match = re.search(
+        r"(?:до|не более|не больше|меньше|за)\s*(\d+)\s*(мин|час|ч\b)", text
+        )
+    if time_match:
+        minutes = int(time_match.group(1))
+        if time_match.group(2) != "мин":
+            minutes *= 60
+        conditions.append(("time", "<=", float(minutes)))
+
+    kcal_match = re.search(
+        r"(?:до|не более|не больше|меньше)\s*(\d+)\s*(?:ккал|калори)", text
+        )
+    if kcal_match:
+        conditions.append(("kcal", "<=", float(kcal_match.group(1))))
+
+    for value in vocab.get("cuisine", []):
+        words = value.lower().replace("ё", "е").split()
+        # «Итальянская кухня» -> «итальянск», основа ищется с начала
+        # слова, чтобы «русск» не совпадало с «белорусская»
+        if words and len(words[0]) > 4 and re.search(
+                r"\b" + re.escape(words[0][:-2]), text):
+            conditions.append(("cuisine", "=", value))
+            break
+
+    return MetadataFilter(conditions)
+
+
+class MetadataColumns:
+    """Колонки метаданных, отображённые в память, и маски фильтров
+    """
+    def __init__(self, path_index: str, mask_cache_size: int = 64):
+        """Загрузка колонок из директории индекса
+
+        Args:
+            path_index (str): Директория индекса
+            mask_cache_size (int): Количество кэшируемых масок фильтров
+        """
+        path = os.path.join(path_index, COLUMNS_DIR)
+
+        self.arrays = {
+            field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r")
+            for field in list(NUMERIC_FIELDS) + list(CATEGORICAL_FIELDS)
+        }
+        with open(os.path.join(path, "vocab.json")) as file:
+            self.vocab = json.load(file)
+
+        # Группы почти дубликатов есть только у индексов новых версий
+        groups_path = os.path.join(path, GROUPS_FILE)
+        self.groups = np.load(groups_path, mmap_mode="r") \
+            if os.path.exists(groups_path) else None
+
+        self.masks = LRUCache(capacity=mask_cache_size)
+
+    @staticmethod
+    def exists(path_index: str) -> bool:
+        return os.path.exists(
+            os.path.join(path_index, COLUMNS_DIR, "vocab.json")
+            )
+
+    def extract_filter(self, text: str) -> MetadataFilter:
+        return extract_filter(text, self.vocab)
+
+    def mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        """Маска рецептов, удовлетворяющих фильтру
+
+        Args:
+            metadata_filter (MetadataFilter): Фильтр
+
+        Returns:
+            np.ndarray: Булева маска по id векторов
+        """
+        key = str(metadata_filter)
+        mask = self.masks.get(key)
+        if mask is not None:
+            return mask
+
+        mask = np.ones(len(self.arrays["time"]), dtype=bool)
+        for field, op, value in metadata_filter.conditions:
+            column = self.arrays[field]
+            if field in CATEGORICAL_FIELDS:
+                codes = [
+                    code for code, name in enumerate(self.vocab[field])
+                    if value.lower() in name.lower()
+                ]
+                condition = np.isin(column, codes)
+                if op == "!=":
+                    condition = ~condition & (column >= 0)
+            else:
+                # NaN не проходит ни одно сравнение
+                with np.errstate(invalid="ignore"):
+                    condition = OPERATORS[op](column, value)
+            mask &= condition
+
+        self.masks.put(key, mask)
+
+        return mask
+
+    def selector(self, mask: np.ndarray):
+        """Селектор FAISS для поиска только среди рецептов из маски
+
+        Returns:
+            tuple: Селектор и упакованная маска, которая должна
+                жить не меньше селектора
+        """
+        bits = np.packbits(mask, bitorder="little")
+
+        return faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bits)), bits
@@ -0,0 +1,343 @@
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+
+trace_logger = logging.getLogger("agent.trace")
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+def escape_label(value) -> str:
+    """Значение метки в текстовом формате Prometheus: экранируются
+    обратная косая черта, кавычка и перевод строки
+    """
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+    return value.replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Потокобезопасные счётчики, значения и гистограммы в формате
+    Prometheus
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """Увеличение счётчика
+
+        Args:
+            name (str): Имя метрики
+            value (float): Приращение
+            **labels: Метки метрики
+        """
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        """Текущее значение метрики
+
+        Args:
+            name (str): Имя метрики
+            value (float): Значение
+            **labels: Метки метрики
+        """
+        with self._lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name: str, value: float,
+                buckets: tuple = LATENCY_BUCKETS, **labels):
+        """Добавление значения в гистограмму
+
+        Args:
+            name (str): Имя метрики
+            value (float): Значение
+            buckets (tuple): Верхние границы корзин
+            **labels: Метки метрики
+        """
+        key = self.key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    "buckets": buckets,
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0
+                }
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @staticmethod
+    def format_labels(labels: tuple, **extra) -> str:
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ""
+
+        return "{" + ",".join(
+            f'{name}="{escape_label(value)}"' for name, value in items
+        ) + "}"
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(
+                (key, dict(value, counts=list(value["counts"])))
+                for key, value in self.histograms.items()
+            )
+
+        typed = set()
+        for kind, items in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in items:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                lines.append(
+                    f"{name}_bucket{self.format_labels(labels, le=bound)} "
+                    f"{count}"
+                    )
+            lines.append(
+                f"{name}_bucket{self.format_labels(labels, le='+Inf')} "
+                f"{histogram['count']}"
+                )
+            lines.append(
+                f"{name}_sum{self.format_labels(labels)} {histogram['sum']:g}"
+                )
+            lines.append(
+                f"{name}_count{self.format_labels(labels)} "
+                f"{histogram['count']}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+METRICS = MetricsRegistry()
+
+
+def start_trace() -> str:
+    """Новый trace id для запроса пользователя в текущем контексте
+    """
+    trace_id = uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+
+    return trace_id
+
+
+def current_trace() -> str:
+    return _trace_id.get()
+
+
+def current_stage() -> str:
+    span = _span.get()
+
+    return span["stage"] if span else "unknown"
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Замер этапа обработки запроса
+
+    Длительность попадает в гистограмму agent_stage_seconds, а этап
+    со всеми полями записывается структурированным логом agent.trace.
+
+    Args:
+        name (str): Название этапа
+        **fields: Дополнительные поля лога
+
+    Yields:
+        dict: Поля этапа, которые можно дополнить внутри блока
+    """
+    span = dict(fields, stage=name)
+    token = _span.set(span)
+    start_time = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span["error"] = repr(e)
+        METRICS.inc("agent_stage_errors_total", stage=name)
+        raise
+    finally:
+        duration = time.perf_counter() - start_time
+        try:
+            _span.reset(token)
+        except ValueError:
+            # Этап завершился в другом контексте (генератор)
+            _span.set(None)
+
+        METRICS.observe("agent_stage_seconds", duration, stage=name)
+        trace_logger.info(json.dumps(
+            dict(span, trace_id=current_trace(),
+                 duration_ms=round(duration * 1000, 2)),
+            ensure_ascii=False,
+            default=str
+            ))
+
+
+def annotate(**fields):
+    """Дополнительные поля текущего этапа
+    """
+    span = _span.get()
+    if span is not None:
+        span.update(fields)
+
+
+def record_cache(cache: str, hit: bool):
+    METRICS.inc(
+        "agent_cache_requests_total", cache=cache,
+        result="hit" if hit else "miss"
+        )
+
+
+def token_usage(response) -> dict:
+    """Количество токенов из ответа LLM, если провайдер его вернул
+    """
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(
+                getattr(generation, "message", None), "usage_metadata", None
+                )
+            if usage:
+                return {
+                    "prompt": usage.get("input_tokens", 0),
+                    "completion": usage.get("output_tokens", 0)
+                }
+
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return {
+            "prompt": usage.get("prompt_tokens", 0),
+            "completion": usage.get("completion_tokens", 0)
+        }
+
+    return {}
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Размер промпта и количество токенов каждого вызова LLM
+    с привязкой к текущему этапу
+    """
+    # Вызов в том же контексте, чтобы был виден текущий этап
+    run_inline = True
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        chars = sum(
+            len(message.content)
+            for batch in messages for message in batch
+            if isinstance(message.content, str)
+        )
+        METRICS.observe(
+            "agent_prompt_chars", chars, buckets=SIZE_BUCKETS,
+            stage=current_stage()
+            )
+
+        span = _span.get()
+        if span is not None:
+            span["prompt_chars"] = span.get("prompt_chars", 0) + chars
+
+    def on_llm_end(self, response, **kwargs):
+        usage = token_usage(response)
+        for kind, count in usage.items():
+            METRICS.inc(
+                "agent_llm_tokens_total", count,
+                stage=current_stage(), type=kind
+                )
+
+        span = _span.get()
+        if span is not None:
+            for kind, count in usage.items():
+                span[f"{kind}_tokens"] = span.get(f"{kind}_tokens", 0) + count
+
+
+def configure_trace_log(path: str = None):
+    """Запись этапов запросов в формате JSON Lines
+
+    Args:
+        path (str): Файл лога, None или "-" - stderr
+    """
+    if path and path != "-":
+        handler = logging.FileHandler(path, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """HTTP-сервер с эндпоинтом /metrics в фоновом потоке
+
+    Args:
+        port (int): Порт сервера
+        host (str): Адрес сервера
+
+    Returns:
+        ThreadingHTTPServer: Запущенный сервер
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+
+    return server
@@ -0,0 +1,264 @@
+import os
+import json
+import sqlite3
+import threading
+
+from collections import Counter
+
+from langchain_core.documents import Document
+
+
+STORE_FILE = "recipes.sqlite"
+
+
+class RecipeStore:
+    """Хранилище рецептов в SQLite с доступом по id вектора
+
+    В отличие от pickle-докстора LangChain, рецепты не загружаются
+    в память целиком: читаются только документы из выдачи поиска.
+    """
+    def __init__(self, path: str, readonly: bool = True):
+        """Инициализация хранилища
+
+        Args:
+            path (str): Путь к файлу SQLite
+            readonly (bool): Открыть хранилище только для чтения
+        """
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+
+        if not readonly:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS recipes (
+                    id INTEGER PRIMARY KEY,
+                    doc_key TEXT UNIQUE NOT NULL,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )"""
+            )
+            # Инвертированный индекс ингредиентов для BM25
+            self.connection.executescript(
+                """CREATE TABLE IF NOT EXISTS ingredient_terms (
+                    term TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    tf INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ingredient_terms_term
+                    ON ingredient_terms (term);
+                CREATE INDEX IF NOT EXISTS ingredient_terms_id
+                    ON ingredient_terms (id);
+                CREATE TABLE IF NOT EXISTS ingredient_lengths (
+                    id INTEGER PRIMARY KEY,
+                    length INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS ingredient_df (
+                    term TEXT PRIMARY KEY,
+                    df INTEGER NOT NULL
+                );"""
+            )
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Отдельное соединение на каждый поток
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.readonly:
+                connection = sqlite3.connect(
+                    f"file:{self.path}?mode=ro",
+                    uri=True,
+                    check_same_thread=False
+                    )
+            else:
+                connection = sqlite3.connect(self.path)
+            self._local.connection = connection
+
+        return connection
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM recipes"
+            ).fetchone()[0]
+
+    def get(self, ids: list) -> list:
+        """Документы по id векторов
+
+        Args:
+            ids (list): id векторов из индекса FAISS
+
+        Returns:
+            list: Документы в порядке ids, отсутствующие пропускаются
+        """
+        ids = [int(i) for i in ids if i >= 0]
+        if not ids:
+            return []
+
+        rows = self.connection.execute(
+            "SELECT id, page_content, metadata FROM recipes "
+            f"WHERE id IN ({','.join('?' * len(ids))})",
+            ids
+        ).fetchall()
+
+        documents = {
+            row[0]: Document(
+                id=str(row[0]),
+                page_content=row[1],
+                metadata=json.loads(row[2])
+                )
+            for row in rows
+        }
+
+        return [documents[i] for i in ids if i in documents]
+
+    def ids_for_keys(self, keys: list) -> list:
+        """id векторов по ключам документов
+        """
+        ids = []
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            ids.extend(row[0] for row in self.connection.execute(
+                "SELECT id FROM recipes "
+                f"WHERE doc_key IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+
+        return ids
+
+    def key_ids(self, keys: list) -> dict:
+        """Ключ документа -> id вектора для ключей из хранилища
+        """
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.update(self.connection.execute(
+                "SELECT doc_key, id FROM recipes "
+                f"WHERE doc_key IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+
+        return found
+
+    def iter_metadata(self):
+        """Пары (id вектора, метаданные) всех рецептов
+        """
+        for doc_id, metadata in self.connection.execute(
+            "SELECT id, metadata FROM recipes"
+        ):
+            yield doc_id, json.loads(metadata)
+
+    def next_id(self) -> int:
+        max_id = self.connection.execute(
+            "SELECT MAX(id) FROM recipes"
+            ).fetchone()[0]
+
+        return 0 if max_id is None else max_id + 1
+
+    def add(self, ids: list, keys: list, documents: list):
+        """Добавление документов
+
+        Args:
+            ids (list): id векторов
+            keys (list): Ключи документов
+            documents (list): Документы LangChain
+        """
+        self.connection.executemany(
+            "INSERT INTO recipes (id, doc_key, page_content, metadata) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (int(i), key, d.page_content,
+                 json.dumps(d.metadata, ensure_ascii=False))
+                for i, key, d in zip(ids, keys, documents)
+            ]
+        )
+
+    def add_terms(self, ids: list, terms: list):
+        """Добавление документов в инвертированный индекс ингредиентов
+
+        Args:
+            ids (list): id векторов
+            terms (list): Термины ингредиентов каждого документа
+        """
+        self.connection.executemany(
+            "INSERT INTO ingredient_terms (term, id, tf) VALUES (?, ?, ?)",
+            [
+                (term, int(i), tf)
+                for i, doc_terms in zip(ids, terms)
+                for term, tf in Counter(doc_terms).items()
+            ]
+        )
+        self.connection.executemany(
+            "INSERT INTO ingredient_lengths (id, length) VALUES (?, ?)",
+            [(int(i), len(doc_terms)) for i, doc_terms in zip(ids, terms)]
+        )
+
+    def update_document_frequencies(self):
+        """Пересчёт документных частот терминов после изменений
+        """
+        self.connection.execute("DELETE FROM ingredient_df")
+        self.connection.execute(
+            "INSERT INTO ingredient_df (term, df) "
+            "SELECT term, COUNT(*) FROM ingredient_terms GROUP BY term"
+        )
+
+    def has_lexical_index(self) -> bool:
+        """Проиндексированы ли ингредиенты всех рецептов
+        """
+        try:
+            n_lengths = self.connection.execute(
+                "SELECT COUNT(*) FROM ingredient_lengths"
+                ).fetchone()[0]
+        except sqlite3.OperationalError:
+            return False
+
+        return n_lengths == len(self)
+
+    def lexical_stats(self) -> tuple:
+        """Количество документов и средняя длина списка ингредиентов
+        """
+        n_docs, avg_length = self.connection.execute(
+            "SELECT COUNT(*), AVG(length) FROM ingredient_lengths"
+            ).fetchone()
+
+        return n_docs, avg_length or 1.0
+
+    def document_frequencies(self, terms) -> dict:
+        terms = list(terms)
+        if not terms:
+            return {}
+
+        return dict(self.connection.execute(
+            "SELECT term, df FROM ingredient_df "
+            f"WHERE term IN ({','.join('?' * len(terms))})",
+            terms
+        ).fetchall())
+
+    def postings(self, term: str) -> list:
+        """Документы с термином
+
+        Returns:
+            list: Тройки (id, частота термина, длина документа)
+        """
+        return self.connection.execute(
+            "SELECT t.id, t.tf, l.length FROM ingredient_terms t "
+            "JOIN ingredient_lengths l ON l.id = t.id WHERE t.term = ?",
+            (term,)
+        ).fetchall()
+
+    def delete(self, ids: list):
+        ids = [(int(i),) for i in ids]
+        for table in ["recipes", "ingredient_terms", "ingredient_lengths"]:
+            self.connection.executemany(
+                f"DELETE FROM {table} WHERE id = ?", ids
+                )
+
+    def clear(self):
+        for table in ["recipes", "ingredient_terms", "ingredient_lengths"]:
+            self.connection.execute(f"DELETE FROM {table}")
+
+    def commit(self):
+        self.connection.commit()
+
+
+def store_path(path_index: str) -> str:
+    return os.path.join(path_index, STORE_FILE)
@@ -0,0 +1,484 @@
+import os
+from typing import Any
+
+import numpy as np
+
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+
+from tools.cache import LRUCache, normalize_query
+from tools.dedup import collapse
+from tools.faiss_index import (
+    load_index_config,
+    read_index,
+    search_params,
+    tune_index
+)
+from tools.lexical import (
+    BM25Searcher,
+    reciprocal_rank_fusion,
+    tokenize_ingredients
+)
+from tools.metadata_filter import MetadataColumns, MetadataFilter
+from tools.metrics import METRICS, annotate
+from tools.recipe_store import RecipeStore, store_path
+
+
+class FilteredRetriever(BaseRetriever):
+    """Ретривер с фильтром по метаданным в асинхронном вызове
+
+    Асинхронный вызов по умолчанию в BaseRetriever не передаёт
+    дополнительные аргументы, поэтому фильтр пробрасывается явно.
+    """
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager=None,
+                                       metadata_filter=None):
+        return await run_in_executor(
+            None, self._get_relevant_documents, query,
+            metadata_filter=metadata_filter
+            )
+
+    def retrieve_batch(self, queries: list,
+                       metadata_filters: list = None) -> list:
+        """Выдача для списка запросов
+
+        Args:
+            queries (list): Тексты запросов
+            metadata_filters (list): Фильтр по метаданным для каждого
+                запроса, None - без фильтров
+
+        Returns:
+            list: Списки документов в порядке queries
+        """
+        metadata_filters = metadata_filters or [None] * len(queries)
+
+        return [
+            self._get_relevant_documents(query, metadata_filter=f)
+            for query, f in zip(queries, metadata_filters)
+        ]
+
+
+class RecipeRetriever(FilteredRetriever):
+    """Ретривер по индексу FAISS и хранилищу рецептов RecipeStore
+
+    Индекс возвращает id векторов, а из хранилища читаются
+    только найденные рецепты. Фильтр по метаданным применяется
+    внутри поиска FAISS через селектор id. Если при сборке индекса
+    найдены группы почти дубликатов, из каждой группы в выдачу
+    попадает только самый близкий рецепт.
+    """
+    index: Any
+    store: Any
+    embeddings: Any
+    columns: Any = None
+    k: int = 3
+    collapse_duplicates: bool = True
+    fetch_factor: int = 3
+
+    @property
+    def groups(self):
+        if self.columns is None or not self.collapse_duplicates:
+            return None
+
+        return self.columns.groups
+
+    @property
+    def fetch_k(self) -> int:
+        """Количество кандидатов поиска с запасом на дубликаты
+        """
+        return self.k * self.fetch_factor if self.groups is not None \
+            else self.k
+
+    def collapse(self, ids: list, k: int = None) -> list:
+        """Выдача без почти дубликатов
+
+        Args:
+            ids (list): id рецептов в порядке релевантности
+            k (int): Количество рецептов
+
+        Returns:
+            list: Не больше k id рецептов из разных групп
+        """
+        k = k or self.k
+        if self.groups is None:
+            return list(ids[:k])
+
+        ids, skipped = collapse(ids, self.groups, k)
+        if skipped:
+            METRICS.inc("retriever_duplicates_collapsed_total", skipped)
+        annotate(duplicates_collapsed=skipped)
+
+        return ids
+
+    def filter_mask(self, metadata_filter):
+        """Маска рецептов для фильтра
+
+        Фильтр, которому не соответствует ни один рецепт, игнорируется,
+        чтобы пользователь всё равно получил ответ.
+
+        Args:
+            metadata_filter: MetadataFilter, выражение фильтра или None
+
+        Returns:
+            np.ndarray: Булева маска по id векторов или None
+        """
+        if self.columns is None or not metadata_filter:
+            return None
+        if isinstance(metadata_filter, str):
+            metadata_filter = MetadataFilter.parse(metadata_filter)
+
+        mask = self.columns.mask(metadata_filter)
+
+        return mask if mask.any() else None
+
+    def extract_filter(self, text: str):
+        if self.columns is None:
+            return None
+
+        return self.columns.extract_filter(text)
+
+    def search(self, query: str, k: int = None, mask=None) -> list:
+        """Поиск id ближайших рецептов
+
+        Args:
+            query (str): Текст запроса
+            k (int): Количество рецептов
+            mask (np.ndarray): Маска допустимых id рецептов
+
+        Returns:
+            list: id векторов в порядке близости
+        """
+        vector = np.asarray(
+            [self.embeddings.embed_query(query)], dtype=np.float32
+            )
+
+        if mask is None:
+            _, ids = self.index.search(vector, k or self.k)
+        else:
+            # Упакованная маска должна жить до конца поиска
+            selector, _bits = self.columns.selector(mask)
+            _, ids = self.index.search(
+                vector, k or self.k,
+                params=search_params(self.index, selector)
+                )
+
+        return [i for i in ids[0] if i >= 0]
+
+    def filter_masks(self, metadata_filters: list) -> list:
+        """Маски для списка фильтров, одинаковые фильтры получают
+        один и тот же объект маски
+        """
+        masks = {}
+        for metadata_filter in metadata_filters:
+            key = str(metadata_filter or "")
+            if key not in masks:
+                masks[key] = self.filter_mask(metadata_filter)
+
+        return [masks[str(f or "")] for f in metadata_filters]
+
+    def search_batch(self, queries: list, k: int = None,
+                     masks: list = None) -> list:
+        """Поиск id ближайших рецептов для списка запросов
+
+        Эмбеддинги запросов считаются одним батчем, а запросы
+        с одинаковой маской ищутся одним вызовом FAISS.
+
+        Args:
+            queries (list): Тексты запросов
+            k (int): Количество рецептов на запрос
+            masks (list): Маска допустимых id для каждого запроса
+
+        Returns:
+            list: Списки id векторов в порядке queries
+        """
+        if not queries:
+            return []
+
+        vectors = np.asarray(
+            self.embeddings.embed_documents(queries), dtype=np.float32
+            )
+        masks = masks or [None] * len(queries)
+
+        groups = {}
+        for i, mask in enumerate(masks):
+            groups.setdefault(id(mask), (mask, []))[1].append(i)
+
+        results = [None] * len(queries)
+        for mask, rows in groups.values():
+            params = {}
+            if mask is not None:
+                # Упакованная маска должна жить до конца поиска
+                selector, _bits = self.columns.selector(mask)
+                params["params"] = search_params(self.index, selector)
+
+            _, ids = self.index.search(vectors[rows], k or self.k, **params)
+            for i, row in zip(rows, ids):
+                results[i] = [doc_id for doc_id in row if doc_id >= 0]
+
+        return results
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None,
+                                metadata_filter=None):
+        mask = self.filter_mask(metadata_filter)
+
+        return self.store.get(
+            self.collapse(self.search(query, self.fetch_k, mask=mask))
+            )
+
+    def retrieve_batch(self, queries: list,
+                       metadata_filters: list = None) -> list:
+        masks = self.filter_masks(metadata_filters or [None] * len(queries))
+
+        return [
+            self.store.get(self.collapse(ids))
+            for ids in self.search_batch(queries, self.fetch_k, masks=masks)
+        ]
+
+
+class HybridRetriever(FilteredRetriever):
+    """Гибридный ретривер: BM25 по ингредиентам и векторный поиск
+
+    Выдачи объединяются через Reciprocal Rank Fusion. Запрос из одних
+    ингредиентов, полностью покрытый найденными рецептами, обрабатывается
+    без модели эмбеддингов. Почти дубликаты убираются из объединённой
+    выдачи по группам векторного ретривера.
+    """
+    dense: Any
+    lexical: Any
+    k: int = 3
+    candidates: int = 30
+    rrf_k: int = 60
+
+    def extract_filter(self, text: str):
+        return self.dense.extract_filter(text)
+
+    def search_lexical(self, query: str, mask=None) -> tuple:
+        """Поиск BM25 по ингредиентам запроса
+
+        Returns:
+            tuple: id рецептов BM25 и готовая выдача, если запрос
+                целиком из известных ингредиентов покрыт рецептами,
+                иначе None
+        """
+        terms = tokenize_ingredients(query)
+        lexical = self.lexical.search(terms, self.candidates, mask=mask)
+
+        # Запрос целиком из известных ингредиентов
+        if self.lexical.is_known(terms):
+            full_matches = [
+                doc_id for doc_id, coverage in lexical if coverage == 1.0
+            ]
+            if len(full_matches) >= self.k:
+                matches = self.dense.collapse(full_matches, self.k)
+                if len(matches) >= self.k:
+                    return lexical, matches
+
+        return lexical, None
+
+    def fuse(self, dense: list, lexical: list) -> list:
+        return self.dense.collapse(reciprocal_rank_fusion(
+            [dense, [doc_id for doc_id, _ in lexical]], k=self.rrf_k
+            ), self.k)
+
+    def search(self, query: str, mask=None) -> list:
+        """Поиск id рецептов
+
+        Args:
+            query (str): Текст запроса
+            mask (np.ndarray): Маска допустимых id рецептов
+
+        Returns:
+            list: id рецептов в порядке релевантности
+        """
+        lexical, matches = self.search_lexical(query, mask)
+        if matches is not None:
+            return matches
+
+        return self.fuse(
+            self.dense.search(query, self.candidates, mask=mask), lexical
+            )
+
+    def search_batch(self, queries: list, masks: list) -> list:
+        """Поиск id рецептов для списка запросов
+
+        Векторный поиск выполняется одним батчем только для запросов,
+        которым не хватило выдачи BM25.
+        """
+        lexicals = []
+        results = [None] * len(queries)
+        for i, (query, mask) in enumerate(zip(queries, masks)):
+            lexical, results[i] = self.search_lexical(query, mask)
+            lexicals.append(lexical)
+
+        todo = [i for i, result in enumerate(results) if result is None]
+        dense = self.dense.search_batch(
+            [queries[i] for i in todo], self.candidates,
+            masks=[masks[i] for i in todo]
+            )
+        for i, ids in zip(todo, dense):
+            results[i] = self.fuse(ids, lexicals[i])
+
+        return results
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None,
+                                metadata_filter=None):
+        mask = self.dense.filter_mask(metadata_filter)
+
+        return self.dense.store.get(self.search(query, mask=mask))
+
+    def retrieve_batch(self, queries: list,
+                       metadata_filters: list = None) -> list:
+        masks = self.dense.filter_masks(
+            metadata_filters or [None] * len(queries)
+            )
+
+        return [
+            self.dense.store.get(ids)
+            for ids in self.search_batch(queries, masks)
+        ]
+
+
+class CachedRetriever(FilteredRetriever):
+    """Ретривер с LRU-кэшем выдачи по нормализованному запросу
+    """
+    retriever: Any
+    cache: Any
+
+    @classmethod
+    def wrap(cls, retriever, capacity: int = 1024):
+        """Обёртка ретривера кэшем
+
+        Args:
+            retriever: Исходный ретривер
+            capacity (int): Максимальное количество запросов в кэше
+
+        Returns:
+            CachedRetriever: Ретривер с кэшем
+        """
+        return cls(
+            retriever=retriever,
+            cache=LRUCache(capacity=capacity, name="retriever")
+            )
+
+    def extract_filter(self, text: str):
+        extract = getattr(self.retriever, "extract_filter", None)
+
+        return extract(text) if extract else None
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None,
+                                metadata_filter=None):
+        key = (normalize_query(query), str(metadata_filter or ""))
+
+        documents = self.cache.get(key)
+        if documents is None:
+            kwargs = {"metadata_filter": metadata_filter} \
+                if metadata_filter else {}
+            documents = self.retriever.invoke(query, **kwargs)
+            self.cache.put(key, documents)
+
+        return list(documents)
+
+    def retrieve_batch(self, queries: list,
+                       metadata_filters: list = None) -> list:
+        """Выдача для списка запросов, исходный ретривер вызывается
+        одним батчем только для промахов кэша
+        """
+        metadata_filters = metadata_filters or [None] * len(queries)
+        keys = [
+            (normalize_query(query), str(f or ""))
+            for query, f in zip(queries, metadata_filters)
+        ]
+        results = [self.cache.get(key) for key in keys]
+
+        # Повторы одного запроса в батче ищутся один раз
+        missing = {}
+        for i, documents in enumerate(results):
+            if documents is None:
+                missing.setdefault(keys[i], i)
+
+        if missing:
+            rows = list(missing.values())
+            found = dict(zip(missing, self.fetch_batch(
+                [queries[i] for i in rows],
+                [metadata_filters[i] for i in rows]
+                )))
+            for key, documents in found.items():
+                self.cache.put(key, documents)
+            results = [
+                found[key] if documents is None else documents
+                for key, documents in zip(keys, results)
+            ]
+
+        return [list(documents) for documents in results]
+
+    def fetch_batch(self, queries: list, metadata_filters: list) -> list:
+        # Ретривер индекса старого формата ищет запросы по одному
+        if hasattr(self.retriever, "retrieve_batch"):
+            return self.retriever.retrieve_batch(queries, metadata_filters)
+
+        return [self.retriever.invoke(query) for query in queries]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def load_retriever(path_index: str, embeddings, k: int = 3,
+                   hybrid: bool = True, collapse_duplicates: bool = True):
+    """Загрузка ретривера из директории индекса
+
+    Args:
+        path_index (str): Директория индекса
+        embeddings: Модель эмбеддингов для запросов
+        k (int): Количество рецептов в выдаче
+        hybrid (bool): Использовать BM25 по ингредиентам вместе
+            с векторным поиском, если индекс ингредиентов собран
+        collapse_duplicates (bool): Оставлять в выдаче один рецепт
+            из группы почти дубликатов, если группы найдены при сборке
+
+    Returns:
+        BaseRetriever: Ретривер рецептов
+    """
+    index_config = load_index_config(path_index)
+    nprobe = int(os.environ.get("FAISS_NPROBE", 0)) \
+        or index_config.get("nprobe")
+    ef_search = int(os.environ.get("FAISS_EF_SEARCH", 0)) \
+        or index_config.get("ef_search")
+
+    # Индексы старого формата с pickle-докстором LangChain
+    if not os.path.exists(store_path(path_index)):
+        from langchain_community.vectorstores import FAISS
+
+        db = FAISS.load_local(
+            folder_path=path_index,
+            embeddings=embeddings,
+            allow_dangerous_deserialization=True
+        )
+        tune_index(db.index, nprobe=nprobe, ef_search=ef_search)
+
+        return db.as_retriever(
+            search_type="similarity",
+            search_kwargs={'k': k}
+        )
+
+    index = read_index(path_index)
+    tune_index(index, nprobe=nprobe, ef_search=ef_search)
+
+    store = RecipeStore(store_path(path_index))
+    retriever = RecipeRetriever(
+        index=index,
+        store=store,
+        embeddings=embeddings,
+        columns=MetadataColumns(path_index)
+        if MetadataColumns.exists(path_index) else None,
+        k=k,
+        collapse_duplicates=collapse_duplicates
+    )
+
+    if hybrid and store.has_lexical_index():
+        retriever = HybridRetriever(
+            dense=retriever,
+            lexical=BM25Searcher(store),
+            k=k
+        )
+
+    return retriever
@@ -0,0 +1,200 @@
+import io
+import os
+import asyncio
+import logging
+import threading
+
+import aiohttp
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+async def iter_file(audio_file, chunk_size: int = 2 ** 16):
+    """Чтение аудиофайла частями для потоковой загрузки
+
+    Args:
+        audio_file: Файлоподобный объект с аудио
+        chunk_size (int): Размер части в байтах
+
+    Yields:
+        bytes: Часть файла
+    """
+    while True:
+        chunk = audio_file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class UnclosableFile(io.IOBase):
+    """Обёртка файла, которую aiohttp не закрывает после отправки,
+    чтобы файл можно было отправить повторно
+    """
+    def __init__(self, file):
+        self.file = file
+        self.name = getattr(file, "name", None) or "audio.wav"
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def close(self):
+        pass
+
+
+class HFInferenceBackend:
+    """Распознавание речи через HuggingFace Inference API
+    """
+    def __init__(self, model: str = "openai/whisper-large-v3-turbo",
+                 token: str = None):
+        """Инициализация бэкенда
+
+        Args:
+            model (str): Модель на HuggingFace Hub
+            token (str): Токен HuggingFace, по умолчанию HF_TOKEN
+        """
+        self.url = "https://api-inference.huggingface.co/models/" + model
+        self.token = token or os.environ.get("HF_TOKEN")
+
+    def request(self, audio_file) -> dict:
+        """Параметры запроса для aiohttp
+
+        Returns:
+            dict: url, заголовки и тело запроса
+        """
+        return {
+            "url": self.url,
+            "headers": {"Authorization": f"Bearer {self.token}"},
+            "data": iter_file(audio_file)
+        }
+
+    def parse(self, response: dict) -> str:
+        return response["text"]
+
+
+class WhisperServerBackend:
+    """Распознавание речи через локальный сервер с API
+    /v1/audio/transcriptions, совместимым с OpenAI Whisper
+    """
+    def __init__(self, base_url: str = "http://localhost:8000",
+                 model: str = "whisper-1", language: str = "ru"):
+        """Инициализация бэкенда
+
+        Args:
+            base_url (str): Адрес сервера
+            model (str): Название модели на сервере
+            language (str): Язык аудио
+        """
+        self.url = base_url.rstrip("/") + "/v1/audio/transcriptions"
+        self.model = model
+        self.language = language
+
+    def request(self, audio_file) -> dict:
+        form = aiohttp.FormData()
+        form.add_field("model", self.model)
+        form.add_field("language", self.language)
+        # Файл отправляется частями, а не читается в память целиком
+        audio_file = UnclosableFile(audio_file)
+        form.add_field("file", audio_file, filename=audio_file.name)
+
+        return {"url": self.url, "data": form}
+
+    def parse(self, response: dict) -> str:
+        return response["text"]
+
+
+class SpeechClient:
+    """Клиент распознавания речи с постоянным пулом соединений
+
+    Клиент держит собственный цикл событий в фоновом потоке и одну
+    сессию aiohttp, поэтому соединения и TLS-рукопожатия
+    переиспользуются между запросами.
+    """
+    def __init__(self, backend=None, timeout: float = 30.0,
+                 connect_timeout: float = 5.0, retries: int = 2,
+                 backoff: float = 0.5, max_connections: int = 8):
+        """Инициализация клиента
+
+        Args:
+            backend: Бэкенд распознавания, по умолчанию HuggingFace
+            timeout (float): Таймаут запроса в секундах
+            connect_timeout (float): Таймаут соединения в секундах
+            retries (int): Количество повторов при сетевых ошибках
+                и ответах 429/5xx
+            backoff (float): Начальная задержка перед повтором
+            max_connections (int): Размер пула соединений
+        """
+        self.backend = backend or HFInferenceBackend()
+        self.retries = retries
+        self.backoff = backoff
+
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=connect_timeout
+            )
+        self.max_connections = max_connections
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever,
+            name="speech-client",
+            daemon=True
+            )
+        self._thread.start()
+
+        self.session = self._submit(self._create_session()).result()
+
+    async def _create_session(self):
+        return aiohttp.ClientSession(
+            timeout=self.timeout,
+            connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _post(self, audio_file) -> dict:
+        for attempt in range(self.retries + 1):
+            audio_file.seek(0)
+            try:
+                async with self.session.post(
+                    **self.backend.request(audio_file)
+                ) as response:
+                    if response.status not in RETRY_STATUSES \
+                            or attempt == self.retries:
+                        response.raise_for_status()
+                        return await response.json()
+                    logging.warning(f"Speech API status {response.status}")
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Speech API error: {e!r}")
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def transcribe(self, audio_file) -> dict:
+        """Распознавание речи
+
+        Args:
+            audio_file: Файлоподобный объект с аудио
+
+        Returns:
+            dict: Распознанный текст в ключе text
+        """
+        response = self._submit(self._post(audio_file)).result()
+
+        return {"text": self.backend.parse(response)}
+
+    async def atranscribe(self, audio_file) -> dict:
+        """Распознавание речи из другого цикла событий
+        """
+        response = await asyncio.wrap_future(
+            self._submit(self._post(audio_file))
+            )
+
+        return {"text": self.backend.parse(response)}
+
+    def close(self):
+        self._submit(self.session.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -1,11 +1,4 @@
-import os
 import re
-import requests
-import aiohttp
-import logging
-
-from PIL import Image
-from duckduckgo_search import DDGS
 
 
 def clean_input(input_string: str) -> str:
@@ -22,77 +15,32 @@ def clean_input(input_string: str) -> str:
     return clean_string
 
 
-def format_docs(docs) -> str:
-    """Форматирование документов в единную строку
+def docs_ids(docs) -> tuple:
+    """Идентификаторы документов ретривера
 
     Args:
         docs: Документы от ретривера
 
     Returns:
-        (str): Строка со всеми документами
+        tuple: id документов, для документов без id - ссылки на рецепт
     """
-    return "\n\n".join([d.page_content for d in docs])
+    return tuple(d.id or d.metadata.get('Ссылка') for d in docs)
 
 
-def format_docs_with_links(docs) -> str:
-    """Форматирование документов в единную строку и добвляет метаданные
+def serialize_docs(docs) -> list:
+    """Краткое описание найденных рецептов для JSON
 
     Args:
         docs: Документы от ретривера
 
     Returns:
-        (str): Строка со всеми документами
+        list: id, название и ссылка каждого рецепта
     """
-    def helper(d):
-        return f"{d.page_content}\nПодробнее:{d.metadata['Ссылка']}"
-
-    return "\n\n".join([helper(d) for d in docs])
-
-
-def search_image(dict_input: dict) -> dict:
-    """Поиск изображения по запросу
-
-    Args:
-        dict_input (dict): Входная цепочка
-
-    Returns:
-        dict: Цепочка с изображением и мета данными
-    """
-    img, image_link, url = None, None, None
-    try:
-        urls_images = DDGS().images(
-            keywords=dict_input["query"],
-            region='ru-ru',
-            safesearch='off',
-            type_image="photo",
-            max_results=1
-            )
-
-        image_link = urls_images[0]['image']
-        url = urls_images[0]['url'].rstrip("/")
-        img = Image.open(requests.get(image_link, stream=True).raw)
-    except Exception as e:
-        logging.error(e)
-
-    result_dict = {
-        "output": img,
-        "image": image_link,
-        "url": url,
-        "task": "Search Image"
+    return [
+        {
+            "id": doc.id,
+            "title": doc.metadata.get("Название"),
+            "link": doc.metadata.get("Ссылка")
         }
-
-    return result_dict
-
-
-async def spech2text(audio_file) -> dict:
-    API_URL = "https://api-inference.huggingface.co/models/openai/" + \
-        "whisper-large-v3-turbo"
-    headers = {"Authorization": f'Bearer {os.environ.get("HF_TOKEN")}'}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            API_URL,
-            headers=headers,
-            data=audio_file.read()
-        ) as response:
-            return await response.json()
+        for doc in docs
+    ]